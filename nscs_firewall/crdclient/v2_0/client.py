@@ -36,6 +36,9 @@ class Client(object):
     firewall_policy_path = "/fw/firewall_policies/%s"
     firewall_policy_insert_path = "/fw/firewall_policies/%s/insert_rule"
     firewall_policy_remove_path = "/fw/firewall_policies/%s/remove_rule"
+    firewall_policy_add_rules_path = "/fw/firewall_policies/%s/add_rules"
+    firewall_policy_remove_rules_path = "/fw/firewall_policies/%s/remove_rules"
+    firewall_policy_evaluate_path = "/fw/firewall_policies/%s/evaluate"
     firewalls_path = "/fw/firewalls"
     firewall_path = "/fw/firewalls/%s"
     fw_configs_path = "/fw/configs"
@@ -45,6 +48,25 @@ class Client(object):
                      'firewalls': 'firewall',
                      }
 
+    # Number of resources fetched per request by the iter_* calls
+    DEFAULT_PAGE_SIZE = 1000
+
+    def _iter_collection(self, collection, path, page_size, **_params):
+        """Yields the resources of a collection, one page at a time.
+
+        Each request asks for page_size resources following the last one
+        received, so the next page is only fetched once the caller has
+        consumed the current one.
+        """
+        params = dict(_params, limit=page_size)
+        while True:
+            resources = self.crdclient.get(path, params=params)[collection]
+            for resource in resources:
+                yield resource
+            if len(resources) < page_size:
+                break
+            params['marker'] = resources[-1]['id']
+
     ################################################################
     ##                FWaaS Service Management                    ##
     ################################################################
@@ -58,6 +80,12 @@ class Client(object):
         return self.crdclient.list('firewall_rules', self.firewall_rules_path,
                          retrieve_all, **_params)
 
+    @crd_client.APIParamsCall
+    def iter_firewall_rules(self, page_size=DEFAULT_PAGE_SIZE, **_params):
+        """Iterates over the firewall rules of a tenant, page by page."""
+        return self._iter_collection('firewall_rules', self.firewall_rules_path,
+                                     page_size, **_params)
+
     @crd_client.APIParamsCall
     def show_firewall_rule(self, firewall_rule, **_params):
         """Fetches information of a certain firewall rule."""
@@ -89,6 +117,12 @@ class Client(object):
         return self.crdclient.list('firewall_policies', self.firewall_policies_path,
                          retrieve_all, **_params)
 
+    @crd_client.APIParamsCall
+    def iter_firewall_policies(self, page_size=DEFAULT_PAGE_SIZE, **_params):
+        """Iterates over the firewall policies of a tenant, page by page."""
+        return self._iter_collection('firewall_policies', self.firewall_policies_path,
+                                     page_size, **_params)
+
     @crd_client.APIParamsCall
     def show_firewall_policy(self, firewall_policy, **_params):
         """Fetches information of a certain firewall policy."""
@@ -113,7 +147,7 @@ class Client(object):
 
     @crd_client.APIParamsCall
     def firewall_policy_insert_rule(self, firewall_policy, body=None):
-        """Inserts specified rule into firewall policy."""
+        """Inserts specified rule, or list of rules, into firewall policy."""
         return self.crdclient.put(self.firewall_policy_insert_path % (firewall_policy),
                         body=body)
 
@@ -123,6 +157,24 @@ class Client(object):
         return self.crdclient.put(self.firewall_policy_remove_path % (firewall_policy),
                         body=body)
 
+    @crd_client.APIParamsCall
+    def firewall_policy_add_rules(self, firewall_policy, body=None):
+        """Appends the specified rules to firewall policy."""
+        return self.crdclient.put(self.firewall_policy_add_rules_path % (firewall_policy),
+                        body=body)
+
+    @crd_client.APIParamsCall
+    def firewall_policy_remove_rules(self, firewall_policy, body=None):
+        """Removes the specified rules from firewall policy."""
+        return self.crdclient.put(self.firewall_policy_remove_rules_path % (firewall_policy),
+                        body=body)
+
+    @crd_client.APIParamsCall
+    def firewall_policy_evaluate(self, firewall_policy, body=None):
+        """Finds the rule of a firewall policy matching each packet."""
+        return self.crdclient.put(self.firewall_policy_evaluate_path % (firewall_policy),
+                        body=body)
+
     # Manage Firewalls
 
     @crd_client.APIParamsCall
@@ -132,6 +184,12 @@ class Client(object):
         return self.crdclient.list('firewalls', self.firewalls_path, retrieve_all,
                          **_params)
 
+    @crd_client.APIParamsCall
+    def iter_firewalls(self, page_size=DEFAULT_PAGE_SIZE, **_params):
+        """Iterates over the firewalls of a tenant, page by page."""
+        return self._iter_collection('firewalls', self.firewalls_path,
+                                     page_size, **_params)
+
     @crd_client.APIParamsCall
     def show_firewall(self, firewall, **_params):
         """Fetches information of a certain firewall."""
@@ -17,8 +17,13 @@
 #
 # @author: Sumit Naiksatam, sumitnaiksatam@gmail.com, Big Switch Networks, Inc.
 
+import bisect
+import datetime
+import socket
+
 import sqlalchemy as sa
-from sqlalchemy.ext.orderinglist import ordering_list
+from sqlalchemy import event
+from sqlalchemy.ext import declarative
 from sqlalchemy import orm
 from sqlalchemy.orm import exc
 
@@ -29,23 +34,166 @@ from nscs.crdservice import manager
 from nscs.crdservice.openstack.common import log as logging
 from nscs.crdservice.openstack.common import uuidutils
 from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins.common import rule_classifier
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
 
 
 LOG = logging.getLogger(__name__)
 
+# Rule positions are sparse ordering keys, spaced RULE_POSITION_GAP apart
+# when a policy is renumbered. The API presents dense 1-based positions.
+RULE_POSITION_GAP = 1024
+RULE_POSITION_MIN = -2 ** 31
+RULE_POSITION_MAX = 2 ** 31 - 1
+
+# The id of the single row of the config journal sequence.
+JOURNAL_SEQUENCE_ID = 1
+# Key of the session info holding the journal changes of the transaction.
+JOURNAL_SESSION_KEY = 'firewall_config_journal'
+
+
+def _spread_rule_positions(prev_key, next_key, count):
+    """
+    Return count ordering keys spread between two keys, either of which may
+    be None for an open end. Returns None if there is no room.
+    """
+    if prev_key is None and next_key is None:
+        prev_key = 0
+    if next_key is None:
+        next_key = prev_key + (count + 1) * RULE_POSITION_GAP
+    elif prev_key is None:
+        prev_key = next_key - (count + 1) * RULE_POSITION_GAP
+    step = (next_key - prev_key) // (count + 1)
+    if (step < 1 or prev_key < RULE_POSITION_MIN or
+            next_key > RULE_POSITION_MAX):
+        return None
+    return [prev_key + step * (index + 1) for index in range(count)]
+
+
+def _longest_common_subsequence(old_ids, new_ids):
+    """
+    Return the set of IDs of the longest subsequence common to two lists
+    of unique IDs. This is the longest increasing run of old indexes taken
+    in new order, found by patience sorting in O(n log n).
+    """
+    old_index = dict((item_id, index) for index, item_id in enumerate(old_ids))
+    tails = []
+    tail_ids = []
+    previous = {}
+    for item_id in new_ids:
+        if item_id not in old_index:
+            continue
+        index = old_index[item_id]
+        pile = bisect.bisect_left(tails, index)
+        previous[item_id] = tail_ids[pile - 1] if pile else None
+        if pile == len(tails):
+            tails.append(index)
+            tail_ids.append(item_id)
+        else:
+            tails[pile] = index
+            tail_ids[pile] = item_id
+    common = set()
+    item_id = tail_ids[-1] if tail_ids else None
+    while item_id is not None:
+        common.add(item_id)
+        item_id = previous[item_id]
+    return common
+
+
+def _ranges_after(columns, values, ascending):
+    """
+    Return the clauses selecting the rows that follow a marker row when
+    ordered by columns, given the marker's values and the direction of
+    each column. NULL sorts below any value, as on MySQL and SQLite.
+    Every clause holds the rows equal to the marker on the leading keys
+    and after it on the next key, which is a range of a matching index.
+    The ranges are returned in sort order, from the last key backwards.
+    """
+    ranges = []
+    equal = []
+    for column, value, asc in zip(columns, values, ascending):
+        if value is None:
+            after = column.isnot(None) if asc else None
+            same = column.is_(None)
+        else:
+            after = column > value if asc else sa.or_(column < value,
+                                                      column.is_(None))
+            same = column == value
+        if after is not None:
+            ranges.append(sa.and_(*(equal + [after])))
+        equal.append(same)
+    ranges.reverse()
+    return ranges
+
+
+def _pack_address(value):
+    """Encode an address as 16 big-endian bytes, IPv4 zero padded."""
+    return ('%032x' % value).decode('hex')
+
+
+def get_address_range(address, ip_version):
+    """Return the first and last address of an IP or CIDR, packed."""
+    start, end = rule_optimizer.parse_address(address, ip_version)
+    return _pack_address(start), _pack_address(end)
+
+
+def get_rule_match_values(rule):
+    """
+    Return the match columns derived from a rule: the first and last
+    address of its source and destination networks, a rule without an
+    address spanning its whole address family, and its IP protocol number,
+    None for any protocol.
+    """
+    ip_version = int(rule['ip_version'])
+    src_start, src_end = get_address_range(rule['source_ip_address'],
+                                           ip_version)
+    dst_start, dst_end = get_address_range(rule['destination_ip_address'],
+                                           ip_version)
+    return {'source_ip_start': src_start,
+            'source_ip_end': src_end,
+            'destination_ip_start': dst_start,
+            'destination_ip_end': dst_end,
+            'protocol_number': rule_optimizer.parse_protocol(
+                rule['protocol'])}
+
+
 class HasTenant(object):
     """Tenant mixin, add to subclasses that have a tenant."""
     # NOTE(jkoelker) tenant_id is just a free form string ;(
-    tenant_id = sa.Column(sa.String(255))
+    tenant_id = sa.Column(sa.String(255), index=True)
+
+
+class HasRevision(object):
+    """
+    Revision mixin. The revision is bumped by every ORM update of the row,
+    which only applies if the row is still at the revision it was read at.
+    """
+    revision_number = sa.Column(sa.BigInteger, nullable=False,
+                                server_default='0')
+
+    @declarative.declared_attr
+    def __mapper_args__(cls):
+        return {'version_id_col': cls.revision_number}
 
 
 class HasId(object):
     """id mixin, add to subclasses that have an id."""
     id = sa.Column(sa.String(36), primary_key=True, default=uuidutils.generate_uuid)
 
-class FirewallRule(model_base.BASEV2, HasId, HasTenant):
+class FirewallRule(model_base.BASEV2, HasId, HasTenant, HasRevision):
     """Represents a Firewall rule."""
     __tablename__ = 'firewall_rules'
+    # Rules are fetched and ordered per policy, the index also serves the
+    # lookups by policy alone. The address range indexes serve the
+    # containment filters of rule listings.
+    __table_args__ = (sa.Index('ix_firewall_rules_policy_position',
+                               'firewall_policy_id', 'position'),
+                      sa.Index('ix_firewall_rules_source_ip_range',
+                               'ip_version', 'source_ip_start',
+                               'source_ip_end'),
+                      sa.Index('ix_firewall_rules_destination_ip_range',
+                               'ip_version', 'destination_ip_start',
+                               'destination_ip_end'))
     name = sa.Column(sa.String(255))
     description = sa.Column(sa.String(1024))
     firewall_policy_id = sa.Column(sa.String(36),
@@ -63,9 +211,17 @@ class FirewallRule(model_base.BASEV2, HasId, HasTenant):
     action = sa.Column(sa.Enum('allow', 'deny', name='firewallrules_action'))
     enabled = sa.Column(sa.Boolean)
     position = sa.Column(sa.Integer)
+    # Derived from the columns above by get_rule_match_values(). Addresses
+    # are 16 bytes wide for both IP versions, so that they compare as
+    # numbers within an IP version.
+    source_ip_start = sa.Column(sa.BINARY(16))
+    source_ip_end = sa.Column(sa.BINARY(16))
+    destination_ip_start = sa.Column(sa.BINARY(16))
+    destination_ip_end = sa.Column(sa.BINARY(16))
+    protocol_number = sa.Column(sa.Integer)
 
 
-class Firewall(model_base.BASEV2, HasId, HasTenant):
+class Firewall(model_base.BASEV2, HasId, HasTenant, HasRevision):
     """Represents a Firewall resource."""
     __tablename__ = 'firewalls'
     name = sa.Column(sa.String(255))
@@ -75,11 +231,11 @@ class Firewall(model_base.BASEV2, HasId, HasTenant):
     status = sa.Column(sa.String(16))
     firewall_policy_id = sa.Column(sa.String(36),
                                    sa.ForeignKey('firewall_policies.id'),
-                                   nullable=True)
-    config_handle_id = sa.Column(sa.String(36), nullable=True)
+                                   nullable=True, index=True)
+    config_handle_id = sa.Column(sa.String(36), nullable=True, index=True)
 
 
-class FirewallPolicy(model_base.BASEV2, HasId, HasTenant):
+class FirewallPolicy(model_base.BASEV2, HasId, HasTenant, HasRevision):
     """Represents a Firewall Policy resource."""
     __tablename__ = 'firewall_policies'
     name = sa.Column(sa.String(255))
@@ -88,12 +244,140 @@ class FirewallPolicy(model_base.BASEV2, HasId, HasTenant):
     firewall_rules = orm.relationship(
         FirewallRule,
         backref=orm.backref('firewall_policies', cascade='all, delete'),
-        order_by='FirewallRule.position',
-        collection_class=ordering_list('position', count_from=1))
+        order_by='FirewallRule.position')
     audited = sa.Column(sa.Boolean)
     firewalls = orm.relationship(Firewall, backref='firewall_policies')
 
 
+class FirewallConfigJournal(model_base.BASEV2):
+    """Records a change to the configuration shipped for firewalls.
+
+    The id is the configuration version reached by the change, handed out
+    by FirewallConfigJournalSequence. Rule changes are recorded against the
+    policy, firewall changes against the firewall and the config handle it
+    is mapped to, and changes to a config handle against the handle alone.
+    """
+    __tablename__ = 'firewall_config_journal'
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    operation = sa.Column(sa.Enum(const.JOURNAL_ADD, const.JOURNAL_MODIFY,
+                                  const.JOURNAL_REMOVE, const.JOURNAL_REORDER,
+                                  const.JOURNAL_UPDATE, const.JOURNAL_RESYNC,
+                                  const.JOURNAL_DELETE,
+                                  name='firewall_config_journal_operation'),
+                          nullable=False)
+    firewall_policy_id = sa.Column(sa.String(36), nullable=True, index=True)
+    firewall_rule_id = sa.Column(sa.String(36), nullable=True)
+    firewall_id = sa.Column(sa.String(36), nullable=True)
+    config_handle_id = sa.Column(sa.String(36), nullable=True, index=True)
+
+
+class FirewallConfigJournalSequence(model_base.BASEV2):
+    """Holds the last id handed out to the config journal.
+
+    Every transaction writing to the journal updates the single row as its
+    last statement before commit, which keeps the row locked until the
+    commit only. Ids are thus handed out in commit order, unlike
+    autoincrement ids, which are taken at insert time: a consumer that read
+    a version cannot miss a change committed later with a lower id.
+    """
+    __tablename__ = 'firewall_config_journal_sequence'
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    last_id = sa.Column(sa.BigInteger, nullable=False)
+
+
+class FirewallHostPlacement(model_base.BASEV2):
+    """Records that the agent of a host runs a firewall.
+
+    Every agent reports the full set of firewalls it runs, reported_at
+    tells how current the placement is.
+    """
+    __tablename__ = 'firewall_host_placements'
+    firewall_id = sa.Column(sa.String(36),
+                            sa.ForeignKey('firewalls.id', ondelete='CASCADE'),
+                            primary_key=True)
+    host = sa.Column(sa.String(255), primary_key=True, index=True)
+    reported_at = sa.Column(sa.DateTime, nullable=False)
+
+
+def _next_journal_ids(session, count):
+    """
+    Return count new config journal ids, above the ids of every
+    transaction committed before this one.
+    """
+    table = FirewallConfigJournalSequence.__table__
+    result = session.execute(
+        table.update().where(table.c.id == JOURNAL_SEQUENCE_ID).values(
+            last_id=table.c.last_id + count))
+    if result.rowcount:
+        last_id = session.execute(
+            sa.select([table.c.last_id]).where(
+                table.c.id == JOURNAL_SEQUENCE_ID)).scalar()
+    else:
+        # The sequence is created by migration.upgrade(), this starts it in
+        # a database not upgraded yet.
+        last_id = (session.query(
+            sa.func.max(FirewallConfigJournal.id)).scalar() or 0) + count
+        session.execute(table.insert().values(id=JOURNAL_SEQUENCE_ID,
+                                              last_id=last_id))
+    return range(last_id - count + 1, last_id + 1)
+
+
+@event.listens_for(orm.Session, 'before_commit')
+def _write_config_journal(session):
+    """
+    Write the journal changes of a transaction about to commit. The other
+    changes are flushed first, so the sequence row is always the last row
+    a transaction locks and is held for the commit only: writers of
+    unrelated firewalls do not wait on each other, and lock the rows they
+    share before the sequence, in one order.
+    """
+    changes = session.info.pop(JOURNAL_SESSION_KEY, None)
+    if not changes:
+        return
+    session.flush()
+    table = FirewallConfigJournal.__table__
+    journal_ids = _next_journal_ids(session, len(changes))
+    # Every row of an executemany INSERT sets the same columns.
+    empty = dict.fromkeys(table.columns.keys())
+    session.execute(table.insert(),
+                    [dict(empty, id=journal_id, **change)
+                     for journal_id, change in zip(journal_ids, changes)])
+
+
+@event.listens_for(orm.Session, 'after_rollback')
+def _discard_config_journal(session):
+    session.info.pop(JOURNAL_SESSION_KEY, None)
+
+
+# Listings are ordered by these keys after the requested sort keys, so the
+# order is total and a page can resume after its last row. Rules are listed
+# policy by policy, in rule order.
+DEFAULT_SORT_KEYS = {FirewallRule: ('firewall_policy_id', 'position', 'id'),
+                     FirewallPolicy: ('id',),
+                     Firewall: ('id',)}
+
+# Columns read to build the API fields that are not a column of the same
+# name.
+FIELD_COLUMNS = {
+    FirewallRule: {'source_port': ('source_port_range_min',
+                                   'source_port_range_max'),
+                   'destination_port': ('destination_port_range_min',
+                                        'destination_port_range_max'),
+                   'position': ('firewall_policy_id', 'position')},
+    FirewallPolicy: {},
+    Firewall: {}}
+
+# Rule filters selecting the rules whose traffic includes the given
+# address or network, port or port range, or protocol, instead of the
+# rules storing exactly that value.
+RULE_CONTAINMENT_FILTERS = {
+    'contains_source_ip_address': 'source_ip',
+    'contains_destination_ip_address': 'destination_ip',
+    'contains_source_port': 'source_port_range',
+    'contains_destination_port': 'destination_port_range',
+    'contains_protocol': 'protocol_number'}
+
+
 class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
     """Mixin class for Firewall DB implementation."""
 
@@ -119,6 +403,43 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
         except exc.NoResultFound:
             raise firewall.FirewallRuleNotFound(firewall_rule_id=id)
 
+    def _check_revision(self, resource, db_obj, revision_number):
+        """
+        Raise FirewallRevisionMismatch if the request asks, If-Match style,
+        for a revision other than the one of the row.
+        """
+        if (revision_number is not None and
+                int(revision_number) != db_obj['revision_number']):
+            raise firewall.FirewallRevisionMismatch(
+                resource=resource, id=db_obj['id'],
+                expected=revision_number, current=db_obj['revision_number'])
+
+    def _flush_revisions(self, context, resource, id):
+        """
+        Flush the pending changes. Each updated row is compared and swapped
+        on the revision it was read at, a row found at another revision has
+        been changed by a concurrent request first.
+        """
+        try:
+            context.session.flush()
+        except exc.StaleDataError:
+            raise firewall.FirewallConcurrentUpdate(resource=resource, id=id)
+
+    def _get_firewall_policy_for_update(self, context, id,
+                                        revision_number=None):
+        fwp_db = self._get_firewall_policy(context, id)
+        self._check_revision('firewall_policy', fwp_db, revision_number)
+        return fwp_db
+
+    def _touch_firewall_policy(self, context, fwp_db):
+        """
+        Write the policy row, compare-and-swapping its revision. Changes to
+        the rule list of a policy are serialized this way, instead of by
+        locking the policy row for the whole request.
+        """
+        orm.attributes.flag_modified(fwp_db, 'audited')
+        self._flush_revisions(context, 'firewall_policy', fwp_db['id'])
+
     def _make_firewall_dict(self, fw, fields=None):
         res = {'id': fw['id'],
                'tenant_id': fw['tenant_id'],
@@ -128,28 +449,70 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
                'admin_state_up': fw['admin_state_up'],
                'status': fw['status'],
                'firewall_policy_id': fw['firewall_policy_id'],
-               'config_handle_id': fw['config_handle_id']}
+               'config_handle_id': fw['config_handle_id'],
+               'revision_number': fw['revision_number']}
         return self._fields(res, fields)
 
-    def _make_firewall_policy_dict(self, firewall_policy, fields=None):
-        fw_rules = [rule['id'] for rule in firewall_policy['firewall_rules']]
-        firewalls = [fw['id'] for fw in firewall_policy['firewalls']]
+    def _make_firewall_policy_dict(self, firewall_policy, fields=None,
+                                   rule_ids=None, firewall_ids=None):
+        # Callers listing policies pass the rule and firewall IDs read for
+        # all of them at once, otherwise they are read here.
+        if rule_ids is None and firewall_ids is None:
+            rule_ids, firewall_ids = self._get_policy_member_ids(
+                orm.object_session(firewall_policy), [firewall_policy['id']],
+                fields)
+            rule_ids = rule_ids[firewall_policy['id']]
+            firewall_ids = firewall_ids[firewall_policy['id']]
         res = {'id': firewall_policy['id'],
                'tenant_id': firewall_policy['tenant_id'],
                'name': firewall_policy['name'],
                'description': firewall_policy['description'],
                'shared': firewall_policy['shared'],
                'audited': firewall_policy['audited'],
-               'firewall_rules': fw_rules,
-               'firewall_list': firewalls}
+               'firewall_rules': rule_ids,
+               'firewall_list': firewall_ids,
+               'revision_number': firewall_policy['revision_number']}
         return self._fields(res, fields)
 
-    def _make_firewall_rule_dict(self, firewall_rule, fields=None):
-        position = None
+    def _get_policy_member_ids(self, session, firewall_policy_ids,
+                               fields=None):
+        """
+        Return the ordered rule IDs and the firewall IDs of the given
+        policies, as two dicts keyed by policy ID. They are read with one
+        query on the ID columns each instead of loading the related
+        objects, and not at all when fields leaves them out.
+        """
+        rule_ids = dict((policy_id, []) for policy_id in firewall_policy_ids)
+        firewall_ids = dict((policy_id, [])
+                            for policy_id in firewall_policy_ids)
+        if not firewall_policy_ids:
+            return rule_ids, firewall_ids
+        if not fields or 'firewall_rules' in fields:
+            query = session.query(FirewallRule.firewall_policy_id,
+                                  FirewallRule.id)
+            query = query.filter(
+                FirewallRule.firewall_policy_id.in_(firewall_policy_ids))
+            for policy_id, rule_id in query.order_by(
+                    FirewallRule.firewall_policy_id, FirewallRule.position):
+                rule_ids[policy_id].append(rule_id)
+        if not fields or 'firewall_list' in fields:
+            query = session.query(Firewall.firewall_policy_id, Firewall.id)
+            query = query.filter(
+                Firewall.firewall_policy_id.in_(firewall_policy_ids))
+            for policy_id, firewall_id in query:
+                firewall_ids[policy_id].append(firewall_id)
+        return rule_ids, firewall_ids
+
+    def _make_firewall_rule_dict(self, firewall_rule, fields=None,
+                                 position=None):
         # We return the position only if the firewall_rule is bound to a
-        # firewall_policy.
-        if firewall_rule['firewall_policy_id']:
-            position = firewall_rule['position']
+        # firewall_policy. Callers walking a policy in order pass the dense
+        # position, otherwise it is counted from the ordering keys.
+        if not firewall_rule['firewall_policy_id']:
+            position = None
+        elif position is None and (not fields or 'position' in fields):
+            position = self._get_rule_position(
+                orm.object_session(firewall_rule), firewall_rule)
         src_port_range = self._get_port_range_from_min_max_ports(
             firewall_rule['source_port_range_min'],
             firewall_rule['source_port_range_max'])
@@ -171,57 +534,685 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
                'destination_port': dst_port_range,
                'action': firewall_rule['action'],
                'position': position,
-               'enabled': firewall_rule['enabled']}
+               'enabled': firewall_rule['enabled'],
+               'revision_number': firewall_rule['revision_number']}
         return self._fields(res, fields)
 
+    def _get_firewall_with_rules_query(self, context, filters=None):
+        # The policy is joined to the firewalls and the ordered rules of all
+        # their policies are fetched by one more SELECT, so a firewall and
+        # its complete rule list take two SELECTs whatever the number of
+        # rules.
+        query = self._get_collection_query(context, Firewall, filters=filters)
+        return query.options(
+            orm.joinedload('firewall_policies').subqueryload('firewall_rules'))
+
+    def _make_firewall_with_rules_dict(self, firewall_db):
+        res = self._make_firewall_dict(firewall_db)
+        fwp_db = firewall_db.firewall_policies
+        if fwp_db:
+            res['firewall_rule_list'] = [
+                self._make_firewall_rule_dict(fwr_db, position=index + 1)
+                for index, fwr_db in enumerate(fwp_db.firewall_rules)]
+        else:
+            res['firewall_rule_list'] = []
+        return res
+
+    def get_firewall_with_rules(self, context, id):
+        LOG.debug(_("get_firewall_with_rules() called"))
+        query = self._get_firewall_with_rules_query(context,
+                                                    filters={'id': [id]})
+        try:
+            firewall_db = query.one()
+        except exc.NoResultFound:
+            raise firewall.FirewallNotFound(firewall_id=id)
+        return self._make_firewall_with_rules_dict(firewall_db)
+
+    def _get_field_columns(self, model, fields):
+        """
+        Return the names of the columns needed to build the given fields
+        of the API dict of a model, or None if all fields are needed.
+        """
+        if not fields:
+            return None
+        columns = set(['id'])
+        for field in fields:
+            if field in FIELD_COLUMNS[model]:
+                columns.update(FIELD_COLUMNS[model][field])
+            elif field in model.__table__.columns:
+                columns.add(field)
+        return sorted(columns)
+
+    def _get_resource(self, context, model, resource, id, fields=None):
+        """Return a row by id, selecting only the columns fields need."""
+        columns = self._get_field_columns(model, fields)
+        rows = None
+        if columns:
+            rows = self._get_collection_page(context, model, resource,
+                                             filters={'id': [id]},
+                                             columns=columns)
+        if not rows:
+            # Loads the full object, or raises the not found error.
+            return getattr(self, '_get_%s' % resource)(context, id)
+        return rows[0]
+
+    def _get_containment_clause(self, name, value):
+        column = RULE_CONTAINMENT_FILTERS[name]
+        try:
+            if column == 'protocol_number':
+                protocol = rule_optimizer.parse_protocol(value)
+                return sa.or_(FirewallRule.protocol_number.is_(None),
+                              FirewallRule.protocol_number == protocol)
+            if column.endswith('_port_range'):
+                min_port, max_port = rule_optimizer.parse_port_range(value)
+                port_min = getattr(FirewallRule, column + '_min')
+                port_max = getattr(FirewallRule, column + '_max')
+                # Rules without a port range match any port.
+                return sa.or_(port_min.is_(None),
+                              sa.and_(port_min <= min_port,
+                                      port_max >= max_port))
+            ip_version = 6 if ':' in value else 4
+            start, end = get_address_range(value, ip_version)
+        except (AttributeError, KeyError, TypeError, ValueError,
+                socket.error):
+            raise firewall.FirewallRuleFilterInvalid(filter=name, value=value)
+        return sa.and_(FirewallRule.ip_version == ip_version,
+                       getattr(FirewallRule, column + '_start') <= start,
+                       getattr(FirewallRule, column + '_end') >= end)
+
+    def _get_containment_clauses(self, model, filters):
+        """
+        Split the containment filters off the filters of a rule listing.
+        Returns the remaining filters and one clause per containment
+        filter, matching the rules holding any of its values. An address
+        or network is looked up as a range of an address range index.
+        """
+        if model is not FirewallRule or not filters:
+            return filters, []
+        filters = dict(filters)
+        clauses = []
+        for name in RULE_CONTAINMENT_FILTERS:
+            values = filters.pop(name, None)
+            if not values:
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            clauses.append(sa.or_(*[self._get_containment_clause(name, value)
+                                    for value in values]))
+        return filters, clauses
+
+    def _get_collection_page(self, context, model, resource, filters=None,
+                             sorts=None, limit=None, marker=None,
+                             page_reverse=False, columns=None):
+        """
+        Return the rows of one page of a listing, by keyset pagination.
+        Rows are ordered by the requested sort keys followed by the default
+        keys of the model, which end with the unique id. The page starts
+        after the marker row by comparing the sort keys with the marker's
+        values, so a deep page costs the same index range scan as the
+        first one instead of skipping every earlier row.
+        If columns are given, only those columns are selected, and every
+        row is returned as a dict holding all columns of the model, None
+        for the ones not selected.
+        """
+        keys = []
+        ascending = []
+        for key, asc in sorts or []:
+            if key not in model.__table__.columns:
+                raise firewall.FirewallSortKeyInvalid(sort_key=key)
+            if key not in keys:
+                keys.append(key)
+                ascending.append(asc)
+        for key in DEFAULT_SORT_KEYS[model]:
+            if 'id' in keys:
+                break
+            if key not in keys:
+                keys.append(key)
+                ascending.append(True)
+        if page_reverse:
+            ascending = [not asc for asc in ascending]
+        sort_columns = [getattr(model, key) for key in keys]
+        filters, clauses = self._get_containment_clauses(model, filters)
+        query = self._get_collection_query(context, model, filters=filters)
+        query = query.filter(*clauses)
+        if columns:
+            query = query.with_entities(*[getattr(model, column)
+                                          for column in columns])
+        query = query.order_by(*[column.asc() if asc else column.desc()
+                                 for column, asc in zip(sort_columns,
+                                                        ascending)])
+        if marker:
+            marker_obj = getattr(self, '_get_%s' % resource)(context, marker)
+            ranges = _ranges_after(sort_columns,
+                                   [marker_obj[key] for key in keys],
+                                   ascending)
+        else:
+            ranges = [None]
+        # The ranges are read one after another until the page is full,
+        # each one as an ordered index scan that stops at the limit.
+        rows = []
+        for clause in ranges:
+            range_query = query if clause is None else query.filter(clause)
+            if limit:
+                range_query = range_query.limit(limit - len(rows))
+            rows.extend(range_query)
+            if limit and len(rows) >= limit:
+                break
+        if page_reverse:
+            rows.reverse()
+        if columns:
+            empty = dict.fromkeys(model.__table__.columns.keys())
+            rows = [dict(empty, **row._asdict()) for row in rows]
+        return rows
+
+    def get_firewall_policy_rule_list(self, context, firewall_policy_id):
+        LOG.debug(_("get_firewall_policy_rule_list() called"))
+        query = self._model_query(context, FirewallRule)
+        query = query.filter_by(firewall_policy_id=firewall_policy_id)
+        return [self._make_firewall_rule_dict(fwr_db, position=index + 1)
+                for index, fwr_db in enumerate(
+                    query.order_by(FirewallRule.position))]
+
+    def get_firewall_policy_rule_ids(self, context, firewall_policy_id):
+        """Return the IDs of the rules of a policy, in order."""
+        query = context.session.query(FirewallRule.id)
+        query = query.filter_by(firewall_policy_id=firewall_policy_id)
+        return [rule_id for (rule_id,) in query.order_by(
+            FirewallRule.position)]
+
+    def _get_rule_position(self, session, firewall_rule_db):
+        """Return the dense 1-based position of a rule in its policy."""
+        query = session.query(sa.func.count(FirewallRule.id))
+        query = query.filter(FirewallRule.firewall_policy_id ==
+                             firewall_rule_db['firewall_policy_id'])
+        query = query.filter(FirewallRule.position <=
+                             firewall_rule_db['position'])
+        return query.scalar()
+
+    def _get_rule_positions(self, context, firewall_policy_ids):
+        """Map the rules of the given policies to their dense positions."""
+        positions = {}
+        if not firewall_policy_ids:
+            return positions
+        query = context.session.query(FirewallRule.id,
+                                      FirewallRule.firewall_policy_id)
+        query = query.filter(
+            FirewallRule.firewall_policy_id.in_(firewall_policy_ids))
+        counts = {}
+        for rule_id, policy_id in query.order_by(FirewallRule.position):
+            counts[policy_id] = counts.get(policy_id, 0) + 1
+            positions[rule_id] = counts[policy_id]
+        return positions
+
+    def _get_listed_rule_positions(self, context, firewall_rule_dbs):
+        """
+        Map the given rules to their dense positions. Only the ordering
+        keys between the first and last listed rule of each policy are
+        read, plus one count of the keys before them.
+        """
+        bounds = {}
+        for fwr_db in firewall_rule_dbs:
+            policy_id = fwr_db['firewall_policy_id']
+            if not policy_id:
+                continue
+            low, high = bounds.get(policy_id, (fwr_db['position'],
+                                               fwr_db['position']))
+            bounds[policy_id] = (min(low, fwr_db['position']),
+                                 max(high, fwr_db['position']))
+        positions = {}
+        for policy_id, (low, high) in bounds.items():
+            query = context.session.query(sa.func.count(FirewallRule.id))
+            position = query.filter(FirewallRule.firewall_policy_id ==
+                                    policy_id,
+                                    FirewallRule.position < low).scalar()
+            query = context.session.query(FirewallRule.id)
+            query = query.filter(FirewallRule.firewall_policy_id == policy_id,
+                                 FirewallRule.position.between(low, high))
+            for (rule_id,) in query.order_by(FirewallRule.position):
+                position += 1
+                positions[rule_id] = position
+        return positions
+
+    def _allocate_rule_positions(self, context, firewall_policy_id,
+                                 position, count=1):
+        """
+        Return ordering keys for count rules inserted at a dense position.
+        The keys are spread over the gap between the neighbouring rules, so
+        no other rule is touched. When the gap is too small, the policy is
+        renumbered first, and when this insert uses the gap up, the policy
+        is handed to _schedule_rule_rebalance.
+        """
+        query = context.session.query(FirewallRule.position)
+        query = query.filter_by(firewall_policy_id=firewall_policy_id)
+        keys = [row[0] for row in query.order_by(
+            FirewallRule.position).offset(max(position - 2, 0)).limit(2)]
+        if position <= 1:
+            prev_key, next_key = None, keys[0] if keys else None
+        elif keys:
+            prev_key, next_key = keys[0], keys[1] if len(keys) > 1 else None
+        else:
+            # Inserting past the end appends to the list.
+            prev_key = context.session.query(
+                sa.func.max(FirewallRule.position)).filter_by(
+                firewall_policy_id=firewall_policy_id).scalar()
+            next_key = None
+        new_keys = _spread_rule_positions(prev_key, next_key, count)
+        if new_keys is None:
+            self._rebalance_rule_positions(context, firewall_policy_id,
+                                           position, count)
+            return self._allocate_rule_positions(context, firewall_policy_id,
+                                                 position, count)
+        bounds = [key for key in [prev_key] + new_keys + [next_key]
+                  if key is not None]
+        if any(later - key < 2 for key, later in zip(bounds, bounds[1:])):
+            self._schedule_rule_rebalance(firewall_policy_id)
+        return new_keys
+
+    def _rebalance_rule_positions(self, context, firewall_policy_id,
+                                  position=None, count=0):
+        """
+        Renumber the rules of a policy RULE_POSITION_GAP apart, leaving
+        room for count rules at the given dense position. The order of the
+        rules does not change.
+        """
+        LOG.debug(_("Rebalancing positions of firewall policy %s"),
+                  firewall_policy_id)
+        query = context.session.query(FirewallRule.id)
+        query = query.filter_by(firewall_policy_id=firewall_policy_id)
+        rule_positions = []
+        for index, (rule_id,) in enumerate(
+                query.order_by(FirewallRule.position)):
+            rank = index + 1
+            if position and rank >= position:
+                rank += count
+            rule_positions.append((rule_id, firewall_policy_id,
+                                   firewall_policy_id,
+                                   rank * RULE_POSITION_GAP))
+        self._write_rule_positions(context, rule_positions)
+        # The rules keep their order, but their revisions moved and the
+        # configurations carrying them have to be compiled again.
+        self._journal_change(context, const.JOURNAL_REORDER,
+                             firewall_policy_id=firewall_policy_id)
+
+    def _write_rule_positions(self, context, rule_positions):
+        """
+        Bind rules to a policy at the given keys with one executemany
+        UPDATE for the rules read unbound and one for the others.
+        rule_positions holds (rule_id, old_policy_id, firewall_policy_id,
+        position) tuples, old_policy_id being the policy the rule was read
+        in and a firewall_policy_id of None unbinding the rule. Every row is
+        compared and swapped on the policy it was read in and gets its
+        revision bumped: a rule bound to another policy by a concurrent
+        request raises FirewallConcurrentUpdate instead of ending up in two
+        policies.
+        """
+        if not rule_positions:
+            return
+        # Rows are written in id order, so that concurrent writers of
+        # overlapping rules lock them in the same order.
+        rule_positions = sorted(rule_positions)
+        table = FirewallRule.__table__
+        update = table.update().values(
+            firewall_policy_id=sa.bindparam('rule_policy_id'),
+            position=sa.bindparam('rule_position'),
+            revision_number=table.c.revision_number + 1)
+        unbound = table.c.firewall_policy_id.is_(None)
+        bound = (table.c.firewall_policy_id ==
+                 sa.bindparam('rule_old_policy_id'))
+        with context.session.begin(subtransactions=True):
+            context.session.flush()
+            for condition in (unbound, bound):
+                rows = [row for row in rule_positions
+                        if (row[1] is None) == (condition is unbound)]
+                if not rows:
+                    continue
+                result = context.session.execute(
+                    update.where(sa.and_(table.c.id == sa.bindparam('rule_id'),
+                                         condition)),
+                    [{'rule_id': rule_id,
+                      'rule_old_policy_id': old_policy_id,
+                      'rule_policy_id': firewall_policy_id,
+                      'rule_position': position}
+                     for rule_id, old_policy_id, firewall_policy_id, position
+                     in rows])
+                if (result.supports_sane_multi_rowcount() and
+                        result.rowcount != len(rows)):
+                    raise firewall.FirewallConcurrentUpdate(
+                        resource='firewall_rule',
+                        id=self._find_moved_rule(context, rows))
+            # The rows were written behind the ORM's back.
+            identity_map = context.session.identity_map
+            for rule_position in rule_positions:
+                fwr_db = identity_map.get(
+                    orm.util.identity_key(FirewallRule, rule_position[0]))
+                if fwr_db is not None:
+                    context.session.expire(fwr_db, ['firewall_policy_id',
+                                                    'position',
+                                                    'revision_number'])
+            for obj in identity_map.values():
+                if isinstance(obj, FirewallPolicy):
+                    context.session.expire(obj, ['firewall_rules'])
+
+    def _find_moved_rule(self, context, rule_positions):
+        """
+        Return the ID of a rule of a failed _write_rule_positions() call
+        that did not end up in the policy it was written to.
+        """
+        query = context.session.query(FirewallRule.id,
+                                      FirewallRule.firewall_policy_id)
+        query = query.filter(FirewallRule.id.in_(
+            [row[0] for row in rule_positions]))
+        policy_ids = dict(query)
+        for rule_id, old_policy_id, firewall_policy_id, position in (
+                rule_positions):
+            if policy_ids.get(rule_id) != firewall_policy_id:
+                return rule_id
+        return rule_positions[0][0]
+
+    def _schedule_rule_rebalance(self, firewall_policy_id):
+        """
+        Hook for renumbering a policy whose gaps ran out off the request
+        path. Without it, the policy is renumbered by the insert that finds
+        no room left.
+        """
+        pass
+
+    def _journal_changes(self, context, changes):
+        """
+        Record changes, given as dicts of journal columns. They get their
+        ids and are written when the transaction commits.
+        """
+        if not changes:
+            return
+        with context.session.begin(subtransactions=True):
+            context.session.info.setdefault(JOURNAL_SESSION_KEY, []).extend(
+                dict(change) for change in changes)
+
+    def _journal_change(self, context, operation, firewall_policy_id=None,
+                        firewall_rule_id=None, firewall_id=None,
+                        config_handle_id=None):
+        self._journal_changes(context, [{
+            'operation': operation,
+            'firewall_policy_id': firewall_policy_id,
+            'firewall_rule_id': firewall_rule_id,
+            'firewall_id': firewall_id,
+            'config_handle_id': config_handle_id}])
+
+    def set_firewall_hosts(self, context, host, firewall_ids):
+        """
+        Replace the placements of a host by the firewalls its agent
+        reports, leaving out the firewalls that do not exist.
+        """
+        LOG.debug(_("set_firewall_hosts() called"))
+        reported_at = datetime.datetime.utcnow()
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(FirewallHostPlacement)
+            query.filter_by(host=host).delete(synchronize_session=False)
+            if not firewall_ids:
+                return
+            fw_query = context.session.query(Firewall.id)
+            fw_query = fw_query.filter(Firewall.id.in_(set(firewall_ids)))
+            rows = [{'firewall_id': firewall_id,
+                     'host': host,
+                     'reported_at': reported_at}
+                    for (firewall_id,) in fw_query]
+            if rows:
+                context.session.execute(
+                    FirewallHostPlacement.__table__.insert(), rows)
+
+    def get_firewall_hosts(self, context, firewall_ids, max_age=None):
+        """
+        Map firewall IDs to the sorted hosts running them. Placements not
+        reported again within max_age seconds are left out, as the agent
+        may be gone.
+        """
+        hosts = {}
+        if not firewall_ids:
+            return hosts
+        query = context.session.query(FirewallHostPlacement.firewall_id,
+                                      FirewallHostPlacement.host)
+        query = query.filter(
+            FirewallHostPlacement.firewall_id.in_(set(firewall_ids)))
+        if max_age:
+            query = query.filter(
+                FirewallHostPlacement.reported_at >=
+                datetime.datetime.utcnow() -
+                datetime.timedelta(seconds=max_age))
+        for firewall_id, host in query.order_by(FirewallHostPlacement.host):
+            hosts.setdefault(firewall_id, []).append(host)
+        return hosts
+
+    def get_config_journal_head(self, context):
+        query = context.session.query(sa.func.max(FirewallConfigJournal.id))
+        return query.scalar() or 0
+
+    def _prune_config_journal(self, context, journal_size):
+        # The newest entry is always kept so that the head version survives
+        # the pruning.
+        with context.session.begin(subtransactions=True):
+            head = self.get_config_journal_head(context)
+            query = context.session.query(FirewallConfigJournal)
+            query = query.filter(FirewallConfigJournal.id <=
+                                 head - max(journal_size, 1))
+            query.delete(synchronize_session=False)
+
+    def get_firewalls_delta(self, context, config_handle_id, from_version):
+        """Return the changes to a config handle since from_version.
+
+        Returns None if the journal no longer goes back to from_version, in
+        which case the caller has to send the full configuration.
+        """
+        LOG.debug(_("get_firewalls_delta() called"))
+        journal_query = context.session.query(FirewallConfigJournal)
+        oldest = journal_query.order_by(FirewallConfigJournal.id).first()
+        head = self.get_config_journal_head(context)
+        if from_version > head or (oldest and from_version < oldest.id - 1):
+            return None
+        fw_query = context.session.query(Firewall)
+        firewalls = fw_query.filter_by(config_handle_id=config_handle_id).all()
+        policy_ids = set(fw.firewall_policy_id for fw in firewalls
+                         if fw.firewall_policy_id)
+        condition = FirewallConfigJournal.config_handle_id == config_handle_id
+        if policy_ids:
+            condition = sa.or_(
+                condition,
+                FirewallConfigJournal.firewall_policy_id.in_(policy_ids))
+        journal_query = journal_query.filter(
+            FirewallConfigJournal.id > from_version).filter(condition)
+
+        updated_fw_ids = set()
+        resync_fw_ids = set()
+        deleted_fw_ids = set()
+        changed_policy_ids = set()
+        changed_rule_ids = set()
+        removed_rule_ids = {}
+        for entry in journal_query:
+            if entry.operation == const.JOURNAL_UPDATE:
+                updated_fw_ids.add(entry.firewall_id)
+            elif entry.operation == const.JOURNAL_RESYNC:
+                if entry.firewall_id:
+                    resync_fw_ids.add(entry.firewall_id)
+                else:
+                    # The config handle itself changed, all its firewalls
+                    # are sent again.
+                    resync_fw_ids.update(fw.id for fw in firewalls)
+            elif entry.operation == const.JOURNAL_DELETE:
+                deleted_fw_ids.add(entry.firewall_id)
+            else:
+                changed_policy_ids.add(entry.firewall_policy_id)
+                if entry.operation == const.JOURNAL_REMOVE:
+                    removed_rule_ids.setdefault(
+                        entry.firewall_policy_id,
+                        set()).add(entry.firewall_rule_id)
+                elif entry.firewall_rule_id:
+                    changed_rule_ids.add(entry.firewall_rule_id)
+
+        firewalls = [fw for fw in firewalls
+                     if fw.id in updated_fw_ids or fw.id in resync_fw_ids or
+                     fw.firewall_policy_id in changed_policy_ids]
+        resync_policy_ids = set(fw.firewall_policy_id for fw in firewalls
+                                if fw.id in resync_fw_ids)
+        # Only the IDs are loaded for the rule ordering, full rules are
+        # loaded for the added or modified rules and for firewalls that
+        # need a resync.
+        rule_ids = {}
+        positions = {}
+        rules = {}
+        policy_ids = set(fw.firewall_policy_id for fw in firewalls
+                         if fw.firewall_policy_id)
+        if policy_ids:
+            query = context.session.query(FirewallRule.id,
+                                          FirewallRule.firewall_policy_id)
+            query = query.filter(
+                FirewallRule.firewall_policy_id.in_(policy_ids))
+            for rule_id, policy_id in query.order_by(FirewallRule.position):
+                rule_ids.setdefault(policy_id, []).append(rule_id)
+                positions[rule_id] = len(rule_ids[policy_id])
+            conditions = []
+            if resync_policy_ids:
+                conditions.append(
+                    FirewallRule.firewall_policy_id.in_(resync_policy_ids))
+            if changed_rule_ids:
+                conditions.append(FirewallRule.id.in_(changed_rule_ids))
+            if conditions:
+                query = context.session.query(FirewallRule)
+                query = query.filter(sa.or_(*conditions))
+                rules = dict((fwr_db.id,
+                              self._make_firewall_rule_dict(
+                                  fwr_db, position=positions.get(fwr_db.id)))
+                             for fwr_db in query)
+
+        data = []
+        for fw in firewalls:
+            res = self._make_firewall_dict(fw)
+            fw_rule_ids = rule_ids.get(fw.firewall_policy_id, [])
+            res['firewall_rule_ids'] = fw_rule_ids
+            if fw.id in resync_fw_ids:
+                res['resync'] = True
+                res['firewall_rule_list'] = [rules[rule_id]
+                                             for rule_id in fw_rule_ids]
+                res['removed_firewall_rule_ids'] = []
+            else:
+                res['resync'] = False
+                res['firewall_rule_list'] = [rules[rule_id]
+                                             for rule_id in fw_rule_ids
+                                             if rule_id in rules]
+                removed = removed_rule_ids.get(fw.firewall_policy_id, set())
+                res['removed_firewall_rule_ids'] = list(
+                    removed - set(fw_rule_ids))
+            data.append(res)
+        current_fw_ids = set(fw.id for fw in fw_query.filter_by(
+            config_handle_id=config_handle_id))
+        return {'firewalls': data,
+                'removed_firewall_ids': list(deleted_fw_ids - current_fw_ids)}
+
     def _set_rules_for_policy(self, context, firewall_policy_db, rule_id_list):
         fwp_db = firewall_policy_db
         with context.session.begin(subtransactions=True):
-            if not rule_id_list:
-                fwp_db.firewall_rules = []
-                fwp_db.audited = False
-                return
-            # We will first check if the new list of rules is valid
-            filters = {'id': [r_id for r_id in rule_id_list]}
-            rules_in_db = self._get_collection_query(context, FirewallRule,
-                                                     filters=filters)
-            rules_dict = dict((fwr_db['id'], fwr_db) for fwr_db in rules_in_db)
-            for fwrule_id in rule_id_list:
-                if fwrule_id not in rules_dict:
-                    # If we find an invalid rule in the list we
-                    # do not perform the update since this breaks
-                    # the integrity of this list.
-                    raise firewall.FirewallRuleNotFound(firewall_rule_id=
-                                                        fwrule_id)
-                elif rules_dict[fwrule_id]['firewall_policy_id']:
-                    if (rules_dict[fwrule_id]['firewall_policy_id'] !=
-                            fwp_db['id']):
+            query = context.session.query(FirewallRule.id,
+                                          FirewallRule.position)
+            query = query.filter_by(firewall_policy_id=fwp_db['id'])
+            old_keys = dict(query)
+            old_rule_ids = sorted(old_keys, key=old_keys.get)
+            old_policy_ids = dict.fromkeys(old_keys, fwp_db['id'])
+            new_rule_ids = []
+            new_rule_id_set = set()
+            for fwrule_id in rule_id_list or []:
+                if fwrule_id not in new_rule_id_set:
+                    new_rule_ids.append(fwrule_id)
+                    new_rule_id_set.add(fwrule_id)
+            # We will first check if the rules added to the list are valid
+            added_rule_ids = [fwrule_id for fwrule_id in new_rule_ids
+                              if fwrule_id not in old_keys]
+            if added_rule_ids:
+                filters = {'id': added_rule_ids}
+                query = self._get_collection_query(context, FirewallRule,
+                                                   filters=filters)
+                rules_dict = dict(query.values(
+                    FirewallRule.id, FirewallRule.firewall_policy_id))
+                for fwrule_id in added_rule_ids:
+                    if fwrule_id not in rules_dict:
+                        # If we find an invalid rule in the list we
+                        # do not perform the update since this breaks
+                        # the integrity of this list.
+                        raise firewall.FirewallRuleNotFound(
+                            firewall_rule_id=fwrule_id)
+                    elif rules_dict[fwrule_id]:
                         raise firewall.FirewallRuleInUse(
                             firewall_rule_id=fwrule_id)
-            # New list of rules is valid so we will first reset the existing
-            # list and then add each rule in order.
+            self._journal_rules_for_policy(context, fwp_db['id'],
+                                           old_rule_ids, new_rule_ids)
+            # New list of rules is valid. The longest run of rules keeping
+            # their relative order keeps its keys, only the removed rules
+            # and the added or moved rules are written.
             # Note that the list could be empty in which case we interpret
             # it as clearing existing rules.
-            fwp_db.firewall_rules = []
-            for fwrule_id in rule_id_list:
-                fwp_db.firewall_rules.append(rules_dict[fwrule_id])
-            fwp_db.firewall_rules.reorder()
-            fwp_db.audited = False
+            removed = [(fwrule_id, fwp_db['id'], None, None)
+                       for fwrule_id in old_rule_ids
+                       if fwrule_id not in new_rule_id_set]
+            kept = _longest_common_subsequence(old_rule_ids, new_rule_ids)
+            placed = []
+            moved = []
+            prev_key = None
+            for fwrule_id in new_rule_ids + [None]:
+                if fwrule_id is not None and fwrule_id not in kept:
+                    moved.append(fwrule_id)
+                    continue
+                next_key = old_keys[fwrule_id] if fwrule_id else None
+                if moved:
+                    keys = _spread_rule_positions(prev_key, next_key,
+                                                  len(moved))
+                    if keys is None:
+                        # No room left between the kept rules, renumber
+                        # the whole list.
+                        placed = [(rule_id, old_policy_ids.get(rule_id),
+                                   fwp_db['id'],
+                                   (index + 1) * RULE_POSITION_GAP)
+                                  for index, rule_id in enumerate(
+                                      new_rule_ids)]
+                        break
+                    placed.extend((rule_id, old_policy_ids.get(rule_id),
+                                   fwp_db['id'], key)
+                                  for rule_id, key in zip(moved, keys))
+                    moved = []
+                prev_key = next_key
+            self._write_rule_positions(context, removed + placed)
+        # Set once the subtransaction has flushed, the policy row is then
+        # written by the caller along with its other changes, bumping its
+        # revision once per request.
+        fwp_db.audited = False
+
+    def _journal_rules_for_policy(self, context, firewall_policy_id,
+                                  old_rule_ids, new_rule_ids):
+        changes = [{'operation': const.JOURNAL_REMOVE,
+                    'firewall_policy_id': firewall_policy_id,
+                    'firewall_rule_id': rule_id}
+                   for rule_id in set(old_rule_ids) - set(new_rule_ids)]
+        changes.extend({'operation': const.JOURNAL_ADD,
+                        'firewall_policy_id': firewall_policy_id,
+                        'firewall_rule_id': rule_id}
+                       for rule_id in set(new_rule_ids) - set(old_rule_ids))
+        if old_rule_ids != new_rule_ids:
+            changes.append({'operation': const.JOURNAL_REORDER,
+                            'firewall_policy_id': firewall_policy_id})
+        self._journal_changes(context, changes)
 
-    def _process_rule_for_policy(self, context, firewall_policy_id,
-                                 firewall_rule_db, position):
+    def _remove_rule_from_policy(self, context, firewall_policy_id,
+                                 firewall_rule_db, revision_number=None):
         with context.session.begin(subtransactions=True):
-            fwp_query = context.session.query(
-                FirewallPolicy).with_lockmode('update')
-            fwp_db = fwp_query.filter_by(id=firewall_policy_id).one()
-            if position:
-                # Note that although position numbering starts at 1,
-                # internal ordering of the list starts at 0, so we compensate.
-                fwp_db.firewall_rules.insert(position - 1, firewall_rule_db)
-            else:
-                fwp_db.firewall_rules.remove(firewall_rule_db)
-            fwp_db.firewall_rules.reorder()
+            fwp_db = self._get_firewall_policy_for_update(
+                context, firewall_policy_id, revision_number)
+            # Only the removed rule is written, the positions of the other
+            # rules of the policy are left alone. Inserts go through
+            # _insert_rules_for_policy.
+            firewall_rule_db.firewall_policy_id = None
+            firewall_rule_db.position = None
+            context.session.expire(fwp_db, ['firewall_rules'])
+            self._journal_change(context, const.JOURNAL_REMOVE,
+                                 firewall_policy_id=firewall_policy_id,
+                                 firewall_rule_id=firewall_rule_db['id'])
             fwp_db.audited = False
+            self._touch_firewall_policy(context, fwp_db)
         return self._make_firewall_policy_dict(fwp_db)
 
     def _get_min_max_ports_from_range(self, port_range):
@@ -259,38 +1250,96 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
                                    admin_state_up=fw['admin_state_up'],
                                    status=const.PENDING_CREATE)
             context.session.add(firewall_db)
+            self._journal_change(context, const.JOURNAL_RESYNC,
+                                 firewall_id=fw_id)
         return self._make_firewall_dict(firewall_db)
 
     def update_firewall(self, context, id, firewall):
         LOG.debug(_("update_firewall() called"))
         fw = firewall['firewall']
+        revision_number = fw.pop('revision_number', None)
         with context.session.begin(subtransactions=True):
-            fw_query = context.session.query(
-                Firewall).with_lockmode('update')
-            firewall_db = fw_query.filter_by(id=id).one()
+            firewall_db = self._get_firewall(context, id)
+            self._check_revision('firewall', firewall_db, revision_number)
+            old_config_handle_id = firewall_db.config_handle_id
+            old_policy_id = firewall_db.firewall_policy_id
             firewall_db.update(fw)
+            self._journal_firewall_update(context, firewall_db,
+                                          old_config_handle_id, old_policy_id)
+            self._flush_revisions(context, 'firewall', id)
         return self._make_firewall_dict(firewall_db)
 
+    def _journal_firewall_update(self, context, firewall_db,
+                                 old_config_handle_id, old_policy_id):
+        if firewall_db.config_handle_id != old_config_handle_id:
+            self._journal_change(context, const.JOURNAL_DELETE,
+                                 firewall_id=firewall_db.id,
+                                 config_handle_id=old_config_handle_id)
+            operation = const.JOURNAL_RESYNC
+        elif firewall_db.firewall_policy_id != old_policy_id:
+            operation = const.JOURNAL_RESYNC
+        else:
+            operation = const.JOURNAL_UPDATE
+        self._journal_change(context, operation, firewall_id=firewall_db.id,
+                             config_handle_id=firewall_db.config_handle_id)
+
     def delete_firewall(self, context, id):
         LOG.debug(_("delete_firewall() called"))
         with context.session.begin(subtransactions=True):
-            fw_query = context.session.query(
-                Firewall).with_lockmode('update')
-            firewall_db = fw_query.filter_by(id=id).one()
+            firewall_db = self._get_firewall(context, id)
             # Note: Plugin should ensure that it's okay to delete if the
             # firewall is active
+            self._journal_change(context, const.JOURNAL_DELETE,
+                                 firewall_id=id,
+                                 config_handle_id=firewall_db.config_handle_id)
+            query = context.session.query(FirewallHostPlacement)
+            query.filter_by(firewall_id=id).delete(synchronize_session=False)
             context.session.delete(firewall_db)
+            self._flush_revisions(context, 'firewall', id)
+
+    def _update_firewalls_status(self, context, firewall_ids, status,
+                                 version=None):
+        # A firewall being deleted keeps its PENDING_DELETE status until
+        # the backend delete completes. The status follows the pushes of the
+        # configuration, so it is not journaled and leaves the config version
+        # as it is. Compiled configs are cached for the statuses they carry.
+        # Given the config version that was pushed, firewalls changed after
+        # it keep their status for the push carrying the change.
+        with context.session.begin(subtransactions=True):
+            query = context.session.query(Firewall)
+            query = query.filter(Firewall.id.in_(firewall_ids))
+            query = query.filter(Firewall.status != const.PENDING_DELETE)
+            if version is not None:
+                journal_query = context.session.query(
+                    FirewallConfigJournal.id)
+                oldest = journal_query.order_by(
+                    FirewallConfigJournal.id).first()
+                if oldest and version < oldest.id - 1:
+                    # The changes after the version are pruned.
+                    return
+                changed = journal_query.filter(
+                    FirewallConfigJournal.id > version).filter(sa.or_(
+                        FirewallConfigJournal.firewall_id == Firewall.id,
+                        FirewallConfigJournal.firewall_policy_id ==
+                        Firewall.firewall_policy_id,
+                        sa.and_(FirewallConfigJournal.config_handle_id ==
+                                Firewall.config_handle_id,
+                                FirewallConfigJournal.firewall_id.is_(None))))
+                query = query.filter(~changed.exists())
+            query.update({'status': status}, synchronize_session=False)
 
     def get_firewall(self, context, id, fields=None):
         LOG.debug(_("get_firewall() called"))
-        fw = self._get_firewall(context, id)
+        fw = self._get_resource(context, Firewall, 'firewall', id, fields)
         return self._make_firewall_dict(fw, fields)
 
-    def get_firewalls(self, context, filters=None, fields=None):
+    def get_firewalls(self, context, filters=None, fields=None, sorts=None,
+                      limit=None, marker=None, page_reverse=False):
         LOG.debug(_("get_firewalls() called"))
-        return self._get_collection(context, Firewall,
-                                    self._make_firewall_dict,
-                                    filters=filters, fields=fields)
+        fw_dbs = self._get_collection_page(
+            context, Firewall, 'firewall', filters, sorts, limit, marker,
+            page_reverse, self._get_field_columns(Firewall, fields))
+        return [self._make_firewall_dict(fw_db, fields) for fw_db in fw_dbs]
 
     def get_firewalls_count(self, context, filters=None):
         LOG.debug(_("get_firewalls_count() called"))
@@ -321,13 +1370,16 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
     def update_firewall_policy(self, context, id, firewall_policy):
         LOG.debug(_("update_firewall_policy() called"))
         fwp = firewall_policy['firewall_policy']
+        revision_number = fwp.pop('revision_number', None)
         with context.session.begin(subtransactions=True):
-            fwp_db = self._get_firewall_policy(context, id)
+            fwp_db = self._get_firewall_policy_for_update(context, id,
+                                                          revision_number)
             if 'firewall_rules' in fwp:
                 self._set_rules_for_policy(context, fwp_db,
                                            fwp['firewall_rules'])
                 del fwp['firewall_rules']
             fwp_db.update(fwp)
+            self._touch_firewall_policy(context, fwp_db)
         return self._make_firewall_policy_dict(fwp_db)
 
     def delete_firewall_policy(self, context, id):
@@ -344,52 +1396,143 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
 
     def get_firewall_policy(self, context, id, fields=None):
         LOG.debug(_("get_firewall_policy() called"))
-        fwp = self._get_firewall_policy(context, id)
-        return self._make_firewall_policy_dict(fwp, fields)
+        fwp = self._get_resource(context, FirewallPolicy, 'firewall_policy',
+                                 id, fields)
+        rule_ids, firewall_ids = self._get_policy_member_ids(
+            context.session, [id], fields)
+        return self._make_firewall_policy_dict(fwp, fields, rule_ids[id],
+                                               firewall_ids[id])
 
-    def get_firewall_policies(self, context, filters=None, fields=None):
+    def get_firewall_policies(self, context, filters=None, fields=None,
+                              sorts=None, limit=None, marker=None,
+                              page_reverse=False):
         LOG.debug(_("get_firewall_policies() called"))
-        return self._get_collection(context, FirewallPolicy,
-                                    self._make_firewall_policy_dict,
-                                    filters=filters, fields=fields)
+        fwp_dbs = self._get_collection_page(
+            context, FirewallPolicy, 'firewall_policy', filters, sorts, limit,
+            marker, page_reverse,
+            self._get_field_columns(FirewallPolicy, fields))
+        rule_ids, firewall_ids = self._get_policy_member_ids(
+            context.session, [fwp_db['id'] for fwp_db in fwp_dbs], fields)
+        return [self._make_firewall_policy_dict(fwp_db, fields,
+                                                rule_ids[fwp_db['id']],
+                                                firewall_ids[fwp_db['id']])
+                for fwp_db in fwp_dbs]
 
     def get_firewalls_policies_count(self, context, filters=None):
         LOG.debug(_("get_firewall_policies_count() called"))
         return self._get_collection_count(context, FirewallPolicy,
                                           filters=filters)
 
-    def create_firewall_rule(self, context, firewall_rule):
-        LOG.debug(_("create_firewall_rule() called"))
-        fwr = firewall_rule['firewall_rule']
+    def _get_firewall_rule_values(self, context, fwr):
         tenant_id = self._get_tenant_id_for_create(context, fwr)
         src_port_min, src_port_max = self._get_min_max_ports_from_range(
             fwr['source_port'])
         dst_port_min, dst_port_max = self._get_min_max_ports_from_range(
             fwr['destination_port'])
+        rule_id = ''
+        if 'id' in fwr:
+            rule_id = fwr['id']
+        else:
+            rule_id = uuidutils.generate_uuid()
+        values = {'id': rule_id,
+                  'tenant_id': tenant_id,
+                  'name': fwr['name'],
+                  'description': fwr['description'],
+                  'firewall_policy_id': None,
+                  'shared': fwr['shared'],
+                  'protocol': fwr['protocol'],
+                  'ip_version': fwr['ip_version'],
+                  'source_ip_address': fwr['source_ip_address'],
+                  'destination_ip_address': fwr['destination_ip_address'],
+                  'source_port_range_min': src_port_min,
+                  'source_port_range_max': src_port_max,
+                  'destination_port_range_min': dst_port_min,
+                  'destination_port_range_max': dst_port_max,
+                  'action': fwr['action'],
+                  'position': None,
+                  'enabled': fwr['enabled'],
+                  'revision_number': 1}
+        values.update(self._get_rule_match_values(values))
+        return values
+
+    def create_firewall_rule(self, context, firewall_rule):
+        LOG.debug(_("create_firewall_rule() called"))
+        return self.create_firewall_rule_bulk(
+            context, {'firewall_rules': [firewall_rule]})[0]
+
+    def _get_rule_insert_index(self, position):
+        """Return the list index of a dense 1-based rule position."""
+        try:
+            index = int(position)
+        except (TypeError, ValueError):
+            raise firewall.FirewallRulePositionInvalid(position=position)
+        if index < 1 or (index != position and str(index) != position):
+            raise firewall.FirewallRulePositionInvalid(position=position)
+        return index - 1
+
+    def create_firewall_rule_bulk(self, context, firewall_rules):
+        """
+        Create a list of rules with a single executemany INSERT.
+        Rules naming a firewall_policy_id are attached to that policy, at
+        their dense position if one is given and at the end otherwise,
+        with one ordering update per policy, as create_firewall_rule does
+        for a single rule. The request body has been validated item by
+        item by the API layer.
+        """
+        LOG.debug(_("create_firewall_rule_bulk() called"))
+        fwrs = [item['firewall_rule']
+                for item in firewall_rules['firewall_rules']]
+        insert_indexes = [None if fwr.get('position') is None else
+                          self._get_rule_insert_index(fwr['position'])
+                          for fwr in fwrs]
         with context.session.begin(subtransactions=True):
-            rule_id = ''
-            if 'id' in fwr:
-                rule_id = fwr['id']
-            else:
-                rule_id = uuidutils.generate_uuid()
-            fwr_db = FirewallRule(id=rule_id,
-                                  tenant_id=tenant_id,
-                                  name=fwr['name'],
-                                  description=fwr['description'],
-                                  shared=fwr['shared'],
-                                  protocol=fwr['protocol'],
-                                  ip_version=fwr['ip_version'],
-                                  source_ip_address=fwr['source_ip_address'],
-                                  destination_ip_address=
-                                  fwr['destination_ip_address'],
-                                  source_port_range_min=src_port_min,
-                                  source_port_range_max=src_port_max,
-                                  destination_port_range_min=dst_port_min,
-                                  destination_port_range_max=dst_port_max,
-                                  action=fwr['action'],
-                                  enabled=fwr['enabled'])
-            context.session.add(fwr_db)
-        return self._make_firewall_rule_dict(fwr_db)
+            rows = [self._get_firewall_rule_values(context, fwr)
+                    for fwr in fwrs]
+            if rows:
+                context.session.execute(FirewallRule.__table__.insert(),
+                                        rows)
+            policy_rule_ids = {}
+            for fwr, row, index in zip(fwrs, rows, insert_indexes):
+                firewall_policy_id = fwr.get('firewall_policy_id')
+                if not firewall_policy_id:
+                    continue
+                if firewall_policy_id not in policy_rule_ids:
+                    self._get_firewall_policy(context, firewall_policy_id)
+                    policy_rule_ids[firewall_policy_id] = (
+                        self.get_firewall_policy_rule_ids(
+                            context, firewall_policy_id))
+                rule_ids = policy_rule_ids[firewall_policy_id]
+                if index is None:
+                    rule_ids.append(row['id'])
+                else:
+                    # A position past the end appends to the list.
+                    rule_ids.insert(index, row['id'])
+            for firewall_policy_id, rule_ids in policy_rule_ids.items():
+                fwp_db = self._get_firewall_policy(context,
+                                                   firewall_policy_id)
+                self._set_rules_for_policy(context, fwp_db, rule_ids)
+                self._touch_firewall_policy(context, fwp_db)
+            if policy_rule_ids:
+                # Binding the rules to their policies bumped their
+                # revisions, the response carries the written ones.
+                query = context.session.query(FirewallRule.id,
+                                              FirewallRule.revision_number)
+                rows_by_id = dict((row['id'], row)
+                                  for fwr, row in zip(fwrs, rows)
+                                  if fwr.get('firewall_policy_id'))
+                query = query.filter(FirewallRule.id.in_(rows_by_id.keys()))
+                for rule_id, revision_number in query:
+                    rows_by_id[rule_id]['revision_number'] = revision_number
+        positions = {}
+        for firewall_policy_id, rule_ids in policy_rule_ids.items():
+            for index, rule_id in enumerate(rule_ids):
+                positions[rule_id] = (firewall_policy_id, index + 1)
+        res = []
+        for row in rows:
+            row['firewall_policy_id'], position = positions.get(row['id'],
+                                                                (None, None))
+            res.append(self._make_firewall_rule_dict(row, position=position))
+        return res
 
     def update_firewall_rule(self, context, id, firewall_rule):
         LOG.debug(_("update_firewall_rule() called"))
@@ -406,13 +1549,25 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
             fwr['destination_port_range_min'] = dst_port_min
             fwr['destination_port_range_max'] = dst_port_max
             del fwr['destination_port']
+        # Positions are ordering keys managed by insert_rule and remove_rule.
+        fwr.pop('position', None)
+        revision_number = fwr.pop('revision_number', None)
         with context.session.begin(subtransactions=True):
             fwr_db = self._get_firewall_rule(context, id)
+            self._check_revision('firewall_rule', fwr_db, revision_number)
             fwr_db.update(fwr)
+            fwr_db.update(self._get_rule_match_values(fwr_db))
+            self._flush_revisions(context, 'firewall_rule', id)
             if fwr_db.firewall_policy_id:
+                self._journal_change(context, const.JOURNAL_MODIFY,
+                                     firewall_policy_id=
+                                     fwr_db.firewall_policy_id,
+                                     firewall_rule_id=id)
                 fwp_db = self._get_firewall_policy(context,
                                                    fwr_db.firewall_policy_id)
                 fwp_db.audited = False
+                self._flush_revisions(context, 'firewall_policy',
+                                      fwp_db['id'])
         return self._make_firewall_rule_dict(fwr_db)
 
     def delete_firewall_rule(self, context, id):
@@ -422,34 +1577,123 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
             if fwr.firewall_policy_id:
                 raise firewall.FirewallRuleInUse(firewall_rule_id=id)
             context.session.delete(fwr)
+            self._flush_revisions(context, 'firewall_rule', id)
 
     def get_firewall_rule(self, context, id, fields=None):
         LOG.debug(_("get_firewall_rule() called"))
-        fwr = self._get_firewall_rule(context, id)
-        return self._make_firewall_rule_dict(fwr, fields)
+        fwr = self._get_resource(context, FirewallRule, 'firewall_rule', id,
+                                 fields)
+        position = None
+        if fwr['firewall_policy_id'] and (not fields or 'position' in fields):
+            position = self._get_rule_position(context.session, fwr)
+        return self._make_firewall_rule_dict(fwr, fields, position)
 
-    def get_firewall_rules(self, context, filters=None, fields=None):
+    def get_firewall_rules(self, context, filters=None, fields=None,
+                           sorts=None, limit=None, marker=None,
+                           page_reverse=False):
         LOG.debug(_("get_firewall_rules() called"))
-        return self._get_collection(context, FirewallRule,
-                                    self._make_firewall_rule_dict,
-                                    filters=filters, fields=fields)
+        fwr_dbs = self._get_collection_page(
+            context, FirewallRule, 'firewall_rule', filters, sorts, limit,
+            marker, page_reverse,
+            self._get_field_columns(FirewallRule, fields))
+        if fields and 'position' not in fields:
+            positions = {}
+        elif limit:
+            # A page only counts the span of each policy it lists.
+            positions = self._get_listed_rule_positions(context, fwr_dbs)
+        else:
+            # The dense positions of all listed rules are counted in one
+            # query.
+            positions = self._get_rule_positions(
+                context, set(fwr_db['firewall_policy_id']
+                             for fwr_db in fwr_dbs
+                             if fwr_db['firewall_policy_id']))
+        return [self._make_firewall_rule_dict(fwr_db, fields,
+                                              positions.get(fwr_db['id']))
+                for fwr_db in fwr_dbs]
 
     def get_firewalls_rules_count(self, context, filters=None):
         LOG.debug(_("get_firewall_rules_count() called"))
-        return self._get_collection_count(context, FirewallRule,
-                                          filters=filters)
+        filters, clauses = self._get_containment_clauses(FirewallRule,
+                                                         filters)
+        query = self._get_collection_query(context, FirewallRule,
+                                           filters=filters)
+        return query.filter(*clauses).count()
+
+    def _get_rule_match_values(self, fwr):
+        try:
+            return get_rule_match_values(fwr)
+        except (KeyError, TypeError, ValueError, socket.error):
+            raise firewall.FirewallRuleInvalidMatch(
+                ip_version=fwr['ip_version'],
+                source_ip_address=fwr['source_ip_address'],
+                destination_ip_address=fwr['destination_ip_address'],
+                protocol=fwr['protocol'])
 
     def _validate_insert_remove_rule_request(self, id, rule_info):
         if not rule_info or 'firewall_rule_id' not in rule_info:
             raise firewall.FirewallRuleInfoMissing()
 
+    def _insert_rules_for_policy(self, context, firewall_policy_id,
+                                 firewall_rule_dbs, ref_firewall_rule_db,
+                                 insert_before, revision_number=None):
+        with context.session.begin(subtransactions=True):
+            fwp_db = self._get_firewall_policy_for_update(
+                context, firewall_policy_id, revision_number)
+            if ref_firewall_rule_db:
+                # If reference_firewall_rule_id is set, the new rules
+                # are inserted depending on the value of insert_before.
+                # If insert_before is set, the new rules are inserted before
+                # reference_firewall_rule_id, and if it is not set the new
+                # rules are inserted after reference_firewall_rule_id.
+                if (ref_firewall_rule_db.firewall_policy_id !=
+                        firewall_policy_id):
+                    raise firewall.FirewallRuleNotAssociatedWithPolicy(
+                        firewall_rule_id=ref_firewall_rule_db['id'],
+                        firewall_policy_id=firewall_policy_id)
+                position = self._get_rule_position(context.session,
+                                                   ref_firewall_rule_db)
+                if not insert_before:
+                    position += 1
+            else:
+                # If reference_firewall_rule_id is not set, it is assumed
+                # that the new rules need to be inserted at the top.
+                # insert_before field is ignored.
+                # So default insertion is always at the top.
+                # Also note that position numbering starts at 1.
+                position = 1
+            # The whole block gets its keys in one go, in the given order,
+            # and no other rule of the policy is written.
+            keys = self._allocate_rule_positions(
+                context, firewall_policy_id, position, len(firewall_rule_dbs))
+            self._write_rule_positions(
+                context, [(fwr_db['id'], None, firewall_policy_id, key)
+                          for fwr_db, key in zip(firewall_rule_dbs, keys)])
+            self._journal_changes(context, [
+                {'operation': const.JOURNAL_ADD,
+                 'firewall_policy_id': firewall_policy_id,
+                 'firewall_rule_id': fwr_db['id']}
+                for fwr_db in firewall_rule_dbs])
+            fwp_db.audited = False
+            self._touch_firewall_policy(context, fwp_db)
+        return self._make_firewall_policy_dict(fwp_db)
+
     def insert_rule(self, context, id, rule_info):
+        """
+        Insert a rule, or an ordered list of rules given as
+        firewall_rule_ids, into a policy as one block.
+        """
         LOG.debug(_("insert_rule() called"))
-        self._validate_insert_remove_rule_request(id, rule_info)
-        firewall_rule_id = rule_info['firewall_rule_id']
+        if rule_info and 'firewall_rule_ids' in rule_info:
+            firewall_rule_ids = rule_info['firewall_rule_ids']
+            if not isinstance(firewall_rule_ids, list):
+                raise firewall.FirewallRuleInfoMissing()
+        else:
+            self._validate_insert_remove_rule_request(id, rule_info)
+            firewall_rule_ids = [rule_info['firewall_rule_id']]
         insert_before = True
         ref_firewall_rule_id = None
-        if not firewall_rule_id:
+        if not firewall_rule_ids or not all(firewall_rule_ids):
             raise firewall.FirewallRuleNotFound(firewall_rule_id=None)
         if 'insert_before' in rule_info:
             ref_firewall_rule_id = rule_info['insert_before']
@@ -458,30 +1702,32 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
             ref_firewall_rule_id = rule_info['insert_after']
             insert_before = False
         with context.session.begin(subtransactions=True):
-            fwr_db = self._get_firewall_rule(context, firewall_rule_id)
-            if fwr_db.firewall_policy_id:
-                raise firewall.FirewallRuleInUse(firewall_rule_id=fwr_db['id'])
+            filters = {'id': firewall_rule_ids}
+            query = self._get_collection_query(context, FirewallRule,
+                                               filters=filters)
+            rules_dict = dict((fwr_db['id'], fwr_db) for fwr_db in query)
+            fwr_dbs = []
+            seen = set()
+            for firewall_rule_id in firewall_rule_ids:
+                if firewall_rule_id in seen:
+                    # A rule listed twice is inserted once.
+                    continue
+                seen.add(firewall_rule_id)
+                if firewall_rule_id not in rules_dict:
+                    raise firewall.FirewallRuleNotFound(
+                        firewall_rule_id=firewall_rule_id)
+                fwr_db = rules_dict[firewall_rule_id]
+                if fwr_db.firewall_policy_id:
+                    raise firewall.FirewallRuleInUse(
+                        firewall_rule_id=fwr_db['id'])
+                fwr_dbs.append(fwr_db)
+            ref_fwr_db = None
             if ref_firewall_rule_id:
-                # If reference_firewall_rule_id is set, the new rule
-                # is inserted depending on the value of insert_before.
-                # If insert_before is set, the new rule is inserted before
-                # reference_firewall_rule_id, and if it is not set the new
-                # rule is inserted after reference_firewall_rule_id.
                 ref_fwr_db = self._get_firewall_rule(
                     context, ref_firewall_rule_id)
-                if insert_before:
-                    position = ref_fwr_db.position
-                else:
-                    position = ref_fwr_db.position + 1
-            else:
-                # If reference_firewall_rule_id is not set, it is assumed
-                # that the new rule needs to be inserted at the top.
-                # insert_before field is ignored.
-                # So default insertion is always at the top.
-                # Also note that position numbering starts at 1.
-                position = 1
-            return self._process_rule_for_policy(context, id, fwr_db,
-                                                 position)
+            return self._insert_rules_for_policy(
+                context, id, fwr_dbs, ref_fwr_db, insert_before,
+                rule_info.get('revision_number'))
 
     def remove_rule(self, context, id, rule_info):
         LOG.debug(_("remove_rule() called"))
@@ -495,8 +1741,65 @@ class Firewall_db_mixin(firewall.FirewallPluginBase, base_db.CrdDbPluginV2):
                 raise firewall.FirewallRuleNotAssociatedWithPolicy(
                     firewall_rule_id=fwr_db['id'],
                     firewall_policy_id=id)
-            return self._process_rule_for_policy(context, id, fwr_db, None)
-            
+            return self._remove_rule_from_policy(
+                context, id, fwr_db, rule_info.get('revision_number'))
+
+    def _validate_rules_request(self, id, rules_info):
+        if not rules_info or not isinstance(
+                rules_info.get('firewall_rule_ids'), list):
+            raise firewall.FirewallRuleInfoMissing()
+        return rules_info['firewall_rule_ids']
+
+    def add_rules(self, context, id, rules_info):
+        """Append the given rules not yet in the policy to its end."""
+        LOG.debug(_("add_rules() called"))
+        firewall_rule_ids = self._validate_rules_request(id, rules_info)
+        with context.session.begin(subtransactions=True):
+            fwp_db = self._get_firewall_policy_for_update(
+                context, id, rules_info.get('revision_number'))
+            rule_ids = self.get_firewall_policy_rule_ids(context, id)
+            # Rules already in the policy keep their place, the list is
+            # deduplicated by _set_rules_for_policy.
+            self._set_rules_for_policy(context, fwp_db,
+                                       rule_ids + firewall_rule_ids)
+            self._touch_firewall_policy(context, fwp_db)
+        return self._make_firewall_policy_dict(fwp_db)
+
+    def remove_rules(self, context, id, rules_info):
+        """Remove the given rules from the policy."""
+        LOG.debug(_("remove_rules() called"))
+        firewall_rule_ids = set(self._validate_rules_request(id, rules_info))
+        with context.session.begin(subtransactions=True):
+            fwp_db = self._get_firewall_policy_for_update(
+                context, id, rules_info.get('revision_number'))
+            rule_ids = self.get_firewall_policy_rule_ids(context, id)
+            for fwrule_id in firewall_rule_ids - set(rule_ids):
+                raise firewall.FirewallRuleNotAssociatedWithPolicy(
+                    firewall_rule_id=fwrule_id,
+                    firewall_policy_id=id)
+            self._set_rules_for_policy(
+                context, fwp_db, [fwrule_id for fwrule_id in rule_ids
+                                  if fwrule_id not in firewall_rule_ids])
+            self._touch_firewall_policy(context, fwp_db)
+        return self._make_firewall_policy_dict(fwp_db)
+
+    def evaluate(self, context, id, packet_info):
+        LOG.debug(_("evaluate() called"))
+        packets = packet_info.get('packets') if packet_info else None
+        if not isinstance(packets, list):
+            raise firewall.FirewallPacketInvalid(packet=packets)
+        self._get_firewall_policy(context, id)
+        classifier = rule_classifier.RuleClassifier(
+            self.get_firewall_policy_rule_list(context, id))
+        results = []
+        for packet in packets:
+            try:
+                results.append(classifier.evaluate(packet))
+            except (AttributeError, KeyError, TypeError, ValueError,
+                    socket.error):
+                raise firewall.FirewallPacketInvalid(packet=packet)
+        return {'results': results}
+
     ####Generating Firewall Configuration
     #def create_config(self, context, config):
     #    c = config['config']
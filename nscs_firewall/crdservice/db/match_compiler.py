@@ -0,0 +1,191 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Compiles the port ranges of firewall rules into masked matches for match
+based backends, such as OpenFlow tables and TCAM style appliances.
+A match is a (value, mask) pair selecting the ports p with
+p & mask == value. A range is covered by prefix matches, each an aligned
+block of ports, unless ternary matches, whose wildcard bits need not be
+the low bits, take fewer. The matches of a range may overlap, as they
+share the action and priority of the rule. A rule with a source and a
+destination range takes the cross product of both covers, the number of
+matches of a rule is reported as its expansion factor.
+"""
+
+import collections
+
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+
+PORT_BITS = 16
+PORT_PROTOCOLS = (rule_optimizer.PROTOCOL_NUMBERS[const.TCP],
+                  rule_optimizer.PROTOCOL_NUMBERS[const.UDP])
+
+# The matches of a rule: the IP protocol number, None for any, and the
+# source and destination port matches, None for any port.
+PortMatch = collections.namedtuple('PortMatch',
+                                   ['protocol', 'source', 'destination'])
+
+
+def range_to_prefixes(port_min, port_max, bits=PORT_BITS):
+    """
+    Split a range into the fewest prefix matches, each an aligned block.
+    A range of n values takes at most 2 * log2(n) of them.
+    """
+    full_mask = (1 << bits) - 1
+    matches = []
+    while port_min <= port_max:
+        # The largest aligned block starting at port_min that fits.
+        size = port_min & -port_min or 1 << bits
+        while port_min + size - 1 > port_max:
+            size >>= 1
+        matches.append((port_min, full_mask & ~(size - 1)))
+        port_min += size
+    return matches
+
+
+# Patterns of the top two bits of a split range as (value, mask) pairs,
+# by the value of the top bit of the matches one bit narrower, None for a
+# wildcard, and the blocks of the top two bits filled with ports.
+_SPLIT_PATTERNS = {
+    # Both ends have the second bit 1, block 10 lies between them.
+    (1, 1): ({0: (1, 3), 1: (3, 3), None: (1, 1)}, [(2, 3)]),
+    # Both ends have the second bit 0, block 01 lies between them.
+    (0, 0): ({0: (0, 3), 1: (2, 3), None: (0, 1)}, [(1, 3)]),
+}
+# The lower end has the second bit 0 and the upper end 1, blocks 01 and 10
+# lie between them. Block 01 alone is matched if the matches of the ends
+# may spill over into block 10, which they can if low_rest <= high_rest + 1
+# as the ends then fill the block together.
+_SPILL_PATTERNS = ({0: (0, 1), 1: (2, 2), None: (0, 0)}, [(1, 3)])
+_APART_PATTERNS = ({0: (0, 3), 1: (3, 3), None: (0, 0)}, [(1, 3), (2, 3)])
+
+
+def _split_cover(low, high, bits):
+    """
+    Cover the ports whose top bit is 0 and whose other bits are at least
+    low, along with those whose top bit is 1 and whose other bits are at
+    most high. bits counts the bits below the top one.
+    Matches with a wildcard top bit cover both ends at once, for the
+    values from low to high. Splitting on the second bit fills the blocks
+    between the ends with ports, and leaves the same problem one bit
+    narrower, whose matches are widened by the patterns above.
+    """
+    top = 1 << bits
+    half = top >> 1
+    low_bit = low >> (bits - 1) if bits else 0
+    high_bit = high >> (bits - 1) if bits else 1
+    if not low or high == top - 1 or (low_bit, high_bit) == (1, 0):
+        # One sided ranges, and ranges whose ends are too far apart for a
+        # match to span both, are best matched by prefixes.
+        return range_to_prefixes(low, top + high, bits + 1)
+    low_rest = low & (half - 1)
+    high_rest = high & (half - 1)
+    if low_bit == high_bit:
+        patterns, blocks = _SPLIT_PATTERNS[(low_bit, high_bit)]
+    elif low_rest <= high_rest + 1:
+        patterns, blocks = _SPILL_PATTERNS
+    else:
+        patterns, blocks = _APART_PATTERNS
+    shift = bits - 1
+    wildcard = (1 << shift) - 1
+    matches = [(value << shift, mask << shift) for value, mask in blocks]
+    for value, mask in _split_cover(low_rest, high_rest, bits - 1):
+        narrow_top = value >> shift & 1 if mask >> shift & 1 else None
+        top_value, top_mask = patterns[narrow_top]
+        matches.append(((top_value << shift) | (value & wildcard),
+                        (top_mask << shift) | (mask & wildcard)))
+    return matches
+
+
+def range_to_ternary(port_min, port_max, bits=PORT_BITS):
+    """
+    Cover a range with the fewest ternary matches. The bits above the
+    highest bit where the ends of the range differ are matched as they
+    are, the rest is covered by _split_cover.
+    """
+    full_mask = (1 << bits) - 1
+    if port_min == port_max:
+        return [(port_min, full_mask)]
+    split = (port_min ^ port_max).bit_length() - 1
+    prefix_mask = full_mask & ~((2 << split) - 1)
+    low_mask = (1 << split) - 1
+    return [((port_min & prefix_mask) | value, prefix_mask | mask)
+            for value, mask in _split_cover(port_min & low_mask,
+                                            port_max & low_mask, split)]
+
+
+def compile_range(port_min, port_max, bits=PORT_BITS):
+    """
+    Return the fewest masked matches covering a range, prefix matches
+    unless ternary ones take fewer.
+    """
+    prefixes = range_to_prefixes(port_min, port_max, bits)
+    if len(prefixes) <= 2:
+        # A single match covering a range is an aligned block, ranges of up
+        # to two prefixes cannot take fewer matches.
+        return prefixes
+    ternary = range_to_ternary(port_min, port_max, bits)
+    if len(ternary) < len(prefixes):
+        return ternary
+    return prefixes
+
+
+def _port_range_matches(port_range, compiler):
+    if not port_range:
+        return [None]
+    port_min, port_max = rule_optimizer.parse_port_range(port_range)
+    if port_min == 0 and port_max == rule_optimizer.MAX_PORT:
+        return [None]
+    return compiler(port_min, port_max)
+
+
+def compile_rule(rule, compiler=compile_range):
+    """
+    Return the port matches of a rule. A rule with ports but without a
+    protocol is matched for TCP and UDP, as ports can only be matched for
+    a given protocol, and a rule with ports for another protocol matches
+    nothing.
+    """
+    protocol = rule_optimizer.parse_protocol(rule['protocol'])
+    if not rule['source_port'] and not rule['destination_port']:
+        return [PortMatch(protocol, None, None)]
+    if protocol is None:
+        protocols = PORT_PROTOCOLS
+    elif protocol in PORT_PROTOCOLS:
+        protocols = (protocol,)
+    else:
+        return []
+    sources = _port_range_matches(rule['source_port'], compiler)
+    destinations = _port_range_matches(rule['destination_port'], compiler)
+    return [PortMatch(protocol, source, destination)
+            for protocol in protocols
+            for source in sources
+            for destination in destinations]
+
+
+def expansion_report(rules):
+    """
+    Return the expansion factor of every rule, the number of masked
+    matches it compiles into, next to the number a prefix only cover
+    takes.
+    """
+    return [{'firewall_rule_id': rule['id'],
+             'expansion': len(compile_rule(rule)),
+             'prefix_expansion': len(compile_rule(rule, range_to_prefixes))}
+            for rule in rules]
@@ -0,0 +1,170 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Schema upgrades for firewall databases created by an earlier release.
+register_models() only creates the tables that are missing, so columns
+and indexes added to existing tables are created here, and derived
+columns are filled in for existing rows. Every step checks the live
+schema or data first, which makes upgrade() safe to run at every plugin
+start.
+"""
+
+import socket
+
+import sqlalchemy as sa
+from sqlalchemy.engine import reflection
+from sqlalchemy import schema
+
+from nscs_firewall.crdservice.db import firewall_db
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+from nscs.crdservice.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+TABLES = [firewall_db.FirewallRule.__table__,
+          firewall_db.Firewall.__table__,
+          firewall_db.FirewallPolicy.__table__,
+          firewall_db.FirewallConfigJournal.__table__,
+          firewall_db.FirewallConfigJournalSequence.__table__,
+          firewall_db.FirewallHostPlacement.__table__]
+
+# Rules whose derived columns are filled in per statement.
+BACKFILL_BATCH_SIZE = 1000
+
+# Match columns of the rules whose addresses or protocol cannot be parsed:
+# empty address ranges, starting after they end, which no containment
+# filter matches.
+INVALID_MATCH_VALUES = {'source_ip_start': '\xff' * 16,
+                        'source_ip_end': '\0' * 16,
+                        'destination_ip_start': '\xff' * 16,
+                        'destination_ip_end': '\0' * 16,
+                        'protocol_number': None}
+
+
+def upgrade_columns(engine):
+    """
+    Add the columns declared on the models missing in the database. New
+    columns either allow NULL or have a server default, so existing rows
+    get a value.
+    """
+    inspector = reflection.Inspector.from_engine(engine)
+    existing_tables = inspector.get_table_names()
+    for table in TABLES:
+        if table.name not in existing_tables:
+            continue
+        existing = set(column['name']
+                       for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing:
+                LOG.info(_("Adding column %(column)s to %(table)s"),
+                         {'column': column.name, 'table': table.name})
+                engine.execute('ALTER TABLE %s ADD COLUMN %s' % (
+                    table.name,
+                    schema.CreateColumn(column).compile(
+                        dialect=engine.dialect)))
+
+
+def upgrade_indexes(engine):
+    """Create the indexes declared on the models missing in the database."""
+    inspector = reflection.Inspector.from_engine(engine)
+    existing_tables = inspector.get_table_names()
+    for table in TABLES:
+        if table.name not in existing_tables:
+            continue
+        existing = set(index['name']
+                       for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                LOG.info(_("Creating index %(index)s on %(table)s"),
+                         {'index': index.name, 'table': table.name})
+                index.create(engine)
+
+
+def backfill_rule_match_values(engine):
+    """
+    Fill in the match columns of the rules created before they existed,
+    walking the rules missing them in id order, a batch at a time. The
+    rules are looked up per IP version on the source address range index,
+    so once every rule is filled in, a start costs one index probe per IP
+    version. Rules with an address or protocol not valid for their IP
+    version are logged and get INVALID_MATCH_VALUES, so they are not read
+    again.
+    """
+    table = firewall_db.FirewallRule.__table__
+    query = sa.select([table.c.id, table.c.ip_version, table.c.protocol,
+                       table.c.source_ip_address,
+                       table.c.destination_ip_address])
+    query = query.where(table.c.source_ip_start.is_(None))
+    query = query.order_by(table.c.id).limit(BACKFILL_BATCH_SIZE)
+    update = table.update().where(table.c.id == sa.bindparam('rule_id'))
+    for ip_version in sorted(rule_optimizer.ADDRESS_FAMILIES):
+        version_query = query.where(table.c.ip_version == ip_version)
+        last_id = None
+        while True:
+            batch_query = version_query
+            if last_id is not None:
+                batch_query = version_query.where(table.c.id > last_id)
+            rows = engine.execute(batch_query).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            params = []
+            for row in rows:
+                try:
+                    values = firewall_db.get_rule_match_values(row)
+                except (KeyError, TypeError, ValueError, socket.error):
+                    LOG.warning(_("Firewall rule %s has an invalid address "
+                                  "or protocol, it is left out of the "
+                                  "containment filters"), row['id'])
+                    values = dict(INVALID_MATCH_VALUES)
+                values['rule_id'] = row['id']
+                params.append(values)
+            engine.execute(update, params)
+            LOG.info(_("Filled in the match columns of %d firewall rules"),
+                     len(params))
+
+
+def seed_config_journal_sequence(engine):
+    """
+    Start the config journal sequence after the ids of the journal entries
+    written before it existed.
+    """
+    table = firewall_db.FirewallConfigJournalSequence.__table__
+    journal = firewall_db.FirewallConfigJournal.__table__
+    existing_tables = reflection.Inspector.from_engine(
+        engine).get_table_names()
+    if table.name not in existing_tables or (
+            journal.name not in existing_tables):
+        return
+    query = sa.select([table.c.id]).where(
+        table.c.id == firewall_db.JOURNAL_SEQUENCE_ID)
+    if engine.execute(query).first():
+        return
+    last_id = engine.execute(
+        sa.select([sa.func.max(journal.c.id)])).scalar() or 0
+    LOG.info(_("Starting the firewall config journal sequence at %d"),
+             last_id)
+    engine.execute(table.insert().values(
+        id=firewall_db.JOURNAL_SEQUENCE_ID, last_id=last_id))
+
+
+def upgrade(engine):
+    upgrade_columns(engine)
+    upgrade_indexes(engine)
+    backfill_rule_match_values(engine)
+    seed_config_journal_sequence(engine)
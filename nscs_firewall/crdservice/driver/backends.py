@@ -0,0 +1,141 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from nscs.crdservice.openstack.common import importutils
+from nscs.crdservice.openstack.common import log as logging
+from nscs_firewall.crdservice.driver import ofc_notifier
+from nscs_firewall.crdservice.plugins.common import constants
+
+LOG = logging.getLogger(__name__)
+
+
+class FirewallBackend(object):
+    """
+    Delivers firewall configurations for one config mode.
+    FirewallDriver hands every backend the firewalls of its config mode
+    changed in one push as a single batch, so a backend can send one
+    message for many firewalls. The firewalls are dicts as built by the
+    plugin, holding the firewall, its config_mode and firewall_rule_list.
+    """
+    def __init__(self, driver):
+        self.driver = driver
+
+    def update_firewalls(self, context, firewalls):
+        raise NotImplementedError()
+
+    def delete_firewalls(self, context, firewalls):
+        raise NotImplementedError()
+
+
+class AgentBackend(FirewallBackend):
+    """
+    Casts every firewall to the l3 agents of the hosts running it. The
+    agents take one firewall per message, the hosts of the whole batch
+    are looked up with one query.
+    """
+    def _cast(self, context, method, firewalls):
+        hosts = self.driver.get_agent_hosts(
+            context, [fw['id'] for fw in firewalls])
+        for fw in firewalls:
+            method(context, fw, hosts.get(fw['id']))
+
+    def update_firewalls(self, context, firewalls):
+        self._cast(context, self.driver.agent_rpc.update_firewall, firewalls)
+
+    def delete_firewalls(self, context, firewalls):
+        self._cast(context, self.driver.agent_rpc.delete_firewall, firewalls)
+
+
+class NFVBackend(FirewallBackend):
+    """
+    Notifies the network services driver once per config handle, the
+    consumer of the handle fetches the configuration of all its firewalls.
+    """
+    def update_firewalls(self, context, firewalls):
+        versions = {}
+        for fw in firewalls:
+            versions[fw['config_handle_id']] = max(
+                versions.get(fw['config_handle_id']), fw.get('config_version'))
+        for config_handle_id, version in versions.items():
+            # A single replace notification, the consumer swaps in the new
+            # configuration as a whole instead of deleting the firewall
+            # and rebuilding it.
+            self.driver.prepare_update(config_handle_id, constants.FW_UPDATE,
+                                       version)
+
+    def delete_firewalls(self, context, firewalls):
+        for config_handle_id in set(fw['config_handle_id']
+                                    for fw in firewalls):
+            self.driver.prepare_update(config_handle_id, constants.FW_UPDATE)
+
+
+class OFCBackend(FirewallBackend):
+    """
+    Sends the firewalls as flow tables to the OpenFlow controller, one
+    versioned update per config handle, through the transport configured
+    as ofc_transport.
+    """
+    def __init__(self, driver):
+        super(OFCBackend, self).__init__(driver)
+        self.notifier = ofc_notifier.OFCNotifier(
+            importutils.import_object(driver.ofc_transport, driver),
+            driver.ofc_max_flows_per_message)
+
+    def update_firewalls(self, context, firewalls):
+        self.notifier.update_firewalls(context, firewalls)
+
+    def delete_firewalls(self, context, firewalls):
+        self.notifier.delete_firewalls(context, firewalls)
+
+
+class NullBackend(FirewallBackend):
+    """Drops the configurations, for config modes without a consumer."""
+
+    def update_firewalls(self, context, firewalls):
+        LOG.debug(_("No consumer for firewalls %s"),
+                  [fw['id'] for fw in firewalls])
+
+    def delete_firewalls(self, context, firewalls):
+        LOG.debug(_("No consumer for firewalls %s"),
+                  [fw['id'] for fw in firewalls])
+
+
+class LocalBackend(FirewallBackend):
+    """
+    Keeps the delivered configurations in memory, for tests and
+    benchmarks. firewalls maps the firewall IDs to the configuration last
+    delivered, batches counts the deliveries.
+    """
+    def __init__(self, driver=None):
+        super(LocalBackend, self).__init__(driver)
+        self._lock = threading.Lock()
+        self.firewalls = {}
+        self.batches = 0
+
+    def update_firewalls(self, context, firewalls):
+        with self._lock:
+            self.batches += 1
+            for fw in firewalls:
+                self.firewalls[fw['id']] = fw
+
+    def delete_firewalls(self, context, firewalls):
+        with self._lock:
+            self.batches += 1
+            for fw in firewalls:
+                self.firewalls.pop(fw['id'], None)
@@ -0,0 +1,142 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import Queue
+import threading
+import time
+
+from nscs.crdservice.openstack.common import log as logging
+
+LOG = logging.getLogger(__name__)
+
+
+class CoalescingDispatcher(object):
+    """
+    Collapse repeated push requests for the same firewall.
+    Firewalls marked dirty within the coalesce interval are handed to
+    push_func once, as a list of firewall IDs, when the interval expires.
+    The payload is built by push_func at flush time, so a push always
+    carries the latest state. An interval of 0 pushes immediately.
+    """
+    def __init__(self, push_func, interval=0):
+        self.push_func = push_func
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._timer = None
+        self.marks = 0
+        self.pushes = 0
+
+    def mark_dirty(self, firewall_ids):
+        with self._lock:
+            self.marks += len(firewall_ids)
+            self._dirty.update(firewall_ids)
+            if self.interval > 0 and self._dirty and self._timer is None:
+                # The window starts at the first mark and is not extended
+                # by later marks, so a steady stream of edits still gets
+                # pushed once per interval.
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if self.interval <= 0:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = list(self._dirty), set()
+            self._timer = None
+            self.pushes += len(dirty)
+        if not dirty:
+            return
+        LOG.debug(_("Pushing firewalls %(ids)s, stats %(stats)s"),
+                  {'ids': dirty, 'stats': self.get_stats()})
+        try:
+            self.push_func(dirty)
+        except Exception:
+            LOG.exception(_("Failed to push firewalls %s"), dirty)
+
+    def get_stats(self):
+        with self._lock:
+            return {'marks': self.marks,
+                    'pushes': self.pushes,
+                    'pushes_saved': self.marks - self.pushes - len(self._dirty),
+                    'pending': len(self._dirty)}
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of background threads running driver calls off the API
+    request thread. submit() blocks once queue_size calls are waiting, so
+    a slow driver throttles writers instead of growing the queue without
+    bound. A pool of 0 workers runs every call inline.
+    """
+    def __init__(self, size=4, queue_size=1000):
+        self.size = size
+        self._queue = Queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        for i in range(size):
+            worker = threading.Thread(target=self._run)
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, func, *args):
+        if self.size <= 0:
+            self._execute(func, args, time.time())
+        else:
+            self._queue.put((func, args, time.time()))
+
+    def _run(self):
+        while True:
+            func, args, queued_at = self._queue.get()
+            try:
+                self._execute(func, args, queued_at)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, func, args, queued_at):
+        started_at = time.time()
+        failed = False
+        try:
+            func(*args)
+        except Exception:
+            failed = True
+            LOG.exception(_("Background driver call %s failed"), func)
+        finished_at = time.time()
+        with self._lock:
+            self.completed += 1
+            if failed:
+                self.failed += 1
+            self.total_wait += started_at - queued_at
+            latency = finished_at - started_at
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def get_stats(self):
+        with self._lock:
+            completed = self.completed or 1
+            return {'workers': self.size,
+                    'queue_depth': self._queue.qsize(),
+                    'completed': self.completed,
+                    'failed': self.failed,
+                    'avg_wait': self.total_wait / completed,
+                    'avg_latency': self.total_latency / completed,
+                    'max_latency': self.max_latency}
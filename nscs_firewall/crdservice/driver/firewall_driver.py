@@ -37,6 +37,37 @@ confpath = cfg.CONF.config_file[0]
 confpath = confpath.replace('nscs.conf', 'modules/firewall.conf')
 modconf.read(confpath)
 nwservice_driver = str(modconf.get("DEFAULT","nwservice_driver"))
+placement_max_age = modconf.getint("FWDRIVER", "placement_max_age",
+                                   fallback=300)
+
+# Config mode of the firewalls without a config handle
+DEFAULT_CONFIG_MODE = 'NN'
+# Backend delivering the configuration of the firewalls of a config mode,
+# entries of the config_backends option override these.
+DEFAULT_BACKENDS = {
+    'NFV': 'nscs_firewall.crdservice.driver.backends.NFVBackend',
+    'NN': 'nscs_firewall.crdservice.driver.backends.AgentBackend',
+    'OFC': 'nscs_firewall.crdservice.driver.backends.OFCBackend'}
+
+
+def parse_backends(value):
+    """Parse a comma separated list of config_mode:class entries."""
+    backends = {}
+    for entry in value.split(','):
+        if entry.strip():
+            config_mode, sep, backend = entry.partition(':')
+            backends[config_mode.strip()] = backend.strip()
+    return backends
+
+
+config_backends = dict(DEFAULT_BACKENDS)
+config_backends.update(parse_backends(
+    modconf.get("FWDRIVER", "config_backends", fallback="")))
+ofc_transport = modconf.get(
+    "FWDRIVER", "ofc_transport",
+    fallback="nscs_firewall.crdservice.driver.ofc_notifier.NSDriverTransport")
+ofc_max_flows_per_message = modconf.getint(
+    "FWDRIVER", "ofc_max_flows_per_message", fallback=5000)
 
 
 class FirewallAgentApi(proxy.RpcProxy):
@@ -48,29 +79,23 @@ class FirewallAgentApi(proxy.RpcProxy):
         super(FirewallAgentApi, self).__init__(topic, self.API_VERSION)
         self.host = host
 
-    def create_firewall(self, context, firewall):
-        return self.fanout_cast(
-            context,
-            self.make_msg('create_firewall', firewall=firewall,
-                          host=self.host),
-            topic=self.topic
-        )
+    def _cast(self, context, method, firewall, hosts):
+        msg = self.make_msg(method, firewall=firewall, host=self.host)
+        if not hosts:
+            # Placement unknown, every agent gets the firewall and the ones
+            # not running it ignore it.
+            return self.fanout_cast(context, msg, topic=self.topic)
+        for host in hosts:
+            self.cast(context, msg, topic='%s.%s' % (self.topic, host))
 
-    def update_firewall(self, context, firewall):
-        return self.fanout_cast(
-            context,
-            self.make_msg('update_firewall', firewall=firewall,
-                          host=self.host),
-            topic=self.topic
-        )
+    def create_firewall(self, context, firewall, hosts=None):
+        return self._cast(context, 'create_firewall', firewall, hosts)
 
-    def delete_firewall(self, context, firewall):
-        return self.fanout_cast(
-            context,
-            self.make_msg('delete_firewall', firewall=firewall,
-                          host=self.host),
-            topic=self.topic
-        )
+    def update_firewall(self, context, firewall, hosts=None):
+        return self._cast(context, 'update_firewall', firewall, hosts)
+
+    def delete_firewall(self, context, firewall, hosts=None):
+        return self._cast(context, 'delete_firewall', firewall, hosts)
 
 class FirewallDriver():
     """
@@ -86,53 +111,94 @@ class FirewallDriver():
             'l3_agent',
             cfg.CONF.host
         )
+        self.ofc_transport = ofc_transport
+        self.ofc_max_flows_per_message = ofc_max_flows_per_message
+        self.backends = {}
+        for config_mode, backend in config_backends.items():
+            self.backends[config_mode] = importutils.import_object(backend,
+                                                                   self)
         
+    def get_agent_hosts(self, context, firewall_ids):
+        # Agents are only sent the firewalls they run, a firewall without
+        # hosts goes to every agent.
+        return self.db.get_firewall_hosts(context, firewall_ids,
+                                          placement_max_age)
+
+    def _get_backends(self, context, fws_with_rules, config_handle_id=None):
+        """Group firewalls by the backend of their config mode."""
+        backends = {}
+        batches = {}
+        for fw_with_rules in fws_with_rules:
+            handle_id = (config_handle_id or
+                         fw_with_rules.get('config_handle_id'))
+            if handle_id not in backends:
+                # Firewalls without a config handle are run by the agents.
+                config_mode = DEFAULT_CONFIG_MODE
+                if handle_id:
+                    config_details = self.db.get_config_handle(context,
+                                                               handle_id)
+                    config_mode = (config_details and
+                                   config_details['config_mode'])
+                backends[handle_id] = self.backends.get(config_mode)
+                if config_mode and backends[handle_id] is None:
+                    LOG.warning(_("No backend for config mode %s"),
+                                config_mode)
+            backend = backends[handle_id]
+            if backend is not None:
+                batches.setdefault(backend, []).append(fw_with_rules)
+        return batches
+
+    def firewalls_config_update(self, context, fws_with_rules):
+        """
+        Deliver the configuration of the firewalls changed in one push,
+        as one batch per backend. Returns the IDs of the firewalls whose
+        backend failed.
+        """
+        try:
+            batches = self._get_backends(context, fws_with_rules)
+        except Exception:
+            LOG.exception(_("Failed to look up the backends of firewalls"))
+            return [fw['id'] for fw in fws_with_rules]
+        failed = []
+        for backend, firewalls in batches.items():
+            try:
+                backend.update_firewalls(context, firewalls)
+            except Exception:
+                LOG.exception(_("%(backend)s failed to update firewalls "
+                                "%(ids)s"),
+                              {'backend': backend.__class__.__name__,
+                               'ids': [fw['id'] for fw in firewalls]})
+                failed.extend(fw['id'] for fw in firewalls)
+        return failed
+
     def firewall_config_update(self,context,firewall_id,fw_with_rules):
         #LOG.debug(_("Prepare Firewall Config Update Message..."))
-        self.fw_db = firewall_db.Firewall_db_mixin()
-        if firewall_id:
-            fw_details = self.db.get_firewall(context, firewall_id)
-            if fw_details['config_handle_id']:
-                config_details = self.db.get_config_handle(context, fw_details['config_handle_id'])
-                if config_details:
-                    config_mode = config_details['config_mode']
-                    if config_mode == 'NFV':
-                        self.agent_rpc.delete_firewall(context, fw_with_rules)
-                        self.prepare_update(fw_details['config_handle_id'],constants.FW_UPDATE)
-                    elif config_mode == 'NN':
-                        self.agent_rpc.update_firewall(context, fw_with_rules)
-                    elif config_mode == 'OFC':
-                        #Need to handle CRD Consumer Notifier
-                        pass
-            else:
-                self.agent_rpc.update_firewall(context, fw_with_rules)
+        for backend, firewalls in self._get_backends(
+                context, [fw_with_rules]).items():
+            backend.update_firewalls(context, firewalls)
         return
     
     def firewall_config_delete(self,context,config_handle_id,fw_with_rules):
         #LOG.debug(_("Prepare Firewall Config Delete Message..."))
-        if config_handle_id:
-            config_details = self.db.get_config_handle(context, config_handle_id)
-            if config_details:
-                config_mode = config_details['config_mode']
-                if config_mode == 'NFV':
-                    self.prepare_update(config_handle_id,constants.FW_UPDATE)
-                elif config_mode == 'NN':
-                    self.agent_rpc.delete_firewall(context, fw_with_rules)
-                elif config_mode == 'OFC':
-                    #Need to handle CRD Consumer Notifier
-                    pass
-        else:
-            self.agent_rpc.delete_firewall(context, fw_with_rules)
+        for backend, firewalls in self._get_backends(
+                context, [fw_with_rules], config_handle_id).items():
+            backend.delete_firewalls(context, firewalls)
         return
     
-    def prepare_update(self,config_handle_id,method):
+    def prepare_update(self,config_handle_id,method,version=None):
         #LOG.debug(_("Firewall Config Handle ID => %s"),(str(config_handle_id)))
         if config_handle_id:
-            update_dict = { "header":"request",
+            update_dict = { "header":constants.CONFIG_NOTIFY_REQUEST,
                         "config_handle_id":config_handle_id,
                         "slug":"firewall",
                         "version":"0.0",
                       }
+            if version is not None:
+                # Sent on every push, even for a version announced before:
+                # a change can be pushed without moving the version, and
+                # the consumer tells for itself whether it is up to date.
+                update_dict['header'] = constants.CONFIG_NOTIFY_REPLACE
+                update_dict['version'] = str(version)
             #LOG.debug(_("Notification Data : %s" % str(update_dict)))
             self.send_modified_notification(config_handle_id,{'config':update_dict})
         return
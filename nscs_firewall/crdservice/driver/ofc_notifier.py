@@ -0,0 +1,217 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Flow tables for firewalls run by an OpenFlow controller (OFC config mode).
+The ordered rules of a firewall are translated into match entries with
+descending priorities, and the tables of the firewalls changed in one
+push are sent to the controller as versioned flow table updates through
+a pluggable transport. The message format is described in
+crdconsumer/README.
+"""
+
+import socket
+import threading
+
+from nscs.crdservice.openstack.common import log as logging
+from nscs.crdservice.openstack.common import uuidutils
+from nscs_firewall.crdservice.db import match_compiler
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+
+LOG = logging.getLogger(__name__)
+
+FLOW_TABLE_HEADER = "flow_table"
+# OpenFlow priorities are 16 bit. The first rule gets the highest one, the
+# catch-all entry dropping the traffic not matched by any rule the lowest.
+FLOW_PRIORITY_MAX = 65534
+FLOW_PRIORITY_DEFAULT = 0
+
+ETH_TYPES = {4: 0x0800, 6: 0x86dd}
+PORT_PROTOCOLS = {rule_optimizer.PROTOCOL_NUMBERS[const.TCP]: 'tcp',
+                  rule_optimizer.PROTOCOL_NUMBERS[const.UDP]: 'udp'}
+
+
+def _address_match(address, ip_version):
+    family, bits = rule_optimizer.ADDRESS_FAMILIES[ip_version]
+    start, end = rule_optimizer.parse_address(address, ip_version)
+    packed = ('%0*x' % (bits // 4, start)).decode('hex')
+    return '%s/%d' % (socket.inet_ntop(family, packed),
+                      bits - (end - start).bit_length())
+
+
+def rule_matches(rule):
+    """
+    Return the OpenFlow matches of a rule. Port ranges are compiled into
+    masked matches by match_compiler, a rule with ports for a protocol
+    without ports matches nothing.
+    """
+    ip_version = int(rule['ip_version'])
+    base = {'eth_type': ETH_TYPES[ip_version]}
+    prefix = 'ipv%d_' % ip_version
+    if rule['source_ip_address']:
+        base[prefix + 'src'] = _address_match(rule['source_ip_address'],
+                                              ip_version)
+    if rule['destination_ip_address']:
+        base[prefix + 'dst'] = _address_match(rule['destination_ip_address'],
+                                              ip_version)
+    matches = []
+    for port_match in match_compiler.compile_rule(rule):
+        match = dict(base)
+        if port_match.protocol is not None:
+            match['ip_proto'] = port_match.protocol
+        name = PORT_PROTOCOLS.get(port_match.protocol)
+        if port_match.source:
+            match[name + '_src'] = list(port_match.source)
+        if port_match.destination:
+            match[name + '_dst'] = list(port_match.destination)
+        matches.append(match)
+    return matches
+
+
+def build_flow_table(fw_with_rules):
+    """
+    Translate the ordered rules of a firewall into flow entries. Entries
+    of one rule share its priority and action, they may overlap. Raises
+    ValueError if the rules do not fit the priority range.
+    """
+    rules = [rule for rule in fw_with_rules['firewall_rule_list']
+             if rule['enabled']]
+    if len(rules) > FLOW_PRIORITY_MAX - FLOW_PRIORITY_DEFAULT:
+        raise ValueError(_("Firewall %(id)s has %(count)d rules, more than "
+                           "flow priorities") %
+                         {'id': fw_with_rules['id'], 'count': len(rules)})
+    flows = []
+    for index, rule in enumerate(rules):
+        for match in rule_matches(rule):
+            flows.append({'priority': FLOW_PRIORITY_MAX - index,
+                          'match': match,
+                          'action': rule['action'],
+                          'firewall_rule_id': rule['id']})
+    # Traffic not matched by any rule is dropped.
+    flows.append({'priority': FLOW_PRIORITY_DEFAULT,
+                  'match': {},
+                  'action': const.FWAAS_DENY,
+                  'firewall_rule_id': None})
+    return flows
+
+
+class OFCNotifier(object):
+    """
+    Sends the flow tables of a batch of firewalls to the controller. The
+    firewalls of a config handle go out as one update, split into parts
+    of at most max_flows flow entries on firewall boundaries. Every part
+    carries an update id unique to the update, the configuration version,
+    its sequence number and the number of parts. The controller collects
+    the parts by update id, as concurrent pushes may send updates of the
+    same version whose parts interleave, and applies the update once all
+    its parts arrived.
+    """
+    def __init__(self, transport, max_flows=5000):
+        self.transport = transport
+        self.max_flows = max_flows
+
+    def _send(self, context, config_handle_id, version, tables, deleted):
+        parts = [[]]
+        size = 0
+        for table in tables:
+            if parts[-1] and size + len(table['flows']) > self.max_flows:
+                parts.append([])
+                size = 0
+            parts[-1].append(table)
+            size += len(table['flows'])
+        update_id = uuidutils.generate_uuid()
+        for sequence, part in enumerate(parts):
+            message = {'header': FLOW_TABLE_HEADER,
+                       'update_id': update_id,
+                       'config_handle_id': config_handle_id,
+                       'version': version,
+                       'sequence': sequence,
+                       'total': len(parts),
+                       'firewalls': part,
+                       'deleted_firewall_ids': []}
+            if sequence == len(parts) - 1:
+                message['deleted_firewall_ids'] = deleted
+            self.transport.send(context, config_handle_id, message)
+
+    def _group(self, firewalls):
+        handles = {}
+        for fw in firewalls:
+            handles.setdefault(fw['config_handle_id'], []).append(fw)
+        return handles
+
+    def update_firewalls(self, context, firewalls):
+        for config_handle_id, fws in self._group(firewalls).items():
+            version = max(fw.get('config_version') for fw in fws)
+            tables = [{'firewall_id': fw['id'],
+                       'flows': build_flow_table(fw)} for fw in fws]
+            self._send(context, config_handle_id, version, tables, [])
+
+    def delete_firewalls(self, context, firewalls):
+        # The version reached by a delete is not known before the firewall
+        # is removed, deletes are applied whatever the version.
+        for config_handle_id, fws in self._group(firewalls).items():
+            self._send(context, config_handle_id, None, [],
+                       [fw['id'] for fw in fws])
+
+
+class NSDriverTransport(object):
+    """Sends the flow table updates through the network services driver."""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def send(self, context, config_handle_id, message):
+        self.driver.send_modified_notification(config_handle_id,
+                                               {'flow_table': message})
+
+
+class LocalTransport(object):
+    """
+    Applies the flow table updates in memory the way the controller does,
+    for tests and benchmarks. tables maps firewall IDs to their flows,
+    versions holds the version applied per config handle, and updates
+    older than it are counted in stale. Parts are collected by update id.
+    """
+    def __init__(self, driver=None):
+        self._lock = threading.Lock()
+        self._parts = {}
+        self.tables = {}
+        self.versions = {}
+        self.messages = 0
+        self.stale = 0
+
+    def send(self, context, config_handle_id, message):
+        with self._lock:
+            self.messages += 1
+            update_id = message['update_id']
+            parts = self._parts.setdefault(update_id, [])
+            parts.append(message)
+            if len(parts) < message['total']:
+                return
+            del self._parts[update_id]
+            version = message['version']
+            if version is not None:
+                if version < self.versions.get(config_handle_id, version):
+                    self.stale += 1
+                    return
+                self.versions[config_handle_id] = version
+            for part in parts:
+                for table in part['firewalls']:
+                    self.tables[table['firewall_id']] = table['flows']
+                for firewall_id in part['deleted_firewall_ids']:
+                    self.tables.pop(firewall_id, None)
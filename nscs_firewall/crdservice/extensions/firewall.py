@@ -89,6 +89,44 @@ class FirewallRuleInfoMissing(qexception.InvalidInput):
                 "rule operation.")
 
 
+class FirewallRulePositionInvalid(qexception.InvalidInput):
+    message = _("Invalid firewall rule position %(position)s, positions "
+                "are integers starting at 1.")
+
+
+class FirewallRuleInvalidMatch(qexception.InvalidInput):
+    message = _("Firewall rule addresses %(source_ip_address)s and "
+                "%(destination_ip_address)s or protocol %(protocol)s are "
+                "not valid for IP version %(ip_version)s.")
+
+
+class FirewallRuleFilterInvalid(qexception.InvalidInput):
+    message = _("Invalid value %(value)s for firewall rule filter "
+                "%(filter)s.")
+
+
+class FirewallPacketInvalid(qexception.InvalidInput):
+    message = _("Invalid packet %(packet)s for rule evaluation.")
+
+
+class FirewallRevisionMismatch(qexception.Conflict):
+    message = _("%(resource)s %(id)s is at revision %(current)s, the "
+                "request expected revision %(expected)s.")
+
+
+class FirewallConcurrentUpdate(qexception.Conflict):
+    message = _("%(resource)s %(id)s was changed by a concurrent request.")
+
+
+class FirewallSortKeyInvalid(qexception.InvalidInput):
+    message = _("Firewall resources cannot be sorted by %(sort_key)s.")
+
+
+class FirewallConfigChunkNotFound(qexception.NotFound):
+    message = _("Configuration chunk %(chunk_sequence)s of config handle "
+                "%(config_handle_id)s could not be found.")
+
+
 class FirewallInternalDriverError(qexception.CrdException):
     """Fwaas exception for all driver errors.
 
@@ -223,6 +261,11 @@ RESOURCE_ATTRIBUTE_MAP = {
         'enabled': {'allow_post': True, 'allow_put': True,
                     'default': True, 'convert_to': attr.convert_to_boolean,
                     'is_visible': True},
+        # Revision the update expects the resource to be at, If-Match
+        # style, updates without it apply to the current revision.
+        'revision_number': {'allow_post': False, 'allow_put': True,
+                            'convert_to': attr.convert_to_int,
+                            'default': None, 'is_visible': True},
     },
     'firewall_policies': {
         'id': {'allow_post': True, 'allow_put': True,
@@ -248,6 +291,9 @@ RESOURCE_ATTRIBUTE_MAP = {
         'audited': {'allow_post': True, 'allow_put': True,
                     'default': False, 'convert_to': attr.convert_to_boolean,
                     'is_visible': True},
+        'revision_number': {'allow_post': False, 'allow_put': True,
+                            'convert_to': attr.convert_to_int,
+                            'default': None, 'is_visible': True},
     },
     'firewalls': {
         'id': {'allow_post': True, 'allow_put': True,
@@ -279,6 +325,9 @@ RESOURCE_ATTRIBUTE_MAP = {
                                'is_visible': True, 'default': None },
         'config_mode': {'allow_post': False, 'allow_put': False,
                    'is_visible': True},
+        'revision_number': {'allow_post': False, 'allow_put': True,
+                            'convert_to': attr.convert_to_int,
+                            'default': None, 'is_visible': True},
     },
     'configs': {
         'config_handle_id': {'allow_post': True, 'allow_put': False,
@@ -407,10 +456,17 @@ class Firewall(extensions.ExtensionDescriptor):
             member_actions = {}
             if resource_name == 'firewall_policy':
                 member_actions = {'insert_rule': 'PUT',
-                                  'remove_rule': 'PUT'}
+                                  'remove_rule': 'PUT',
+                                  'add_rules': 'PUT',
+                                  'remove_rules': 'PUT',
+                                  'evaluate': 'PUT'}
+
+            # Rules can be created in bulk by posting a list of them.
+            allow_bulk = collection_name == 'firewall_rules'
 
             controller = base.create_resource(
                 collection_name, resource_name, plugin, params,
+                allow_bulk=allow_bulk,
                 member_actions=member_actions,
                 allow_pagination=cfg.CONF.allow_pagination,
                 allow_sorting=cfg.CONF.allow_sorting)
@@ -453,7 +509,8 @@ class FirewallPluginBase(ServicePluginBase):
         return 'Firewall service plugin'
 
     @abc.abstractmethod
-    def get_firewalls(self, context, filters=None, fields=None):
+    def get_firewalls(self, context, filters=None, fields=None, sorts=None,
+                      limit=None, marker=None, page_reverse=False):
         pass
 
     @abc.abstractmethod
@@ -473,7 +530,9 @@ class FirewallPluginBase(ServicePluginBase):
         pass
 
     @abc.abstractmethod
-    def get_firewall_rules(self, context, filters=None, fields=None):
+    def get_firewall_rules(self, context, filters=None, fields=None,
+                           sorts=None, limit=None, marker=None,
+                           page_reverse=False):
         pass
 
     @abc.abstractmethod
@@ -497,7 +556,9 @@ class FirewallPluginBase(ServicePluginBase):
         pass
 
     @abc.abstractmethod
-    def get_firewall_policies(self, context, filters=None, fields=None):
+    def get_firewall_policies(self, context, filters=None, fields=None,
+                              sorts=None, limit=None, marker=None,
+                              page_reverse=False):
         pass
 
     @abc.abstractmethod
@@ -519,3 +580,15 @@ class FirewallPluginBase(ServicePluginBase):
     @abc.abstractmethod
     def remove_rule(self, context, id, rule_info):
         pass
+
+    @abc.abstractmethod
+    def add_rules(self, context, id, rules_info):
+        pass
+
+    @abc.abstractmethod
+    def remove_rules(self, context, id, rules_info):
+        pass
+
+    @abc.abstractmethod
+    def evaluate(self, context, id, packet_info):
+        pass
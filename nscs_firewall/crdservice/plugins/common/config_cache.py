@@ -0,0 +1,62 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+
+class ConfigCache(object):
+    """
+    Compiled firewall configuration per config handle.
+    Each configuration is cached with the config version it was compiled
+    at, the head of the config journal, and served only to lookups that
+    read the same version from the database. A write committed by any
+    process moves the head, so no process serves a configuration older
+    than what is committed. The state of a configuration is what else it
+    was compiled from that changes without moving the head, lookups have
+    to read the same state as well.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._configs = {}
+
+    def get(self, config_handle_id, version, variant=None, state=None):
+        """
+        Return the config cached at version and state, None if there is
+        none.
+        """
+        with self._lock:
+            cached = self._configs.get(config_handle_id)
+            if cached and cached[:2] == (version, state):
+                return cached[2].get(variant)
+
+    def set(self, config_handle_id, version, config, variant=None,
+            state=None):
+        """Cache a config compiled at the given version of the handle.
+
+        variant tells apart different encodings of the same config. A
+        config of another state at the same version replaces the cached
+        ones.
+        """
+        with self._lock:
+            cached = self._configs.get(config_handle_id)
+            if cached and cached[0] > version:
+                # Compiled before a newer config was cached.
+                return
+            if not cached or cached[:2] != (version, state):
+                cached = self._configs[config_handle_id] = (version, state,
+                                                            {})
+            cached[2][variant] = config
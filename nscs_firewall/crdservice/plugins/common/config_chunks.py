@@ -0,0 +1,123 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import hashlib
+import json
+import threading
+
+from nscs_firewall.crdservice.plugins.common import constants as const
+
+
+# The most bytes a character takes within a JSON string.
+MAX_ESCAPE = len(json.dumps(u'\x00')) - 2
+
+
+def _chunk_message(config, sequence, total, checksum, data):
+    chunk = dict(config)
+    chunk['header'] = const.CONFIG_HEADER_CHUNK
+    chunk['response'] = {'content_header': config['header'],
+                         'sequence': sequence,
+                         'total': total,
+                         'checksum': checksum,
+                         'data': data}
+    return chunk
+
+
+def _encoded_size(data):
+    """Return the size of a string within a JSON string, without quotes."""
+    return len(json.dumps(data)) - 2
+
+
+def split_config(config, chunk_size):
+    """
+    Split a generated firewall configuration into chunks.
+    The configuration response is serialized to JSON and cut into pieces
+    small enough that every chunk, once wrapped in the {'config': chunk}
+    message delivered to the consumer and serialized to JSON, takes at most
+    chunk_size bytes. The envelope of the chunk and the escaping of the
+    piece within a JSON string are counted. Every chunk carries its sequence
+    number, the total number of chunks and the SHA-1 checksum of the whole
+    payload, so that the consumer can verify the reassembled configuration.
+    """
+    payload = json.dumps(config['response'])
+    checksum = hashlib.sha1(payload).hexdigest()
+    # The sequence and total take no more digits than the payload length.
+    envelope = len(json.dumps({'config': _chunk_message(
+        config, len(payload), len(payload), checksum, '')}))
+    room = chunk_size - envelope
+    if room < MAX_ESCAPE:
+        raise ValueError(_("Configuration chunk size %(size)d does not fit "
+                           "the %(envelope)d bytes of the chunk envelope") %
+                         {'size': chunk_size, 'envelope': envelope})
+    pieces = []
+    offset = 0
+    while offset < len(payload):
+        length = min(room, len(payload) - offset)
+        size = _encoded_size(payload[offset:offset + length])
+        while size > room:
+            # Escaping takes up to MAX_ESCAPE bytes per character, the
+            # piece is shrunk by the share of bytes over the room.
+            length = min(length - 1, length * room // size)
+            size = _encoded_size(payload[offset:offset + length])
+        pieces.append(payload[offset:offset + length])
+        offset += length
+    pieces = pieces or ['']
+    return [_chunk_message(config, sequence, len(pieces), checksum, piece)
+            for sequence, piece in enumerate(pieces)]
+
+
+def join_config(chunks):
+    """
+    Reassemble the configuration response from all of its chunks.
+    Raises ValueError if chunks are missing or the checksum does not match.
+    """
+    chunks = sorted(chunks, key=lambda chunk: chunk['response']['sequence'])
+    if not chunks:
+        raise ValueError(_("No configuration chunks"))
+    total = chunks[0]['response']['total']
+    checksum = chunks[0]['response']['checksum']
+    if [chunk['response']['sequence'] for chunk in chunks] != range(total):
+        raise ValueError(_("Configuration chunks are missing"))
+    payload = ''.join(chunk['response']['data'] for chunk in chunks)
+    if hashlib.sha1(payload).hexdigest() != checksum:
+        raise ValueError(_("Configuration checksum mismatch"))
+    config = dict(chunks[0])
+    config['header'] = chunks[0]['response']['content_header']
+    config['response'] = json.loads(payload)
+    return config
+
+
+class ConfigChunkStore(object):
+    """
+    Recently split configurations, so that a consumer paging through the
+    chunks of a configuration does not get it compiled again per chunk.
+    """
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._chunks = collections.OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            return self._chunks.get(key)
+
+    def set(self, key, chunks):
+        with self._lock:
+            self._chunks[key] = chunks
+            while len(self._chunks) > self.max_entries:
+                self._chunks.popitem(last=False)
@@ -0,0 +1,95 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import base64
+import json
+import zlib
+
+from nscs_firewall.crdservice.plugins.common import constants as const
+
+# Order of the columns of the compact format for the keys of the rule dicts
+# built by Firewall_db_mixin._make_firewall_rule_dict. The columns are the
+# keys of the rules encoded, keys missing here follow in sorted order.
+RULE_FIELDS = ('id', 'tenant_id', 'name', 'description', 'firewall_policy_id',
+               'shared', 'protocol', 'ip_version', 'source_ip_address',
+               'destination_ip_address', 'source_port', 'destination_port',
+               'action', 'position', 'enabled', 'revision_number')
+
+
+def negotiate_format(requested):
+    """Return the most compact format supported by both sides."""
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        return const.CONFIG_FORMAT_JSON
+    return max(const.CONFIG_FORMAT_JSON,
+               min(requested, const.CONFIG_FORMAT_COMPACT))
+
+
+def _map_firewalls(response, func):
+    # Full configurations are a list of firewalls, deltas a dict holding
+    # the list of changed firewalls.
+    if isinstance(response, dict):
+        response = dict(response)
+        response['firewalls'] = [func(fw) for fw in response['firewalls']]
+        return response
+    return [func(fw) for fw in response]
+
+
+def _rule_fields(rules):
+    keys = set()
+    for rule in rules:
+        keys.update(rule)
+    fields = [field for field in RULE_FIELDS if field in keys]
+    fields.extend(sorted(keys.difference(RULE_FIELDS)))
+    return fields
+
+
+def _rules_to_rows(fw):
+    fw = dict(fw)
+    # Taken from the rules, so that the format follows the rule dicts.
+    fields = _rule_fields(fw['firewall_rule_list'])
+    fw['firewall_rule_list'] = {
+        'fields': fields,
+        'rows': [[rule.get(field) for field in fields]
+                 for rule in fw['firewall_rule_list']]}
+    return fw
+
+
+def _rows_to_rules(fw):
+    fields = fw['firewall_rule_list']['fields']
+    fw['firewall_rule_list'] = [dict(zip(fields, row))
+                                for row in fw['firewall_rule_list']['rows']]
+    return fw
+
+
+def encode_config(response):
+    """
+    Encode a configuration response in the compact format.
+    The rule list of every firewall is turned into a header naming the
+    columns and one row per rule, the result is serialized to JSON,
+    compressed with zlib and base64 encoded for the message bus.
+    """
+    payload = json.dumps(_map_firewalls(response, _rules_to_rows),
+                         separators=(',', ':'))
+    return base64.b64encode(zlib.compress(payload))
+
+
+def decode_config(data):
+    """Decode a configuration response encoded by encode_config()."""
+    response = json.loads(zlib.decompress(base64.b64decode(data)))
+    return _map_firewalls(response, _rows_to_rules)
@@ -35,6 +35,30 @@ FWAAS_ALLOW = "allow"
 FWAAS_DENY = "deny"
 FW_UPDATE = "FW_UPDATE"
 
+# Firewall configuration journal operations
+JOURNAL_ADD = "add"
+JOURNAL_MODIFY = "modify"
+JOURNAL_REMOVE = "remove"
+JOURNAL_REORDER = "reorder"
+JOURNAL_UPDATE = "update"
+JOURNAL_RESYNC = "resync"
+JOURNAL_DELETE = "delete"
+
+# Firewall configuration response headers
+CONFIG_HEADER_DATA = "data"
+CONFIG_HEADER_DELTA = "delta"
+CONFIG_HEADER_CHUNK = "chunk"
+
+# Firewall configuration notifications sent to the consumers. A replace
+# notification carries the version of the new configuration, which the
+# consumer fetches and swaps in for the running one as a whole.
+CONFIG_NOTIFY_REQUEST = "request"
+CONFIG_NOTIFY_REPLACE = "replace"
+
+# Firewall configuration response formats, negotiated with the consumer
+CONFIG_FORMAT_JSON = 1
+CONFIG_FORMAT_COMPACT = 2
+
 # L3 Protocol name constants
 TCP = "tcp"
 UDP = "udp"
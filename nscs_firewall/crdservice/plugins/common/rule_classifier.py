@@ -0,0 +1,109 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+
+
+class RuleClassifier(object):
+    """
+    Packet classifier compiled from the ordered rules of a policy.
+    Rules are grouped by (ip_version, source prefix length, destination
+    prefix length). Within a group the rules are hashed by their masked
+    source and destination networks, so a lookup costs one hash probe per
+    group instead of a scan of every rule (tuple space search). Groups are
+    probed in the order of their first rule, and the search stops once no
+    group can hold a rule before the best match found so far.
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        groups = {}
+        for index, rule in enumerate(rules):
+            if not rule['enabled']:
+                continue
+            match = rule_optimizer.RuleMatch(rule, index)
+            bits = rule_optimizer.ADDRESS_FAMILIES[match.ip_version][1]
+            key = (match.ip_version,
+                   bits - (match.src_max - match.src_min).bit_length(),
+                   bits - (match.dst_max - match.dst_min).bit_length())
+            group = groups.setdefault(key, (index, {}))
+            group[1].setdefault((match.src_min, match.dst_min),
+                                []).append(match)
+        # (first rule index, ip_version, source mask, destination mask,
+        #  rules by network)
+        self._groups = []
+        for (ip_version, src_prefix, dst_prefix), (first, rules_by_net) in (
+                groups.items()):
+            bits = rule_optimizer.ADDRESS_FAMILIES[ip_version][1]
+            self._groups.append(
+                (first, ip_version,
+                 ((1 << bits) - 1) ^ ((1 << (bits - src_prefix)) - 1),
+                 ((1 << bits) - 1) ^ ((1 << (bits - dst_prefix)) - 1),
+                 rules_by_net))
+        self._groups.sort()
+
+    def classify(self, packet):
+        """
+        Return the first rule matching a packet, None if no rule does.
+        packet holds ip_version, protocol, source_ip_address,
+        destination_ip_address, source_port and destination_port. Ports
+        may be left out for protocols without ports, such packets only
+        match rules without a port range.
+        """
+        ip_version = int(packet.get('ip_version') or 4)
+        protocol = rule_optimizer.parse_protocol(packet.get('protocol'))
+        src = rule_optimizer.parse_address(packet['source_ip_address'],
+                                           ip_version)[0]
+        dst = rule_optimizer.parse_address(packet['destination_ip_address'],
+                                           ip_version)[0]
+        # Port 0 is never part of a rule port range, so a packet without
+        # ports only matches the rules that match any port.
+        src_port = int(packet.get('source_port') or 0)
+        dst_port = int(packet.get('destination_port') or 0)
+        best = None
+        for first, group_ip_version, src_mask, dst_mask, rules_by_net in (
+                self._groups):
+            if best is not None and first > best.index:
+                break
+            if group_ip_version != ip_version:
+                continue
+            for match in rules_by_net.get((src & src_mask, dst & dst_mask),
+                                          ()):
+                if best is not None and match.index > best.index:
+                    break
+                if ((match.protocol is None or match.protocol == protocol) and
+                        match.src_port_min <= src_port <=
+                        match.src_port_max and
+                        match.dst_port_min <= dst_port <=
+                        match.dst_port_max):
+                    best = match
+                    break
+        if best is None:
+            return None
+        return best.rule
+
+    def evaluate(self, packet):
+        """Return the matching rule and the resulting action of a packet."""
+        rule = self.classify(packet)
+        if rule is None:
+            # Traffic not matched by any rule is dropped.
+            return {'firewall_rule_id': None,
+                    'position': None,
+                    'action': const.FWAAS_DENY}
+        return {'firewall_rule_id': rule['id'],
+                'position': rule['position'],
+                'action': rule['action']}
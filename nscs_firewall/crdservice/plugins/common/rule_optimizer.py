@@ -0,0 +1,201 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import socket
+
+from nscs_firewall.crdservice.plugins.common import constants as const
+
+# Reasons reported for rules that are not shipped to the backends
+RULE_DISABLED = "disabled"
+RULE_SHADOWED = "shadowed"
+RULE_REDUNDANT = "redundant"
+
+PROTOCOL_NUMBERS = {const.ICMP: 1, const.TCP: 6, const.UDP: 17}
+ADDRESS_FAMILIES = {4: (socket.AF_INET, 32), 6: (socket.AF_INET6, 128)}
+MAX_PORT = 65535
+
+
+def parse_protocol(protocol):
+    """Return the IP protocol number of a rule protocol, None for any."""
+    if protocol is None:
+        return None
+    protocol = str(protocol).lower()
+    if protocol in PROTOCOL_NUMBERS:
+        return PROTOCOL_NUMBERS[protocol]
+    return int(protocol)
+
+
+def parse_address(address, ip_version):
+    """Return the first and last address of an IP or CIDR as integers."""
+    family, bits = ADDRESS_FAMILIES[ip_version]
+    if not address:
+        return 0, (1 << bits) - 1
+    ip, sep, prefix = address.partition('/')
+    prefix = int(prefix) if prefix else bits
+    value = 0
+    for byte in bytearray(socket.inet_pton(family, ip)):
+        value = (value << 8) | byte
+    host_mask = (1 << (bits - prefix)) - 1
+    return value & ~host_mask, value | host_mask
+
+
+def parse_port_range(port_range):
+    """Return the first and last port of a rule port range."""
+    if not port_range:
+        return 0, MAX_PORT
+    min_port, sep, max_port = str(port_range).partition(':')
+    return int(min_port), int(max_port or min_port)
+
+
+class RuleMatch(object):
+    """The traffic matched by a firewall rule, as closed integer ranges."""
+
+    def __init__(self, rule, index=0):
+        self.rule = rule
+        self.index = index
+        self.ip_version = rule['ip_version']
+        self.protocol = parse_protocol(rule['protocol'])
+        (self.src_min, self.src_max) = parse_address(
+            rule['source_ip_address'], self.ip_version)
+        (self.dst_min, self.dst_max) = parse_address(
+            rule['destination_ip_address'], self.ip_version)
+        (self.src_port_min, self.src_port_max) = parse_port_range(
+            rule['source_port'])
+        (self.dst_port_min, self.dst_port_max) = parse_port_range(
+            rule['destination_port'])
+
+    def covers(self, other):
+        """Whether every packet matched by other is matched by self."""
+        return (self.dst_min <= other.dst_min and
+                self.dst_max >= other.dst_max and
+                self.src_min <= other.src_min and
+                self.src_max >= other.src_max and
+                self.dst_port_min <= other.dst_port_min and
+                self.dst_port_max >= other.dst_port_max and
+                self.src_port_min <= other.src_port_min and
+                self.src_port_max >= other.src_port_max and
+                self.ip_version == other.ip_version and
+                (self.protocol is None or self.protocol == other.protocol))
+
+    def intersects(self, other):
+        """Whether some packet is matched by both self and other."""
+        return (self.dst_min <= other.dst_max and
+                other.dst_min <= self.dst_max and
+                self.src_min <= other.src_max and
+                other.src_min <= self.src_max and
+                self.dst_port_min <= other.dst_port_max and
+                other.dst_port_min <= self.dst_port_max and
+                self.src_port_min <= other.src_port_max and
+                other.src_port_min <= self.src_port_max and
+                self.ip_version == other.ip_version and
+                (self.protocol is None or other.protocol is None or
+                 self.protocol == other.protocol))
+
+
+def _prefixes(first, last, bits):
+    """Yield the (first, last) address of every prefix containing a block."""
+    length = bits - (last - first).bit_length()
+    for prefix in range(length + 1):
+        host_mask = (1 << (bits - prefix)) - 1
+        yield first & ~host_mask, first | host_mask
+
+
+class MatchIndex(object):
+    """
+    Rule matches indexed by destination and source prefix.
+    A rule can only cover another rule if its prefixes hold the other
+    rule's prefixes, so the candidates are found by looking up the at most
+    33 (or 129 for IPv6) enclosing prefixes instead of scanning every rule.
+    """
+    def __init__(self):
+        self._matches = {}
+
+    def add(self, match):
+        by_src = self._matches.setdefault(
+            (match.ip_version, match.dst_min, match.dst_max), {})
+        by_src.setdefault((match.src_min, match.src_max), []).append(match)
+
+    def covering(self, match):
+        """Return the indexed matches covering match, in rule order."""
+        bits = ADDRESS_FAMILIES[match.ip_version][1]
+        found = []
+        for dst in _prefixes(match.dst_min, match.dst_max, bits):
+            by_src = self._matches.get((match.ip_version,) + dst)
+            if not by_src:
+                continue
+            for src in _prefixes(match.src_min, match.src_max, bits):
+                for candidate in by_src.get(src, ()):
+                    if candidate.covers(match):
+                        found.append(candidate)
+        return sorted(found, key=lambda candidate: candidate.index)
+
+
+def optimize_rules(rules):
+    """
+    Drop the rules of an ordered rule list that cannot change the outcome.
+    A rule is dropped when it is disabled, when an earlier rule matches all
+    of its traffic (shadowed), or when a later rule with the same action
+    matches all of its traffic and no rule in between with another action
+    overlaps it (redundant). Returns the rules to ship and one annotation
+    per dropped rule.
+    """
+    annotations = []
+    matches = []
+    shipped = MatchIndex()
+    for index, rule in enumerate(rules):
+        if not rule['enabled']:
+            annotations.append({'firewall_rule_id': rule['id'],
+                                'reason': RULE_DISABLED})
+            continue
+        match = RuleMatch(rule, index)
+        shadowing = shipped.covering(match)
+        if shadowing:
+            annotations.append({
+                'firewall_rule_id': rule['id'],
+                'reason': RULE_SHADOWED,
+                'by_firewall_rule_id': shadowing[0].rule['id'],
+                'conflict': shadowing[0].rule['action'] != rule['action']})
+            continue
+        shipped.add(match)
+        matches.append(match)
+
+    # Walk upwards, so that a rule made redundant by a later rule is only
+    # checked against rules that are themselves shipped.
+    kept = collections.deque()
+    kept_index = MatchIndex()
+    for match in reversed(matches):
+        covering = [later for later in kept_index.covering(match)
+                    if later.rule['action'] == match.rule['action']]
+        if covering:
+            for later in kept:
+                if later is covering[0]:
+                    break
+                if (later.rule['action'] != match.rule['action'] and
+                        later.intersects(match)):
+                    covering = None
+                    break
+        if covering:
+            annotations.append({
+                'firewall_rule_id': match.rule['id'],
+                'reason': RULE_REDUNDANT,
+                'by_firewall_rule_id': covering[0].rule['id'],
+                'conflict': False})
+        else:
+            kept.appendleft(match)
+            kept_index.add(match)
+    return [match.rule for match in kept], annotations
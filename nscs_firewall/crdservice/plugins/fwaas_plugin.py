@@ -18,6 +18,7 @@
 # @author: Sumit Naiksatam, sumitnaiksatam@gmail.com, Big Switch Networks, Inc.
 
 from oslo.config import cfg
+from sqlalchemy import exc as sa_exc
 
 from nscs.crdservice.common import exceptions as n_exception
 from nscs.crdservice.common import rpc as q_rpc
@@ -25,13 +26,24 @@ from nscs.crdservice.common import topics
 from nscs.crdservice import context as crd_context
 from nscs.crdservice.db import api as qdbapi
 from nscs_firewall.crdservice.db import firewall_db
+from nscs_firewall.crdservice.db import migration
 from nscs_firewall.crdservice.extensions import firewall as fw_ext
 from nscs.crdservice.openstack.common import log as logging
 from nscs.crdservice.openstack.common import rpc
 from nscs.crdservice.openstack.common.rpc import proxy
 from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins.common.config_cache import ConfigCache
+from nscs_firewall.crdservice.plugins.common import config_chunks
+from nscs_firewall.crdservice.plugins.common import config_encoding
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
 from nscs.crdservice.openstack.common import importutils
 from nscs_firewall.crdservice.listener.firewall import FirewallListener
+from nscs_firewall.crdservice.driver.dispatch import CoalescingDispatcher
+from nscs_firewall.crdservice.driver.dispatch import WorkerPool
+import copy
+import functools
+import random
+import threading
 import time
 import configparser
 LOG = logging.getLogger(__name__)
@@ -41,6 +53,61 @@ confpath = cfg.CONF.config_file[0]
 confpath = confpath.replace('nscs.conf', 'modules/firewall.conf')
 modconf.read(confpath)
 firewall_driver = str(modconf.get("FWDRIVER","firewall_driver"))
+push_coalesce_interval = modconf.getfloat("FWDRIVER", "push_coalesce_interval",
+                                          fallback=0)
+driver_workers = modconf.getint("FWDRIVER", "driver_workers", fallback=4)
+driver_queue_size = modconf.getint("FWDRIVER", "driver_queue_size",
+                                   fallback=1000)
+config_journal_size = modconf.getint("FWDRIVER", "config_journal_size",
+                                     fallback=10000)
+config_chunk_size = modconf.getint("FWDRIVER", "config_chunk_size",
+                                   fallback=262144)
+optimize_rules = modconf.getboolean("FWDRIVER", "optimize_rules",
+                                    fallback=False)
+conflict_retries = modconf.getint("FWDRIVER", "conflict_retries", fallback=5)
+
+
+def is_conflict(error):
+    """
+    Tell whether an error is a lost race against a concurrent request: a
+    revision number compare-and-swap that failed, or a transaction the
+    database rolled back to break a deadlock.
+    """
+    if isinstance(error, fw_ext.FirewallConcurrentUpdate):
+        return True
+    # MySQL: "Deadlock found when trying to get lock",
+    # PostgreSQL: "deadlock detected".
+    return (isinstance(error, sa_exc.DBAPIError) and
+            'deadlock' in str(error.orig).lower())
+
+
+def retry_on_conflict(f):
+    """
+    Run a plugin call again when its write lost the race for a revision
+    number, or a deadlock, against a concurrent request. Every attempt gets
+    a fresh copy of the request body, which the DB layer edits in place. A
+    revision asked for by the caller is a precondition and is not retried.
+    """
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return f(self, *[copy.deepcopy(arg)
+                                 if isinstance(arg, dict) else arg
+                                 for arg in args],
+                         **copy.deepcopy(kwargs))
+            except Exception as e:
+                if not is_conflict(e):
+                    raise
+                attempt += 1
+                if attempt > conflict_retries:
+                    raise
+                LOG.debug(_("Retrying %(func)s: %(error)s"),
+                          {'func': f.__name__, 'error': e})
+                # Spreads out writers that keep colliding.
+                time.sleep(random.uniform(0, 0.01 * attempt))
+    return wrapper
 
 
 class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
@@ -52,48 +119,178 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
     firewall_db.Firewall_db_mixin.
     """
     supported_extension_aliases = ["fwaas"]
+    # Lists of firewall rules are created with create_firewall_rule_bulk.
+    __native_bulk_support = True
+    # Listings are sorted and paginated by marker in the database.
+    __native_pagination_support = True
+    __native_sorting_support = True
 
     def __init__(self):
         """Do the initialization for the firewall service plugin here."""
 	self.db = firewall_db.Firewall_db_mixin()
         self.driver = importutils.import_object(firewall_driver)
+        self.workers = WorkerPool(driver_workers, driver_queue_size)
+        self.config_cache = ConfigCache()
+        self.config_chunks = config_chunks.ConfigChunkStore()
+        self.push_dispatcher = CoalescingDispatcher(self._submit_push,
+                                                    push_coalesce_interval)
+        self._rebalance_lock = threading.Lock()
+        self._rebalance_pending = set()
         qdbapi.register_models()
+        migration.upgrade(qdbapi.get_session().get_bind())
 	super(FirewallPlugin, self).__init__()
 
 
+    def _get_config_mode(self, context, config_handle_id):
+        if not config_handle_id:
+            return None
+        config_details = self.get_config_handle(context, config_handle_id)
+        return config_details['config_mode']
+
+    def _optimize_rules(self, fw_rules_list):
+        # Disabled, shadowed and redundant rules are not shipped, the
+        # analysis tells the consumer which rules were dropped and why.
+        if not optimize_rules:
+            return fw_rules_list, []
+        return rule_optimizer.optimize_rules(fw_rules_list)
+
     def _make_firewall_dict_with_rules(self, context, firewall_id):
-        firewall = self.get_firewall(context, firewall_id)
-        fw_policy_id = firewall['firewall_policy_id']
-        if fw_policy_id:
-            fw_policy = self.get_firewall_policy(context, fw_policy_id)
-            fw_rules_list = [self.get_firewall_rule(
-                context, rule_id) for rule_id in fw_policy['firewall_rules']]
-            firewall['firewall_rule_list'] = fw_rules_list
-        else:
-            firewall['firewall_rule_list'] = []
+        firewall = self.get_firewall_with_rules(context, firewall_id)
+        firewall['config_mode'] = self._get_config_mode(
+            context, firewall['config_handle_id'])
+        (firewall['firewall_rule_list'],
+         firewall['firewall_rule_analysis']) = self._optimize_rules(
+            firewall['firewall_rule_list'])
         # FIXME(Sumit): If the size of the firewall object we are creating
         # here exceeds the largest message size supported by rabbit/qpid
         # then we will have a problem.
         return firewall
 
-    def _rpc_update_firewall(self, context, firewall_id):
-        #status_update = {"firewall": {"status": const.PENDING_UPDATE}}
-        status_update = {"firewall": {"status": const.ACTIVE}}
-        fw = super(FirewallPlugin, self).update_firewall(context, firewall_id,
-                                                         status_update)
-        if fw:
-            fw_with_rules = (
-                self._make_firewall_dict_with_rules(context,
-                                                    firewall_id))
-            #self.agent_rpc.update_firewall(context, fw_with_rules)
-            self.driver.firewall_config_update(context,firewall_id,fw_with_rules)
-            
+    def _get_admin_context(self):
+        # Background workers run outside of any request.
+        return crd_context.get_admin_context()
+
+    def _make_firewall_push(self, fw, config_mode, fw_rules_list,
+                            fw_rules_analysis, config_version):
+        # The rule list is shared by every firewall of the policy, only the
+        # firewall envelope is built per firewall.
+        fw_with_rules = dict(fw)
+        fw_with_rules['config_mode'] = config_mode
+        fw_with_rules['firewall_rule_list'] = fw_rules_list
+        fw_with_rules['firewall_rule_analysis'] = fw_rules_analysis
+        if fw['config_handle_id']:
+            # The version consumers of the config handle have to reach.
+            fw_with_rules['config_version'] = config_version
+        return fw_with_rules
 
     def _rpc_update_firewall_policy(self, context, firewall_policy_id):
-        firewall_policy = self.get_firewall_policy(context, firewall_policy_id)
-        if firewall_policy:
-            for firewall_id in firewall_policy['firewall_list']:
-                self._rpc_update_firewall(context, firewall_id)
+        filters = {'firewall_policy_id': [firewall_policy_id]}
+        firewalls = super(FirewallPlugin, self).get_firewalls(
+            context, filters=filters, fields=['id', 'config_handle_id'])
+        if firewalls:
+            firewall_ids = [fw['id'] for fw in firewalls]
+            self._update_firewalls_status(context, firewall_ids,
+                                          const.PENDING_UPDATE)
+            self.push_dispatcher.mark_dirty(firewall_ids)
+
+    def _submit_push(self, firewall_ids):
+        self.workers.submit(self._push_firewalls, firewall_ids)
+
+    def _push_firewalls(self, firewall_ids):
+        # Runs on a background worker, the firewalls may have been updated
+        # or deleted since they were scheduled.
+        context = self._get_admin_context()
+        # Read before the firewalls, so they are at least at this version.
+        config_version = self.get_config_journal_head(context)
+        filters = {'id': firewall_ids}
+        firewalls = super(FirewallPlugin, self).get_firewalls(
+            context, filters=filters)
+        # Serialize each policy's rules once for all firewalls using it,
+        # and look up each config handle's mode once.
+        fw_rules_lists = {}
+        config_modes = {}
+        fws_with_rules = []
+        failed = []
+        for fw in firewalls:
+            if fw['status'] == const.PENDING_DELETE:
+                continue
+            fw_policy_id = fw['firewall_policy_id']
+            config_handle_id = fw['config_handle_id']
+            try:
+                if config_handle_id not in config_modes:
+                    config_modes[config_handle_id] = self._get_config_mode(
+                        context, config_handle_id)
+                if fw_policy_id not in fw_rules_lists:
+                    fw_rules_lists[fw_policy_id] = self._optimize_rules(
+                        self._get_policy_rule_list(context, fw_policy_id))
+                fw_rules_list, fw_rules_analysis = (
+                    fw_rules_lists[fw_policy_id])
+                fws_with_rules.append(self._make_firewall_push(
+                    fw, config_modes[config_handle_id], fw_rules_list,
+                    fw_rules_analysis, config_version))
+            except Exception:
+                LOG.exception(_("Failed to push firewall %s"), fw['id'])
+                failed.append(fw['id'])
+        # One batch per config mode backend for all firewalls of the push.
+        failed.extend(self.driver.firewalls_config_update(context,
+                                                          fws_with_rules))
+        failed_ids = set(failed)
+        pushed = [fw['id'] for fw in fws_with_rules
+                  if fw['id'] not in failed_ids]
+        if pushed:
+            # A firewall changed since config_version is pushed again, it
+            # stays pending until then.
+            self._update_firewalls_status(context, pushed, const.ACTIVE,
+                                          config_version)
+        if failed:
+            self._update_firewalls_status(context, failed, const.ERROR)
+        self._prune_config_journal(context, config_journal_size)
+
+    def _get_policy_rule_list(self, context, firewall_policy_id):
+        if not firewall_policy_id:
+            return []
+        return self.get_firewall_policy_rule_list(context, firewall_policy_id)
+
+    def _schedule_rule_rebalance(self, firewall_policy_id):
+        # Called within the insert transaction, the policy is handed to a
+        # worker by _submit_rule_rebalances() once it is committed.
+        with self._rebalance_lock:
+            self._rebalance_pending.add(firewall_policy_id)
+
+    def _submit_rule_rebalances(self):
+        with self._rebalance_lock:
+            pending, self._rebalance_pending = self._rebalance_pending, set()
+        for firewall_policy_id in pending:
+            self.workers.submit(self._rebalance_policy, firewall_policy_id)
+
+    @retry_on_conflict
+    def _rebalance_policy(self, firewall_policy_id):
+        # Runs on a background worker. Renumbering keeps the rule order, so
+        # nothing has to be pushed afterwards.
+        context = self._get_admin_context()
+        with context.session.begin(subtransactions=True):
+            fwp_query = context.session.query(firewall_db.FirewallPolicy)
+            fwp_db = fwp_query.filter_by(id=firewall_policy_id).first()
+            if fwp_db:
+                self._rebalance_rule_positions(context, firewall_policy_id)
+                self._touch_firewall_policy(context, fwp_db)
+
+    def _delete_firewall(self, firewall_id):
+        # Runs on a background worker, the DB object is only removed once
+        # the backend has been told to delete the firewall.
+        context = self._get_admin_context()
+        fw_with_rules = (
+            self._make_firewall_dict_with_rules(context, firewall_id))
+        try:
+            self.driver.firewall_config_delete(
+                context, fw_with_rules['config_handle_id'], fw_with_rules)
+        except Exception:
+            LOG.exception(_("Failed to delete firewall %s"), firewall_id)
+            status_update = {"firewall": {"status": const.ERROR}}
+            super(FirewallPlugin, self).update_firewall(context, firewall_id,
+                                                        status_update)
+        else:
+            self.delete_db_firewall_object(context, firewall_id)
 
     def _ensure_update_firewall(self, context, firewall_id):
         fwall = self.get_firewall(context, firewall_id)
@@ -104,7 +301,8 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
                                                 pending_state=fwall['status'])
 
     def _ensure_update_firewall_policy(self, context, firewall_policy_id):
-        firewall_policy = self.get_firewall_policy(context, firewall_policy_id)
+        firewall_policy = self.get_firewall_policy(context, firewall_policy_id,
+                                                   fields=['firewall_list'])
         if firewall_policy and 'firewall_list' in firewall_policy:
             for firewall_id in firewall_policy['firewall_list']:
                 self._ensure_update_firewall(context, firewall_id)
@@ -123,25 +321,18 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
         fw_count = self.get_firewalls_count(context)
         #if fw_count:
         #    raise FirewallCountExceeded(tenant_id=tenant_id)
-        #firewall['firewall']['status'] = const.PENDING_CREATE
-        firewall['firewall']['status'] = const.ACTIVE
+        firewall['firewall']['status'] = const.PENDING_CREATE
         fw = super(FirewallPlugin, self).create_firewall(context, firewall)
-        fw_with_rules = (
-            self._make_firewall_dict_with_rules(context, fw['id']))
-        #self.agent_rpc.create_firewall(context, fw_with_rules)
-        self.driver.firewall_config_update(context,fw['id'],fw_with_rules)
+        self.workers.submit(self._push_firewalls, [fw['id']])
         return fw
 
+    @retry_on_conflict
     def update_firewall(self, context, id, firewall):
         #LOG.debug(_("update_firewall() called"))
         #self._ensure_update_firewall(context, id)
-        #firewall['firewall']['status'] = const.PENDING_UPDATE
-        firewall['firewall']['status'] = const.ACTIVE
+        firewall['firewall']['status'] = const.PENDING_UPDATE
         fw = super(FirewallPlugin, self).update_firewall(context, id, firewall)
-        fw_with_rules = (
-            self._make_firewall_dict_with_rules(context, fw['id']))
-        #self.agent_rpc.update_firewall(context, fw_with_rules)
-        self.driver.firewall_config_update(context,fw['id'],fw_with_rules)
+        self.workers.submit(self._push_firewalls, [fw['id']])
         return fw
 
     def delete_db_firewall_object(self, context, id):
@@ -149,27 +340,25 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
         if firewall['status'] in [const.PENDING_DELETE]:
             super(FirewallPlugin, self).delete_firewall(context, id)
 
+    @retry_on_conflict
     def delete_firewall(self, context, id):
         #LOG.debug(_("delete_firewall() called"))
         status_update = {"firewall": {"status": const.PENDING_DELETE}}
-        fw = super(FirewallPlugin, self).update_firewall(context, id,
-                                                         status_update)
-        fw_with_rules = (
-            self._make_firewall_dict_with_rules(context, fw['id']))
-        self.driver.firewall_config_delete(context,fw['config_handle_id'],fw_with_rules)
-        super(FirewallPlugin, self).delete_firewall(context, id)
-        #self.agent_rpc.delete_firewall(context, fw_with_rules)
-        
+        super(FirewallPlugin, self).update_firewall(context, id, status_update)
+        self.workers.submit(self._delete_firewall, id)
+
     def get_firewall(self, context, id, fields=None):
 	#LOG.debug(_("get_firewall() called"))
-	fw_details = super(FirewallPlugin, self).get_firewall(context, id)
-        config_handle_id = fw_details['config_handle_id']
-	if config_handle_id:
-	    config_details = self.get_config_handle(context, config_handle_id)
-	    fw_details.update({'config_mode': config_details['config_mode']})
-	else:
-	    fw_details.update({'config_mode': None})
-        return fw_details
+        db_fields = fields
+        if fields and 'config_mode' in fields:
+            # The config mode is looked up through the config handle.
+            db_fields = list(fields) + ['config_handle_id']
+        fw_details = super(FirewallPlugin, self).get_firewall(context, id,
+                                                              db_fields)
+        if not fields or 'config_mode' in fields:
+            fw_details.update({'config_mode': self._get_config_mode(
+                context, fw_details['config_handle_id'])})
+        return self._fields(fw_details, fields)
 
 
     def create_firewall_policy(self,context,firewall_policy):
@@ -177,6 +366,7 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
         fwp = super(FirewallPlugin, self).create_firewall_policy(context, firewall_policy)
         return fwp
     
+    @retry_on_conflict
     def update_firewall_policy(self, context, id, firewall_policy):
         #LOG.debug(_("update_firewall_policy() called"))
         #self._ensure_update_firewall_policy(context, id)
@@ -185,6 +375,30 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
         self._rpc_update_firewall_policy(context, id)
         return fwp
 
+    @retry_on_conflict
+    def create_firewall_rule(self, context, firewall_rule):
+        #LOG.debug(_("create_firewall_rule() called"))
+        fwr = super(FirewallPlugin,
+                    self).create_firewall_rule(context, firewall_rule)
+        # A rule created with a firewall_policy_id is attached to it.
+        if fwr['firewall_policy_id']:
+            self._rpc_update_firewall_policy(context,
+                                             fwr['firewall_policy_id'])
+        return fwr
+
+    @retry_on_conflict
+    def create_firewall_rule_bulk(self, context, firewall_rules):
+        #LOG.debug(_("create_firewall_rule_bulk() called"))
+        fwrs = super(FirewallPlugin,
+                     self).create_firewall_rule_bulk(context, firewall_rules)
+        # One push per policy the new rules were attached to.
+        for firewall_policy_id in set(fwr['firewall_policy_id']
+                                      for fwr in fwrs):
+            if firewall_policy_id:
+                self._rpc_update_firewall_policy(context, firewall_policy_id)
+        return fwrs
+
+    @retry_on_conflict
     def update_firewall_rule(self, context, id, firewall_rule):
         #LOG.debug(_("update_firewall_rule() called"))
         #self._ensure_update_or_delete_firewall_rule(context, id)
@@ -196,6 +410,7 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
             pass
         return fwr
 
+    @retry_on_conflict
     def delete_firewall_rule(self, context, id):
         #LOG.debug(_("delete_firewall_rule() called"))
         #self._ensure_update_or_delete_firewall_rule(context, id)
@@ -216,14 +431,17 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
             self._rpc_update_firewall_policy(context, firewall_policy_id)
             pass
 
+    @retry_on_conflict
     def insert_rule(self, context, id, rule_info):
         #LOG.debug(_("insert_rule() called"))
         #self._ensure_update_firewall_policy(context, id)
         fwp = super(FirewallPlugin,
                     self).insert_rule(context, id, rule_info)
+        self._submit_rule_rebalances()
         self._rpc_update_firewall_policy(context, id)
         return fwp
 
+    @retry_on_conflict
     def remove_rule(self, context, id, rule_info):
         #LOG.debug(_("remove_rule() called"))
         #self._ensure_update_firewall_policy(context, id)
@@ -231,6 +449,22 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
                     self).remove_rule(context, id, rule_info)
         self._rpc_update_firewall_policy(context, id)
         return fwp
+
+    @retry_on_conflict
+    def add_rules(self, context, id, rules_info):
+        #LOG.debug(_("add_rules() called"))
+        fwp = super(FirewallPlugin,
+                    self).add_rules(context, id, rules_info)
+        self._rpc_update_firewall_policy(context, id)
+        return fwp
+
+    @retry_on_conflict
+    def remove_rules(self, context, id, rules_info):
+        #LOG.debug(_("remove_rules() called"))
+        fwp = super(FirewallPlugin,
+                    self).remove_rules(context, id, rules_info)
+        self._rpc_update_firewall_policy(context, id)
+        return fwp
     
     def create_networkfunction(self, context, networkfunction):
         v = self.db.create_networkfunction(context, networkfunction)
@@ -261,12 +495,20 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
     
     def update_config_handle(self, context, config_handle_id, config_handle):
         #LOG.debug(_('Update config_handle %s'), config_handle_id)
-        v_new = self.db.update_config_handle(context, config_handle_id, config_handle)
+        with context.session.begin(subtransactions=True):
+            v_new = self.db.update_config_handle(context, config_handle_id, config_handle)
+            # The config mode is shipped with every firewall of the handle,
+            # its consumers get all of them again.
+            self._journal_change(context, const.JOURNAL_RESYNC,
+                                 config_handle_id=config_handle_id)
         return v_new
     
     def delete_config_handle(self, context, config_handle_id):
         #LOG.debug(_('Delete config_handle %s'), config_handle_id)
-        self.db.delete_config_handle(context, config_handle_id)
+        with context.session.begin(subtransactions=True):
+            self.db.delete_config_handle(context, config_handle_id)
+            self._journal_change(context, const.JOURNAL_RESYNC,
+                                 config_handle_id=config_handle_id)
     
     def get_config_handle(self, context, config_handle_id, fields=None):
         #LOG.debug(_('Get config_handle %s'), config_handle_id)
@@ -285,26 +527,162 @@ class FirewallPlugin(FirewallListener, firewall_db.Firewall_db_mixin):
         c = config['config']
         id = c['config_handle_id']
         slug = c['slug']
-        version = c['version']
-        filters = {}
-        filters['config_handle_id']= [id]
-        firewalls = super(FirewallPlugin,
-                    self).get_firewalls(context, filters=filters)
-        data = []
-        for fw in firewalls:
-            fw_with_rules = (
-                self._make_firewall_dict_with_rules(context, fw['id']))
-            data.append(fw_with_rules)
+        format_version = config_encoding.negotiate_format(
+            c.get('format_version'))
+        if c.get('header') == const.CONFIG_HEADER_DELTA:
+            res = self._create_config_delta(context, c, format_version)
+            if res:
+                return res
+            # The journal no longer covers the consumer's version, fall
+            # back to sending the full configuration.
+        version, data = self._compile_config(context, id, format_version)
         res = {'config_handle_id': id,
             'response': data,
             'slug': slug,
-            'version': version,
-            'header': 'data'}
+            'version': str(version),
+            'format_version': format_version,
+            'header': const.CONFIG_HEADER_DATA}
         return res
+
+    def _get_firewall_statuses(self, context, config_handle_id):
+        firewalls = super(FirewallPlugin, self).get_firewalls(
+            context, filters={'config_handle_id': [config_handle_id]},
+            fields=['id', 'status'])
+        return tuple((fw['id'], fw['status']) for fw in firewalls)
+
+    def _compile_config(self, context, id, format_version, version=None,
+                        statuses=None):
+        if version is None:
+            # Read before the firewalls, a change committed while they are
+            # read moves the version and gets the config compiled again.
+            version = self.get_config_journal_head(context)
+        if statuses is None:
+            # The statuses follow the pushes without moving the version,
+            # the config is cached for the statuses it carries.
+            statuses = self._get_firewall_statuses(context, id)
+        data = self.config_cache.get(id, version, format_version, statuses)
+        if data is not None:
+            # Nothing changed since it was compiled.
+            return version, data
+        if format_version == const.CONFIG_FORMAT_COMPACT:
+            data = config_encoding.encode_config(self._compile_config(
+                context, id, const.CONFIG_FORMAT_JSON, version, statuses)[1])
+        else:
+            filters = {}
+            filters['config_handle_id']= [id]
+            data = super(FirewallPlugin, self).get_firewalls(
+                context, filters=filters)
+            # All firewalls fetched here share the same config handle, and
+            # the rules of each policy are read once for all its firewalls.
+            config_mode = self._get_config_mode(context, id)
+            fw_rules_lists = {}
+            fw_statuses = dict(statuses)
+            for fw_with_rules in data:
+                fw_with_rules['config_mode'] = config_mode
+                # A status changed since the statuses were read is left to
+                # the next lookup, which reads it as well.
+                fw_with_rules['status'] = fw_statuses.get(
+                    fw_with_rules['id'], fw_with_rules['status'])
+                fw_policy_id = fw_with_rules['firewall_policy_id']
+                if fw_policy_id not in fw_rules_lists:
+                    fw_rules_lists[fw_policy_id] = self._optimize_rules(
+                        self._get_policy_rule_list(context, fw_policy_id))
+                (fw_with_rules['firewall_rule_list'],
+                 fw_with_rules['firewall_rule_analysis']) = (
+                    fw_rules_lists[fw_policy_id])
+        self.config_cache.set(id, version, data, format_version, statuses)
+        return version, data
+
+    def _create_config_delta(self, context, c, format_version):
+        id = c['config_handle_id']
+        try:
+            from_version = int(c['version'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        version = self.get_config_journal_head(context)
+        delta = self.get_firewalls_delta(context, id, from_version)
+        if delta is None:
+            return None
+        config_mode = self._get_config_mode(context, id)
+        fw_rules_lists = {}
+        for fw_with_rules in delta['firewalls']:
+            fw_with_rules['config_mode'] = config_mode
+            if optimize_rules:
+                # Which rules are shipped depends on the whole policy, so
+                # changed firewalls are resent with their full rule list.
+                fw_policy_id = fw_with_rules['firewall_policy_id']
+                if fw_policy_id not in fw_rules_lists:
+                    fw_rules_lists[fw_policy_id] = self._optimize_rules(
+                        self._get_policy_rule_list(context, fw_policy_id))
+                fw_rules_list, fw_rules_analysis = (
+                    fw_rules_lists[fw_policy_id])
+                fw_with_rules.update(
+                    {'resync': True,
+                     'firewall_rule_ids': [rule['id']
+                                           for rule in fw_rules_list],
+                     'firewall_rule_list': fw_rules_list,
+                     'firewall_rule_analysis': fw_rules_analysis,
+                     'removed_firewall_rule_ids': []})
+        if format_version == const.CONFIG_FORMAT_COMPACT:
+            delta = config_encoding.encode_config(delta)
+        return {'config_handle_id': id,
+                'response': delta,
+                'slug': c['slug'],
+                'from_version': str(from_version),
+                'version': str(version),
+                'format_version': format_version,
+                'header': const.CONFIG_HEADER_DELTA}
     
+    def create_config_chunk(self, context, config):
+        c = config['config']
+        id = c['config_handle_id']
+        # Full configurations are the same for every consumer, deltas
+        # depend on the version the consumer holds.
+        from_version = None
+        if c.get('header') == const.CONFIG_HEADER_DELTA:
+            from_version = c.get('version')
+        format_version = config_encoding.negotiate_format(
+            c.get('format_version'))
+        key = (id, c.get('header'), from_version, format_version,
+               self.get_config_journal_head(context))
+        chunks = self.config_chunks.get(key)
+        if chunks is None:
+            res = self.create_config(context, config)
+            chunks = config_chunks.split_config(res, config_chunk_size)
+            self.config_chunks.set(key, chunks)
+        try:
+            sequence = int(c['chunk_sequence'])
+        except (TypeError, ValueError):
+            sequence = -1
+        if not 0 <= sequence < len(chunks):
+            raise fw_ext.FirewallConfigChunkNotFound(
+                chunk_sequence=c['chunk_sequence'], config_handle_id=id)
+        return chunks[sequence]
+
+    def report_firewall_hosts(self, context, host, firewall_ids):
+        # Called by the agents over RPC, each with the full list of the
+        # firewalls it runs, so that pushes are cast to those hosts only.
+        LOG.debug(_('Agent on %(host)s runs firewalls %(ids)s'),
+                  {'host': host, 'ids': firewall_ids})
+        self.set_firewall_hosts(self._get_admin_context(), host, firewall_ids)
+
+    def get_dispatch_stats(self, context):
+        """
+        Return the counters of the push coalescing and of the driver
+        worker pool: queue depth, wait and latency of the driver calls.
+        Called over RPC by operators.
+        """
+        return {'push': self.push_dispatcher.get_stats(),
+                'workers': self.workers.get_stats()}
+
     def generate_firewall_config(self,context, config):
 	LOG.debug(_('Generating Firewall Configuration %s'), str(config))
 	ctx = crd_context.get_admin_context()
-	data = self.create_config(ctx, config['body'])
+	if 'chunk_sequence' in config['body']['config']:
+	    # The consumer pages through the configuration chunk by chunk, a
+	    # version change between pages means it has to start over.
+	    data = self.create_config_chunk(ctx, config['body'])
+	else:
+	    data = self.create_config(ctx, config['body'])
 	LOG.debug(_('Generated Firewall Configuration %s'), str(data))
 	return {'config':data}
@@ -0,0 +1,106 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import tempfile
+import unittest
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy import orm
+
+from nscs.crdservice.db import model_base
+from nscs_firewall.crdservice.db import firewall_db
+
+
+class TestContext(object):
+    """Request context holding a session of the test database."""
+
+    def __init__(self, session, tenant_id='tenant', is_admin=True):
+        self.session = session
+        self.tenant_id = tenant_id
+        self.is_admin = is_admin
+
+
+class SqlTestCase(unittest.TestCase):
+    """
+    Runs a test against an in-memory SQLite database holding the firewall
+    tables. statements lists the SQL statements executed since the last
+    reset_statements() call, as (statement, parameters) pairs.
+    """
+    # An in-memory database lives in a single connection, tests running
+    # concurrent sessions set this to share a database file instead.
+    database_file = False
+
+    def setUp(self):
+        super(SqlTestCase, self).setUp()
+        url = 'sqlite://'
+        if self.database_file:
+            fd, path = tempfile.mkstemp(suffix='.sqlite')
+            os.close(fd)
+            self.addCleanup(os.remove, path)
+            url = 'sqlite:///%s' % path
+        self.engine = sa.create_engine(url)
+        model_base.BASEV2.metadata.create_all(self.engine)
+        self.addCleanup(self.engine.dispose)
+        self._session_maker = orm.sessionmaker(bind=self.engine,
+                                               autocommit=True)
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute',
+                     self._record_statement)
+        self.plugin = firewall_db.Firewall_db_mixin()
+
+    def _record_statement(self, conn, cursor, statement, parameters,
+                          context, executemany):
+        self.statements.append((statement, parameters))
+
+    def reset_statements(self):
+        del self.statements[:]
+
+    def get_context(self, tenant_id='tenant', is_admin=True):
+        return TestContext(self._session_maker(), tenant_id, is_admin)
+
+    def add_policy(self, context, policy_id, rule_count, **kwargs):
+        """Add a policy holding rule_count rules, with rows of its own."""
+        with context.session.begin(subtransactions=True):
+            context.session.add(firewall_db.FirewallPolicy(
+                id=policy_id, tenant_id=context.tenant_id, name=policy_id))
+            for index in range(rule_count):
+                values = dict(
+                    id='%s-rule-%d' % (policy_id, index),
+                    tenant_id=context.tenant_id,
+                    firewall_policy_id=policy_id,
+                    position=(index + 1) * firewall_db.RULE_POSITION_GAP,
+                    protocol='tcp', ip_version=4, source_ip_address=None,
+                    destination_ip_address='10.0.%d.%d' % (index // 250,
+                                                           index % 250),
+                    destination_port_range_min=1000 + index,
+                    destination_port_range_max=1000 + index,
+                    action='allow', enabled=True, shared=False)
+                values.update(kwargs)
+                values.update(firewall_db.get_rule_match_values(values))
+                context.session.add(firewall_db.FirewallRule(**values))
+
+    def add_firewalls(self, context, policy_id, count,
+                      config_handle_id='handle'):
+        with context.session.begin(subtransactions=True):
+            for index in range(count):
+                context.session.add(firewall_db.Firewall(
+                    id='%s-fw-%d' % (policy_id, index),
+                    tenant_id=context.tenant_id,
+                    firewall_policy_id=policy_id, admin_state_up=True,
+                    status='ACTIVE', config_handle_id=config_handle_id))
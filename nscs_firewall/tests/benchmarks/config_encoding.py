@@ -0,0 +1,60 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Payload size and encode and decode times of the configuration formats, for
+a config handle with one firewall per policy size. Run with
+python -m nscs_firewall.tests.benchmarks.config_encoding
+"""
+
+import json
+import sys
+import time
+
+from nscs_firewall.crdservice.plugins.common import config_encoding
+from nscs_firewall.tests import fake_rules
+
+RULE_COUNTS = (1000, 10000, 100000)
+
+
+def _time(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, (time.time() - start) * 1000
+
+
+def run(rule_counts=RULE_COUNTS, out=sys.stdout):
+    out.write('%8s %12s %12s %6s %10s %10s %10s %10s\n' % (
+        'rules', 'json bytes', 'compact', 'ratio', 'json enc', 'json dec',
+        'comp enc', 'comp dec'))
+    for count in rule_counts:
+        response = fake_rules.make_firewalls(
+            fake_rules.make_rules(count), 1)
+        payload, json_encode = _time(json.dumps, response)
+        decoded, json_decode = _time(json.loads, payload)
+        data, compact_encode = _time(config_encoding.encode_config,
+                                     response)
+        decoded, compact_decode = _time(config_encoding.decode_config, data)
+        assert decoded == response
+        out.write('%8d %12d %12d %6.2f %8.0fms %8.0fms %8.0fms %8.0fms\n' % (
+            count, len(payload), len(data),
+            float(len(data)) / len(payload), json_encode, json_decode,
+            compact_encode, compact_decode))
+
+
+if __name__ == '__main__':
+    run()
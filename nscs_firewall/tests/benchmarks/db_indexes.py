@@ -0,0 +1,184 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Query plans and times of the hot firewall lookups on a seeded database,
+before and after migration.upgrade_indexes() creates the indexes declared
+on the models. The tables are created without their secondary indexes,
+as a database of an earlier release has them, and seeded with rules spread
+over policies, and firewalls spread over config handles. Run with
+python -m nscs_firewall.tests.benchmarks.db_indexes [--rules N] [URL]
+The default URL is a SQLite file in a temporary directory, a MySQL URL
+runs the queries under EXPLAIN instead of EXPLAIN QUERY PLAN. The tables
+of a given database are dropped first.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+from nscs.crdservice.db import model_base
+from nscs_firewall.crdservice.db import firewall_db
+from nscs_firewall.crdservice.db import migration
+
+RULES_PER_POLICY = 500
+FIREWALLS_PER_POLICY = 10
+FIREWALLS_PER_HANDLE = 10
+TENANTS = 100
+BATCH_SIZE = 10000
+REPEAT = 20
+
+# The lookups of firewall_db, with the parameters of a policy, tenant and
+# handle in the middle of the seeded data.
+QUERIES = (
+    ('rules of a policy in order',
+     'SELECT id FROM firewall_rules WHERE firewall_policy_id = :policy_id '
+     'ORDER BY position'),
+    ('neighbour key of an insert',
+     'SELECT position FROM firewall_rules '
+     'WHERE firewall_policy_id = :policy_id '
+     'ORDER BY position LIMIT 1 OFFSET 250'),
+    ('rules of a tenant',
+     'SELECT id FROM firewall_rules WHERE tenant_id = :tenant_id'),
+    ('firewalls using a policy',
+     'SELECT id FROM firewalls WHERE firewall_policy_id = :policy_id'),
+    ('firewalls of a config handle',
+     'SELECT id FROM firewalls WHERE config_handle_id = :handle_id'),
+    ('journal of a config handle',
+     'SELECT id FROM firewall_config_journal '
+     'WHERE config_handle_id = :handle_id AND id > 0'),
+)
+
+
+def seed(engine, rule_count):
+    policy_count = max(1, rule_count // RULES_PER_POLICY)
+    policies = firewall_db.FirewallPolicy.__table__
+    rules = firewall_db.FirewallRule.__table__
+    firewalls = firewall_db.Firewall.__table__
+    journal = firewall_db.FirewallConfigJournal.__table__
+    engine.execute(policies.insert(), [
+        {'id': 'policy-%d' % index, 'tenant_id': 'tenant-%d' % (
+            index % TENANTS), 'name': 'policy %d' % index}
+        for index in range(policy_count)])
+    for start in range(0, rule_count, BATCH_SIZE):
+        rows = []
+        for index in range(start, min(start + BATCH_SIZE, rule_count)):
+            policy = index % policy_count
+            rows.append({
+                'id': 'rule-%d' % index,
+                'tenant_id': 'tenant-%d' % (policy % TENANTS),
+                'name': 'rule %d' % index,
+                'firewall_policy_id': 'policy-%d' % policy,
+                'position': (index // policy_count + 1) *
+                firewall_db.RULE_POSITION_GAP,
+                'protocol': 'tcp', 'ip_version': 4,
+                'destination_ip_address': '10.%d.%d.%d' % (
+                    index >> 16 & 255, index >> 8 & 255, index & 255),
+                'destination_port_range_min': 1 + index % 65535,
+                'destination_port_range_max': 1 + index % 65535,
+                'action': 'allow', 'enabled': True, 'shared': False})
+        engine.execute(rules.insert(), rows)
+    fw_rows = [{'id': 'fw-%d' % index,
+                'tenant_id': 'tenant-%d' % (index % TENANTS),
+                'name': 'fw %d' % index,
+                'firewall_policy_id': 'policy-%d' % (index % policy_count),
+                'config_handle_id': 'handle-%d' % (
+                    index // FIREWALLS_PER_HANDLE),
+                'status': 'ACTIVE', 'admin_state_up': True}
+               for index in range(policy_count * FIREWALLS_PER_POLICY)]
+    engine.execute(firewalls.insert(), fw_rows)
+    engine.execute(journal.insert(), [
+        {'id': index + 1, 'operation': 'update',
+         'firewall_id': fw['id'],
+         'config_handle_id': fw['config_handle_id']}
+        for index, fw in enumerate(fw_rows)])
+    middle = policy_count // 2
+    return {'policy_id': 'policy-%d' % middle,
+            'tenant_id': 'tenant-%d' % (middle % TENANTS),
+            'handle_id': 'handle-%d' % (
+                middle * FIREWALLS_PER_POLICY // FIREWALLS_PER_HANDLE)}
+
+
+def drop_indexes(engine):
+    for table in migration.TABLES:
+        for index in table.indexes:
+            index.drop(engine)
+
+
+def measure(engine, params):
+    """Return the plan and the average time of every query."""
+    explain = ('EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite'
+               else 'EXPLAIN ')
+    results = []
+    for name, sql in QUERIES:
+        plan = engine.execute(sa.text(explain + sql), params).fetchall()
+        start = time.time()
+        for attempt in range(REPEAT):
+            engine.execute(sa.text(sql), params).fetchall()
+        elapsed = (time.time() - start) * 1000 / REPEAT
+        results.append((name, [' '.join(str(value) for value in row)
+                               for row in plan], elapsed))
+    return results
+
+
+def run(url, rule_count, out=sys.stdout):
+    engine = sa.create_engine(url)
+    model_base.BASEV2.metadata.drop_all(engine)
+    model_base.BASEV2.metadata.create_all(engine)
+    drop_indexes(engine)
+    start = time.time()
+    params = seed(engine, rule_count)
+    out.write('Seeded %d rules in %.0fs\n' % (rule_count,
+                                              time.time() - start))
+    before = measure(engine, params)
+    start = time.time()
+    migration.upgrade_indexes(engine)
+    out.write('Created the indexes in %.1fs\n' % (time.time() - start))
+    after = measure(engine, params)
+    for (name, plan_before, time_before), (_name, plan_after, time_after) in (
+            zip(before, after)):
+        out.write('\n%s: %.2fms -> %.2fms\n' % (name, time_before,
+                                                time_after))
+        for line in plan_before:
+            out.write('  before: %s\n' % line)
+        for line in plan_after:
+            out.write('  after:  %s\n' % line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rules', type=int, default=1000000)
+    parser.add_argument('url', nargs='?')
+    args = parser.parse_args(argv)
+    if args.url:
+        run(args.url, args.rules)
+        return
+    directory = tempfile.mkdtemp()
+    try:
+        run('sqlite:///' + os.path.join(directory, 'firewall.db'),
+            args.rules)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Expansion factor of port ranges compiled into masked matches: the number
+of matches per range for prefix covers and for the covers picked by
+compile_range(), over several kinds of ranges, and per rule for a random
+policy. Run with
+python -m nscs_firewall.tests.benchmarks.match_compiler
+"""
+
+import random
+import sys
+import time
+
+from nscs_firewall.crdservice.db import match_compiler
+from nscs_firewall.tests import fake_rules
+
+RANGE_COUNT = 10000
+TOP = (1 << match_compiler.PORT_BITS) - 1
+
+
+def _uniform(rng):
+    port_min = rng.randint(0, TOP)
+    return port_min, rng.randint(port_min, TOP)
+
+
+def _short(rng):
+    port_min = rng.randint(0, TOP)
+    return port_min, min(TOP, port_min + rng.randint(0, 1024))
+
+
+def _high(rng):
+    # Ephemeral and registered port ranges, open at the top.
+    return rng.randint(1, 49152), TOP
+
+
+RANGES = (('uniform', _uniform), ('short', _short), ('open top', _high))
+WORST_CASES = ((1, TOP - 1), (1, 49151), (1024, TOP - 1), (2, TOP - 2))
+
+
+def _stats(counts):
+    counts = sorted(counts)
+    return (float(sum(counts)) / len(counts), counts[len(counts) // 2],
+            counts[-1])
+
+
+def run(range_count=RANGE_COUNT, out=sys.stdout):
+    rng = random.Random(25)
+    out.write('%-10s %26s %26s %10s\n' % (
+        'ranges', 'prefix mean/median/max', 'compiled mean/median/max',
+        'us/range'))
+    for name, make_range in RANGES:
+        ranges = [make_range(rng) for index in range(range_count)]
+        prefixes = [len(match_compiler.range_to_prefixes(*port_range))
+                    for port_range in ranges]
+        start = time.time()
+        compiled = [len(match_compiler.compile_range(*port_range))
+                    for port_range in ranges]
+        elapsed = (time.time() - start) * 1e6 / range_count
+        out.write('%-10s %26s %26s %10.1f\n' % (
+            name, '%.2f / %d / %d' % _stats(prefixes),
+            '%.2f / %d / %d' % _stats(compiled), elapsed))
+    out.write('\n%-14s %8s %9s\n' % ('range', 'prefixes', 'compiled'))
+    for port_min, port_max in WORST_CASES:
+        out.write('%-14s %8d %9d\n' % (
+            '%d-%d' % (port_min, port_max),
+            len(match_compiler.range_to_prefixes(port_min, port_max)),
+            len(match_compiler.compile_range(port_min, port_max))))
+    rules = fake_rules.make_rules(range_count)
+    for rule in rules[::3]:
+        rule['source_port'] = '1024:65535'
+    report = match_compiler.expansion_report(rules)
+    expansion = [entry['expansion'] for entry in report]
+    mean, median, most = _stats(expansion)
+    out.write('\n%d rules, a third with source port 1024-65535: %d matches '
+              'compiled, %d as prefixes, expansion mean %.2f max %d\n' % (
+                  len(rules), sum(expansion),
+                  sum(entry['prefix_expansion'] for entry in report),
+                  mean, most))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,168 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Time and statements taken to read the rule and firewall IDs of a large
+policy, by loading the rule and firewall objects of the policy
+relationships and by the ID column queries of _get_policy_member_ids, and
+to get and list policies through the plugin. Run with
+python -m nscs_firewall.tests.benchmarks.policy_members [--rules N] [URL]
+The default URL is a SQLite file in a temporary directory. The tables of a
+given database are dropped first.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy import orm
+
+from nscs.crdservice.db import model_base
+from nscs_firewall.crdservice.db import firewall_db
+from nscs_firewall.tests import base
+
+FIREWALL_COUNT = 5
+# Small policies listed along with the large one.
+OTHER_POLICIES = 20
+OTHER_POLICY_RULES = 10
+BATCH_SIZE = 10000
+REPEAT = 5
+
+
+def seed(engine, rule_count):
+    policies = firewall_db.FirewallPolicy.__table__
+    rules = firewall_db.FirewallRule.__table__
+    firewalls = firewall_db.Firewall.__table__
+    sizes = [('large', rule_count)] + [
+        ('small-%d' % index, OTHER_POLICY_RULES)
+        for index in range(OTHER_POLICIES)]
+    engine.execute(policies.insert(), [
+        {'id': policy_id, 'tenant_id': 'tenant', 'name': policy_id}
+        for policy_id, count in sizes])
+    for policy_id, count in sizes:
+        for start in range(0, count, BATCH_SIZE):
+            # Rules are inserted in reverse order of their positions, so
+            # the order comes from the position and not the row order.
+            engine.execute(rules.insert(), [
+                {'id': '%s-rule-%d' % (policy_id, index),
+                 'tenant_id': 'tenant', 'firewall_policy_id': policy_id,
+                 'position': (count - index) * firewall_db.RULE_POSITION_GAP,
+                 'protocol': 'tcp', 'ip_version': 4,
+                 'destination_ip_address': '10.%d.%d.%d' % (
+                     index >> 16 & 255, index >> 8 & 255, index & 255),
+                 'destination_port_range_min': 1 + index % 65535,
+                 'destination_port_range_max': 1 + index % 65535,
+                 'action': 'allow', 'enabled': True, 'shared': False}
+                for index in range(start, min(start + BATCH_SIZE, count))])
+    engine.execute(firewalls.insert(), [
+        {'id': 'fw-%d' % index, 'tenant_id': 'tenant',
+         'firewall_policy_id': 'large', 'config_handle_id': 'handle',
+         'status': 'ACTIVE', 'admin_state_up': True}
+        for index in range(FIREWALL_COUNT)])
+
+
+def load_members(context, policy_id):
+    """The IDs read through the relationships of the policy object."""
+    fwp_db = context.session.query(firewall_db.FirewallPolicy).get(policy_id)
+    return ([fwr_db.id for fwr_db in fwp_db.firewall_rules],
+            [fw_db.id for fw_db in fwp_db.firewalls])
+
+
+def query_members(context, policy_id):
+    plugin = firewall_db.Firewall_db_mixin()
+    rule_ids, firewall_ids = plugin._get_policy_member_ids(
+        context.session, [policy_id])
+    return rule_ids[policy_id], firewall_ids[policy_id]
+
+
+def measure(engine, func, *args):
+    """
+    Return the result of func, its average time and its statement count.
+    Every call gets a session of its own, after one call warming up the
+    database cache.
+    """
+    statements = []
+
+    def record(*event_args):
+        statements.append(event_args)
+    session_maker = orm.sessionmaker(bind=engine, autocommit=True)
+    func(base.TestContext(session_maker()), *args)
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        start = time.time()
+        for attempt in range(REPEAT):
+            result = func(base.TestContext(session_maker()), *args)
+        elapsed = (time.time() - start) * 1000 / REPEAT
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return result, elapsed, len(statements) // REPEAT
+
+
+def run(url, rule_count, out=sys.stdout):
+    engine = sa.create_engine(url)
+    model_base.BASEV2.metadata.drop_all(engine)
+    model_base.BASEV2.metadata.create_all(engine)
+    start = time.time()
+    seed(engine, rule_count)
+    out.write('Seeded a policy of %d rules in %.0fs\n' % (
+        rule_count, time.time() - start))
+    plugin = firewall_db.Firewall_db_mixin()
+    loaded, load_time, load_statements = measure(engine, load_members,
+                                                 'large')
+    queried, query_time, query_statements = measure(engine, query_members,
+                                                    'large')
+    assert loaded[0] == queried[0]
+    assert sorted(loaded[1]) == sorted(queried[1])
+    cases = [
+        ('member IDs by relationships', load_time, load_statements),
+        ('member IDs by ID columns', query_time, query_statements)]
+    for name, args in (
+            ('get_firewall_policy', ('large',)),
+            ('get_firewall_policy firewall_list', ('large',
+                                                   ['firewall_list'])),
+            ('get_firewall_policies', ())):
+        func = getattr(plugin, name.split()[0])
+        result, elapsed, statements = measure(engine, func, *args)
+        cases.append((name, elapsed, statements))
+    out.write('%-36s %10s %10s\n' % ('', 'time', 'statements'))
+    for name, elapsed, statements in cases:
+        out.write('%-36s %8.0fms %10d\n' % (name, elapsed, statements))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rules', type=int, default=50000)
+    parser.add_argument('url', nargs='?')
+    args = parser.parse_args(argv)
+    if args.url:
+        run(args.url, args.rules)
+        return
+    directory = tempfile.mkdtemp()
+    try:
+        run('sqlite:///' + os.path.join(directory, 'firewall.db'),
+            args.rules)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Lookup throughput of RuleClassifier against a linear first-match scan, by
+policy size, for two kinds of policies: the mixed rules of fake_rules,
+whose catch-all rules end most linear scans early, and host rules, each
+for one destination address, where a linear scan walks most of the policy.
+Run with
+python -m nscs_firewall.tests.benchmarks.rule_classifier
+"""
+
+import itertools
+import random
+import sys
+import time
+
+from nscs_firewall.crdservice.plugins.common import rule_classifier
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+from nscs_firewall.tests import fake_rules
+
+POLICY_SIZES = (100, 1000, 10000, 100000)
+PACKET_COUNT = 2000
+# The linear scan is timed on fewer packets, as it takes seconds per
+# thousand packets on the largest policies.
+LINEAR_PACKET_COUNT = 100
+
+
+class LinearScan(object):
+    """First match by walking the parsed rules in order."""
+
+    def __init__(self, rules):
+        self.matches = [rule_optimizer.RuleMatch(rule, index)
+                        for index, rule in enumerate(rules)
+                        if rule['enabled']]
+
+    def classify(self, packet):
+        ip_version = packet['ip_version']
+        protocol = rule_optimizer.parse_protocol(packet['protocol'])
+        src = rule_optimizer.parse_address(packet['source_ip_address'],
+                                           ip_version)[0]
+        dst = rule_optimizer.parse_address(packet['destination_ip_address'],
+                                           ip_version)[0]
+        src_port = packet.get('source_port', 0)
+        dst_port = packet.get('destination_port', 0)
+        for match in self.matches:
+            if (match.ip_version == ip_version and
+                    (match.protocol is None or match.protocol == protocol) and
+                    match.src_min <= src <= match.src_max and
+                    match.dst_min <= dst <= match.dst_max and
+                    match.src_port_min <= src_port <= match.src_port_max and
+                    match.dst_port_min <= dst_port <= match.dst_port_max):
+                return match.rule
+        return None
+
+
+def make_host_rules(count):
+    rules = fake_rules.make_rules(count)
+    for index, rule in enumerate(rules):
+        rule.update(ip_version=4,
+                    source_ip_address='10.%d.0.0/16' % (index % 256),
+                    destination_ip_address='172.16.%d.%d' % (
+                        index // 250 % 256, index % 250))
+    return rules
+
+
+POLICIES = (('mixed', fake_rules.make_rules), ('hosts', make_host_rules))
+
+
+def _lookups_per_second(classifier, packets):
+    start = time.time()
+    for packet in packets:
+        classifier.classify(packet)
+    return len(packets) / max(time.time() - start, 1e-9)
+
+
+def run(policy_sizes=POLICY_SIZES, out=sys.stdout):
+    out.write('%6s %8s %10s %8s %14s %14s %8s\n' % (
+        'policy', 'rules', 'build', 'groups', 'classifier/s', 'linear/s',
+        'speedup'))
+    for (name, make_rules), size in itertools.product(POLICIES,
+                                                      policy_sizes):
+        rules = make_rules(size)
+        rng = random.Random(size)
+        packets = [fake_rules.make_packet(rules, rng)
+                   for index in range(PACKET_COUNT)]
+        start = time.time()
+        classifier = rule_classifier.RuleClassifier(rules)
+        build = (time.time() - start) * 1000
+        classified = _lookups_per_second(classifier, packets)
+        linear = _lookups_per_second(LinearScan(rules),
+                                     packets[:LINEAR_PACKET_COUNT])
+        out.write('%6s %8d %8.0fms %8d %14.0f %14.0f %7.0fx\n' % (
+            name, size, build, len(classifier._groups), classified, linear,
+            classified / linear))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,127 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Random firewall rules and packets for the tests and benchmarks. Rules are
+shaped like the rule dicts built by
+Firewall_db_mixin._make_firewall_rule_dict.
+"""
+
+import random
+import socket
+
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+
+SOURCE_NETWORKS = (None, '10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24',
+                   '192.168.0.0/16')
+
+
+def make_rule(index, rng, policy_id='policy'):
+    ip_version = 6 if index % 10 == 0 else 4
+    if ip_version == 6:
+        source = None
+        destination = rng.choice([None, '2001:db8::/32',
+                                  '2001:db8:%x::/48' % rng.randint(0, 20)])
+    else:
+        source = rng.choice(SOURCE_NETWORKS)
+        destination = rng.choice([None, '172.16.0.0/12',
+                                  '172.16.%d.0/24' % rng.randint(0, 15),
+                                  '172.16.%d.%d' % (rng.randint(0, 15),
+                                                    rng.randint(0, 255))])
+    low = rng.randint(1, 65535)
+    return {'id': 'rule-%d' % index,
+            'tenant_id': 'tenant',
+            'name': 'rule %d' % index,
+            'description': '',
+            'firewall_policy_id': policy_id,
+            'shared': False,
+            'protocol': rng.choice([None, 'tcp', 'tcp', 'udp', 'icmp']),
+            'ip_version': ip_version,
+            'source_ip_address': source,
+            'destination_ip_address': destination,
+            'source_port': None,
+            'destination_port': rng.choice(
+                [None, '80', '443', '1000:2000', str(low),
+                 '%d:%d' % (low, min(65535, low + rng.randint(0, 4096)))]),
+            'action': rng.choice(['allow', 'deny']),
+            'position': index + 1,
+            'enabled': rng.random() > 0.05,
+            'revision_number': 1}
+
+
+def make_rules(count, seed=0, policy_id='policy'):
+    rng = random.Random(seed)
+    return [make_rule(index, rng, policy_id) for index in range(count)]
+
+
+def make_firewalls(rules, count):
+    """Firewalls of one config handle sharing the policy of the rules."""
+    return [{'id': 'fw-%d' % index,
+             'tenant_id': 'tenant',
+             'name': 'fw %d' % index,
+             'description': '',
+             'shared': False,
+             'admin_state_up': True,
+             'status': 'ACTIVE',
+             'firewall_policy_id': 'policy',
+             'config_handle_id': 'handle',
+             'revision_number': 1,
+             'config_mode': 'NFV',
+             'firewall_rule_list': rules,
+             'firewall_rule_analysis': []}
+            for index in range(count)]
+
+
+def _format_address(value, ip_version):
+    family, bits = rule_optimizer.ADDRESS_FAMILIES[ip_version]
+    packed = ('%0*x' % (bits // 4, value)).decode('hex')
+    return socket.inet_ntop(family, packed)
+
+
+def make_packet(rules, rng):
+    """
+    Return a random packet, half of the time one that falls within the
+    networks and ports of a random rule.
+    """
+    if rules and rng.random() < 0.5:
+        match = rule_optimizer.RuleMatch(rng.choice(rules))
+        ip_version = match.ip_version
+        protocol = match.protocol
+        if protocol is None:
+            protocol = rng.choice([1, 6, 17])
+        src = rng.randint(match.src_min, match.src_max)
+        dst = rng.randint(match.dst_min, match.dst_max)
+        src_port = rng.randint(max(1, match.src_port_min),
+                               match.src_port_max)
+        dst_port = rng.randint(max(1, match.dst_port_min),
+                               match.dst_port_max)
+    else:
+        ip_version = rng.choice([4, 4, 4, 6])
+        bits = rule_optimizer.ADDRESS_FAMILIES[ip_version][1]
+        protocol = rng.choice([1, 6, 17])
+        src = rng.getrandbits(bits)
+        dst = rng.getrandbits(bits)
+        src_port = rng.randint(1, 65535)
+        dst_port = rng.randint(1, 65535)
+    packet = {'ip_version': ip_version,
+              'protocol': protocol,
+              'source_ip_address': _format_address(src, ip_version),
+              'destination_ip_address': _format_address(dst, ip_version)}
+    if protocol != 1:
+        packet['source_port'] = src_port
+        packet['destination_port'] = dst_port
+    return packet
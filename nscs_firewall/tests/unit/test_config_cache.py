@@ -0,0 +1,65 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from nscs_firewall.crdservice.plugins.common.config_cache import ConfigCache
+
+
+class TestConfigCache(unittest.TestCase):
+
+    def setUp(self):
+        super(TestConfigCache, self).setUp()
+        self.cache = ConfigCache()
+
+    def test_cached_at_version(self):
+        self.cache.set('handle', 7, 'config')
+        self.assertEqual('config', self.cache.get('handle', 7))
+        # Another process committed a change.
+        self.assertIsNone(self.cache.get('handle', 8))
+        self.assertIsNone(self.cache.get('other', 7))
+
+    def test_newer_version_replaces(self):
+        self.cache.set('handle', 7, 'old', 'json')
+        self.cache.set('handle', 7, 'old', 'compact')
+        self.cache.set('handle', 8, 'new', 'json')
+        self.assertEqual('new', self.cache.get('handle', 8, 'json'))
+        self.assertIsNone(self.cache.get('handle', 8, 'compact'))
+        self.assertIsNone(self.cache.get('handle', 7, 'json'))
+
+    def test_older_version_not_cached(self):
+        # A config compiled before a newer one was cached is dropped.
+        self.cache.set('handle', 8, 'new')
+        self.cache.set('handle', 7, 'old')
+        self.assertEqual('new', self.cache.get('handle', 8))
+        self.assertIsNone(self.cache.get('handle', 7))
+
+    def test_variants(self):
+        self.cache.set('handle', 7, 'json', 'json')
+        self.cache.set('handle', 7, 'compact', 'compact')
+        self.assertEqual('compact', self.cache.get('handle', 7, 'compact'))
+        self.assertEqual('json', self.cache.get('handle', 7, 'json'))
+        self.assertIsNone(self.cache.get('handle', 7))
+
+    def test_state_replaces(self):
+        self.cache.set('handle', 7, 'pending', 'json', ('PENDING_UPDATE',))
+        self.assertIsNone(self.cache.get('handle', 7, 'json', ('ACTIVE',)))
+        self.cache.set('handle', 7, 'active', 'json', ('ACTIVE',))
+        self.assertEqual('active',
+                         self.cache.get('handle', 7, 'json', ('ACTIVE',)))
+        self.assertIsNone(self.cache.get('handle', 7, 'json',
+                                         ('PENDING_UPDATE',)))
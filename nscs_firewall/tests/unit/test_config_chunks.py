@@ -0,0 +1,122 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import json
+
+from nscs_firewall.crdservice.plugins.common import config_chunks
+from nscs_firewall.crdservice.plugins.common.config_cache import ConfigCache
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins import fwaas_plugin
+from nscs_firewall.tests import base
+
+# The message bus limit the chunks are sized for.
+CHUNK_SIZE = 16384
+
+
+class ChunkTestPlugin(fwaas_plugin.FirewallPlugin):
+    """The configuration requests of the plugin, without its backends."""
+
+    def __init__(self):
+        self.config_cache = ConfigCache()
+        self.config_chunks = config_chunks.ConfigChunkStore()
+
+    def get_config_handle(self, context, config_handle_id, fields=None):
+        return {'id': config_handle_id, 'config_mode': 'NFV'}
+
+
+class TestSplitConfig(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestSplitConfig, self).setUp()
+        self.addCleanup(setattr, fwaas_plugin, 'config_chunk_size',
+                        fwaas_plugin.config_chunk_size)
+        fwaas_plugin.config_chunk_size = CHUNK_SIZE
+        self.plugin = ChunkTestPlugin()
+
+    def _request(self, **kwargs):
+        config = {'config_handle_id': 'handle', 'slug': 'firewall',
+                  'header': const.CONFIG_HEADER_DATA}
+        config.update(kwargs)
+        return {'config': config}
+
+    def _get_chunks(self, context, **kwargs):
+        # Pages through the configuration as a consumer does, chunk by
+        # chunk until the total announced by the first one.
+        chunks = []
+        total = 1
+        while len(chunks) < total:
+            chunk = self.plugin.create_config_chunk(
+                context, self._request(chunk_sequence=len(chunks), **kwargs))
+            total = chunk['response']['total']
+            chunks.append(chunk)
+        return chunks
+
+    def test_chunks_of_large_policy(self):
+        context = self.get_context()
+        # Quotes and backslashes are escaped once more within a chunk.
+        self.add_policy(context, 'policy', 300,
+                        description='"quoted" \\ \\\\ "' * 10)
+        self.add_firewalls(context, 'policy', 2)
+        full = self.plugin.create_config(context, self._request())
+        payload = json.dumps(full['response'])
+        self.assertTrue(len(payload) > 10 * CHUNK_SIZE)
+
+        chunks = self._get_chunks(context)
+        self.assertTrue(len(chunks) > 10)
+        for chunk in chunks:
+            self.assertTrue(len(json.dumps({'config': chunk})) <= CHUNK_SIZE)
+            self.assertEqual(hashlib.sha1(payload).hexdigest(),
+                             chunk['response']['checksum'])
+        config = config_chunks.join_config(chunks)
+        self.assertEqual(const.CONFIG_HEADER_DATA, config['header'])
+        self.assertEqual(json.loads(payload), config['response'])
+
+    def test_compact_chunks(self):
+        context = self.get_context()
+        self.add_policy(context, 'policy', 300)
+        self.add_firewalls(context, 'policy', 1)
+        chunks = self._get_chunks(
+            context, format_version=const.CONFIG_FORMAT_COMPACT)
+        for chunk in chunks:
+            self.assertTrue(len(json.dumps({'config': chunk})) <= CHUNK_SIZE)
+        full = self.plugin.create_config(
+            context, self._request(format_version=const.CONFIG_FORMAT_COMPACT))
+        self.assertEqual(full['response'],
+                         config_chunks.join_config(chunks)['response'])
+
+    def test_chunk_not_found(self):
+        context = self.get_context()
+        self.add_firewalls(context, None, 1)
+        self.assertEqual(1, len(self._get_chunks(context)))
+        self.assertRaises(fwaas_plugin.fw_ext.FirewallConfigChunkNotFound,
+                          self.plugin.create_config_chunk, context,
+                          self._request(chunk_sequence=1))
+
+    def test_split_worst_case_escaping(self):
+        config = {'config_handle_id': 'handle', 'header': 'data',
+                  'response': '\\"' * 5000}
+        chunks = config_chunks.split_config(config, 1000)
+        for chunk in chunks:
+            self.assertTrue(len(json.dumps({'config': chunk})) <= 1000)
+        self.assertEqual(config['response'],
+                         config_chunks.join_config(chunks)['response'])
+
+    def test_chunk_size_below_envelope(self):
+        config = {'config_handle_id': 'handle', 'header': 'data',
+                  'response': []}
+        self.assertRaises(ValueError, config_chunks.split_config, config, 100)
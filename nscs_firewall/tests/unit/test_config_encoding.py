@@ -0,0 +1,93 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nscs_firewall.crdservice.plugins.common import config_encoding
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+from nscs_firewall.tests import base
+from nscs_firewall.tests import fake_rules
+
+
+class TestConfigEncoding(base.SqlTestCase):
+
+    def _get_firewalls(self, rule_count):
+        context = self.get_context()
+        self.add_policy(context, 'policy', rule_count)
+        self.add_firewalls(context, 'policy', 2)
+        firewalls = self.plugin.get_firewalls(
+            context, filters={'config_handle_id': ['handle']})
+        for fw in firewalls:
+            fw['firewall_rule_list'] = (
+                self.plugin.get_firewall_policy_rule_list(context, 'policy'))
+        return firewalls
+
+    def test_rule_dict_keys_carried(self):
+        firewalls = self._get_firewalls(3)
+        rule = firewalls[0]['firewall_rule_list'][0]
+        self.assertIn('revision_number', rule)
+        decoded = config_encoding.decode_config(
+            config_encoding.encode_config(firewalls))
+        self.assertEqual(firewalls, decoded)
+
+    def _round_trip(self, response):
+        data = config_encoding.encode_config(response)
+        self.assertIsInstance(data, str)
+        return config_encoding.decode_config(data)
+
+    def test_full_round_trip(self):
+        rules = fake_rules.make_rules(500)
+        rules[0]['name'] = u'r\xe8gle "quoted" \\'
+        response = fake_rules.make_firewalls(rules, 3)
+        for fw in response:
+            (fw['firewall_rule_list'],
+             fw['firewall_rule_analysis']) = rule_optimizer.optimize_rules(
+                fw['firewall_rule_list'])
+        self.assertTrue(response[0]['firewall_rule_analysis'])
+        self.assertEqual(response, self._round_trip(response))
+
+    def test_empty_round_trip(self):
+        self.assertEqual([], self._round_trip([]))
+        self.assertEqual(fake_rules.make_firewalls([], 1),
+                         self._round_trip(fake_rules.make_firewalls([], 1)))
+
+    def test_delta_round_trip(self):
+        context = self.get_context()
+        self.add_policy(context, 'policy', 20)
+        self.add_firewalls(context, 'policy', 2)
+        head = self.plugin.get_config_journal_head(context)
+        with context.session.begin():
+            self.plugin._journal_changes(context, [
+                {'operation': const.JOURNAL_MODIFY,
+                 'firewall_policy_id': 'policy',
+                 'firewall_rule_id': 'policy-rule-3'},
+                {'operation': const.JOURNAL_REMOVE,
+                 'firewall_policy_id': 'policy',
+                 'firewall_rule_id': 'gone'},
+                {'operation': const.JOURNAL_RESYNC,
+                 'firewall_id': 'policy-fw-1',
+                 'config_handle_id': 'handle'},
+                {'operation': const.JOURNAL_DELETE,
+                 'firewall_id': 'deleted', 'config_handle_id': 'handle'}])
+        delta = self.plugin.get_firewalls_delta(context, 'handle', head)
+        self.assertEqual(2, len(delta['firewalls']))
+        self.assertEqual(['deleted'], delta['removed_firewall_ids'])
+        self.assertEqual(delta, self._round_trip(delta))
+
+    def test_unknown_rule_keys_follow_known_ones(self):
+        rules = [{'id': 'a', 'action': 'allow', 'zone': 'x', 'extra': 1}]
+        self.assertEqual(['id', 'action', 'extra', 'zone'],
+                         config_encoding._rule_fields(rules))
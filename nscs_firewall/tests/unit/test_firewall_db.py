@@ -0,0 +1,1077 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import re
+
+from nscs_firewall.crdservice.db import firewall_db
+from nscs_firewall.crdservice.db import migration
+from nscs_firewall.crdservice.extensions import firewall
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.tests import base
+
+
+class TestFirewallWithRules(base.SqlTestCase):
+
+    def test_firewall_with_rules(self):
+        context = self.get_context()
+        self.add_policy(context, 'policy', 100)
+        self.add_firewalls(context, 'policy', 1)
+        self.reset_statements()
+        fw = self.plugin.get_firewall_with_rules(self.get_context(),
+                                                 'policy-fw-0')
+        self.assertEqual(2, len(self.statements))
+        self.assertEqual('policy', fw['firewall_policy_id'])
+        self.assertEqual(100, len(fw['firewall_rule_list']))
+
+    def test_firewall_without_policy(self):
+        context = self.get_context()
+        self.add_firewalls(context, None, 1)
+        fw = self.plugin.get_firewall_with_rules(self.get_context(),
+                                                 'None-fw-0')
+        self.assertEqual([], fw['firewall_rule_list'])
+
+
+class TestConfigJournal(base.SqlTestCase):
+
+    def _journal(self, context, count, **kwargs):
+        with context.session.begin(subtransactions=True):
+            self.plugin._journal_changes(context, [
+                dict(operation=const.JOURNAL_UPDATE, **kwargs)
+                for index in range(count)])
+
+    def _get_journal_ids(self, context):
+        return [entry.id for entry in context.session.query(
+            firewall_db.FirewallConfigJournal).order_by(
+                firewall_db.FirewallConfigJournal.id)]
+
+    def test_journal_ids_from_sequence(self):
+        context = self.get_context()
+        self._journal(context, 3)
+        self._journal(context, 2)
+        self.assertEqual([1, 2, 3, 4, 5], self._get_journal_ids(context))
+        self.assertEqual(5, self.plugin.get_config_journal_head(context))
+
+    def test_sequence_survives_pruning(self):
+        context = self.get_context()
+        self._journal(context, 5)
+        context.session.query(firewall_db.FirewallConfigJournal).delete()
+        self._journal(context, 1)
+        self.assertEqual([6], self._get_journal_ids(context))
+
+    def test_rolled_back_ids_are_reused(self):
+        context = self.get_context()
+        self._journal(context, 2)
+        try:
+            with context.session.begin():
+                self.plugin._journal_change(context, const.JOURNAL_UPDATE)
+                raise ValueError()
+        except ValueError:
+            pass
+        self._journal(context, 1)
+        self.assertEqual([1, 2, 3], self._get_journal_ids(context))
+
+    def test_seed_sequence_after_journal(self):
+        context = self.get_context()
+        with context.session.begin():
+            for journal_id in (4, 9):
+                context.session.add(firewall_db.FirewallConfigJournal(
+                    id=journal_id, operation=const.JOURNAL_UPDATE))
+        migration.seed_config_journal_sequence(self.engine)
+        migration.seed_config_journal_sequence(self.engine)
+        self._journal(context, 1)
+        self.assertEqual([4, 9, 10], self._get_journal_ids(context))
+
+    def test_config_handle_change_resyncs_firewalls(self):
+        context = self.get_context()
+        self.add_policy(context, 'policy', 3)
+        self.add_firewalls(context, 'policy', 2)
+        self.add_firewalls(context, 'other', 1, config_handle_id='other')
+        head = self.plugin.get_config_journal_head(context)
+        self._journal(context, 1, config_handle_id='other')
+        self.assertEqual([], self.plugin.get_firewalls_delta(
+            context, 'handle', head)['firewalls'])
+        with context.session.begin():
+            self.plugin._journal_change(context, const.JOURNAL_RESYNC,
+                                        config_handle_id='handle')
+        delta = self.plugin.get_firewalls_delta(context, 'handle', head)
+        self.assertEqual(['policy-fw-0', 'policy-fw-1'],
+                         sorted(fw['id'] for fw in delta['firewalls']))
+        for fw in delta['firewalls']:
+            self.assertTrue(fw['resync'])
+            self.assertEqual(3, len(fw['firewall_rule_list']))
+
+    def test_journal_written_at_commit(self):
+        context = self.get_context()
+        with context.session.begin():
+            self.reset_statements()
+            self.plugin._journal_change(context, const.JOURNAL_UPDATE)
+            self.assertEqual([], self.statements)
+        # The sequence is updated first and the journal written last.
+        statements = [statement for statement, parameters in self.statements]
+        self.assertTrue(statements[0].startswith(
+            'UPDATE firewall_config_journal_sequence'))
+        self.assertTrue(statements[-1].startswith(
+            'INSERT INTO firewall_config_journal '))
+        self.assertEqual([1], self._get_journal_ids(context))
+
+
+class TestConcurrentConfigJournal(base.SqlTestCase):
+
+    database_file = True
+
+    def _get_journal_ids(self, context):
+        query = context.session.query(firewall_db.FirewallConfigJournal)
+        return dict((entry.firewall_id, entry.id) for entry in query)
+
+    def test_journal_ids_in_commit_order(self):
+        first = self.get_context()
+        second = self.get_context()
+        first.session.begin()
+        self.plugin._journal_change(first, const.JOURNAL_UPDATE,
+                                    firewall_id='first')
+        # The first transaction holds no lock on the sequence until it
+        # commits, the second one goes ahead and commits before it.
+        with second.session.begin():
+            self.plugin._journal_change(second, const.JOURNAL_UPDATE,
+                                        firewall_id='second')
+        first.session.commit()
+        self.assertEqual({'second': 1, 'first': 2},
+                         self._get_journal_ids(self.get_context()))
+
+    def test_rolled_back_session_keeps_no_changes(self):
+        first = self.get_context()
+        second = self.get_context()
+        first.session.begin()
+        self.plugin._journal_change(first, const.JOURNAL_UPDATE,
+                                    firewall_id='first')
+        first.session.rollback()
+        with second.session.begin():
+            self.plugin._journal_change(second, const.JOURNAL_UPDATE,
+                                        firewall_id='second')
+        with first.session.begin():
+            self.plugin._journal_change(first, const.JOURNAL_UPDATE,
+                                        firewall_id='third')
+        self.assertEqual({'second': 1, 'third': 2},
+                         self._get_journal_ids(self.get_context()))
+
+
+class TestRevisions(base.SqlTestCase):
+
+    database_file = True
+
+    def setUp(self):
+        super(TestRevisions, self).setUp()
+        context = self.get_context()
+        self.add_policy(context, 'policy', 3)
+        self.add_policy(context, 'other', 0)
+        # Two rules not in any policy.
+        self.add_policy(context, 'free', 2, firewall_policy_id=None,
+                        position=None)
+
+    def _write_rule_positions(self, rule_positions):
+        context = self.get_context()
+        with context.session.begin():
+            self.plugin._write_rule_positions(context, rule_positions)
+
+    def _get_rule_revision(self, rule_id):
+        return self.plugin.get_firewall_rule(self.get_context(),
+                                             rule_id)['revision_number']
+
+    def test_update_bumps_revision(self):
+        revision = self._get_rule_revision('policy-rule-0')
+        fwr = self.plugin.update_firewall_rule(
+            self.get_context(), 'policy-rule-0',
+            {'firewall_rule': {'name': 'renamed',
+                               'revision_number': revision}})
+        self.assertEqual(revision + 1, fwr['revision_number'])
+
+    def test_revision_mismatch(self):
+        revision = self._get_rule_revision('policy-rule-0')
+        self.assertRaises(firewall.FirewallRevisionMismatch,
+                          self.plugin.update_firewall_rule,
+                          self.get_context(), 'policy-rule-0',
+                          {'firewall_rule': {'name': 'renamed',
+                                             'revision_number': revision + 1}})
+        self.assertEqual(revision, self._get_rule_revision('policy-rule-0'))
+
+    def test_stale_write_is_concurrent_update(self):
+        first = self.get_context()
+        fwr_db = self.plugin._get_firewall_rule(first, 'policy-rule-0')
+        self.plugin.update_firewall_rule(
+            self.get_context(), 'policy-rule-0',
+            {'firewall_rule': {'name': 'second'}})
+
+        def write():
+            with first.session.begin():
+                fwr_db.name = 'first'
+                self.plugin._flush_revisions(first, 'firewall_rule',
+                                             'policy-rule-0')
+        self.assertRaises(firewall.FirewallConcurrentUpdate, write)
+        self.assertEqual('second', self.plugin.get_firewall_rule(
+            self.get_context(), 'policy-rule-0')['name'])
+
+    def test_insert_bumps_rule_revision(self):
+        revision = self._get_rule_revision('free-rule-0')
+        self.plugin.insert_rule(self.get_context(), 'policy',
+                                {'firewall_rule_id': 'free-rule-0'})
+        self.assertEqual(revision + 1, self._get_rule_revision('free-rule-0'))
+
+    def test_attach_rule_bound_meanwhile(self):
+        # The second request binds the rule after the first one read it
+        # unbound.
+        self.plugin.insert_rule(self.get_context(), 'other',
+                                {'firewall_rule_id': 'free-rule-0'})
+        self.assertRaises(firewall.FirewallConcurrentUpdate,
+                          self._write_rule_positions,
+                          [('free-rule-0', None, 'policy', 1),
+                           ('free-rule-1', None, 'policy', 2)])
+        self.assertEqual('other', self.plugin.get_firewall_rule(
+            self.get_context(), 'free-rule-0')['firewall_policy_id'])
+        # The whole write is rolled back.
+        self.assertIsNone(self.plugin.get_firewall_rule(
+            self.get_context(), 'free-rule-1')['firewall_policy_id'])
+        self.assertEqual(
+            ['policy-rule-0', 'policy-rule-1', 'policy-rule-2'],
+            self.plugin.get_firewall_policy_rule_ids(self.get_context(),
+                                                     'policy'))
+
+    def test_move_rule_removed_meanwhile(self):
+        self.plugin.remove_rule(self.get_context(), 'policy',
+                                {'firewall_rule_id': 'policy-rule-2'})
+        self.assertRaises(firewall.FirewallConcurrentUpdate,
+                          self._write_rule_positions,
+                          [('policy-rule-2', 'policy', 'policy', 1)])
+        self.assertIsNone(self.plugin.get_firewall_rule(
+            self.get_context(), 'policy-rule-2')['firewall_policy_id'])
+
+
+class TestCreateFirewallRules(base.SqlTestCase):
+
+    def _rule(self, name, **kwargs):
+        fwr = {'tenant_id': 'tenant', 'name': name, 'description': '',
+               'shared': False, 'protocol': 'tcp', 'ip_version': 4,
+               'source_ip_address': None,
+               'destination_ip_address': '10.0.0.0/24',
+               'source_port': None, 'destination_port': '80',
+               'action': 'allow', 'enabled': True}
+        fwr.update(kwargs)
+        return {'firewall_rule': fwr}
+
+    def _create(self, *rules):
+        return self.plugin.create_firewall_rule_bulk(
+            self.get_context(), {'firewall_rules': list(rules)})
+
+    def _get_rule_names(self, policy_id):
+        return [fwr['name'] for fwr in
+                self.plugin.get_firewall_policy_rule_list(self.get_context(),
+                                                          policy_id)]
+
+    def test_mixed_batch(self):
+        context = self.get_context()
+        self.add_policy(context, 'policy', 2, name='old')
+        self.add_policy(context, 'other', 0)
+        fwrs = self._create(
+            self._rule('free'),
+            self._rule('first', firewall_policy_id='policy', position=1),
+            self._rule('last', firewall_policy_id='policy'),
+            self._rule('past end', firewall_policy_id='policy',
+                       position='10'),
+            self._rule('other', firewall_policy_id='other'))
+        self.assertEqual([(None, None), ('policy', 1), ('policy', 4),
+                          ('policy', 5), ('other', 1)],
+                         [(fwr['firewall_policy_id'], fwr['position'])
+                          for fwr in fwrs])
+        self.assertEqual(['first', 'old', 'old', 'last', 'past end'],
+                         self._get_rule_names('policy'))
+        self.assertEqual(['other'], self._get_rule_names('other'))
+        self.assertIsNone(self.plugin.get_firewall_rule(
+            self.get_context(), fwrs[0]['id'])['firewall_policy_id'])
+
+    def test_bad_positions(self):
+        self.add_policy(self.get_context(), 'policy', 2)
+        for position in ('first', '', 0, -1, '-1', 1.5):
+            self.assertRaises(firewall.FirewallRulePositionInvalid,
+                              self._create, self._rule('free'),
+                              self._rule('bad', firewall_policy_id='policy',
+                                         position=position))
+        # Nothing of a rejected batch is created.
+        self.assertEqual(0, self.plugin.get_firewalls_rules_count(
+            self.get_context(), filters={'name': ['free']}))
+        self.assertEqual(2, len(self._get_rule_names('policy')))
+
+    def test_single_create_attaches_like_bulk(self):
+        self.add_policy(self.get_context(), 'policy', 2, name='old')
+        fwr = self.plugin.create_firewall_rule(
+            self.get_context(),
+            self._rule('new', firewall_policy_id='policy', position=2))
+        self.assertEqual('policy', fwr['firewall_policy_id'])
+        self.assertEqual(2, fwr['position'])
+        self.assertEqual(['old', 'new', 'old'],
+                         self._get_rule_names('policy'))
+
+    def test_update_with_returned_revision(self):
+        self.add_policy(self.get_context(), 'policy', 2)
+        fwrs = self._create(self._rule('free'),
+                            self._rule('new', firewall_policy_id='policy'))
+        for fwr in fwrs:
+            self.assertEqual(self.plugin.get_firewall_rule(
+                self.get_context(), fwr['id'])['revision_number'],
+                fwr['revision_number'])
+            updated = self.plugin.update_firewall_rule(
+                self.get_context(), fwr['id'],
+                {'firewall_rule': {'name': 'renamed',
+                                   'revision_number':
+                                   fwr['revision_number']}})
+            self.assertEqual(fwr['revision_number'] + 1,
+                             updated['revision_number'])
+
+
+class TestRulePositions(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestRulePositions, self).setUp()
+        context = self.get_context()
+        self.add_policy(context, 'policy', 3)
+        self.add_policy(context, 'free', 3, firewall_policy_id=None,
+                        position=None)
+
+    def _set_keys(self, keys):
+        context = self.get_context()
+        table = firewall_db.FirewallRule.__table__
+        with context.session.begin():
+            for index, key in enumerate(keys):
+                context.session.execute(table.update().where(
+                    table.c.id == 'policy-rule-%d' % index).values(
+                    position=key))
+
+    def _get_keys(self):
+        context = self.get_context()
+        query = context.session.query(firewall_db.FirewallRule.id,
+                                      firewall_db.FirewallRule.position)
+        query = query.filter_by(firewall_policy_id='policy')
+        return query.order_by(firewall_db.FirewallRule.position).all()
+
+    def _insert(self, rule_ids, **rule_info):
+        rule_info['firewall_rule_ids'] = rule_ids
+        self.plugin.insert_rule(self.get_context(), 'policy', rule_info)
+
+    def _get_revisions(self):
+        context = self.get_context()
+        return dict(context.session.query(
+            firewall_db.FirewallRule.id,
+            firewall_db.FirewallRule.revision_number))
+
+    def test_spread_rule_positions(self):
+        gap = firewall_db.RULE_POSITION_GAP
+        self.assertEqual([gap, 2 * gap],
+                         firewall_db._spread_rule_positions(None, None, 2))
+        self.assertEqual([gap + 341, gap + 682],
+                         firewall_db._spread_rule_positions(gap, 2 * gap, 2))
+        self.assertEqual([0], firewall_db._spread_rule_positions(None, gap, 1))
+        self.assertEqual([3 * gap],
+                         firewall_db._spread_rule_positions(2 * gap, None, 1))
+        self.assertIsNone(firewall_db._spread_rule_positions(1, 2, 1))
+        self.assertIsNone(firewall_db._spread_rule_positions(
+            firewall_db.RULE_POSITION_MAX - 1, None, 1))
+
+    def test_insert_between_writes_inserted_rules_only(self):
+        revisions = self._get_revisions()
+        self._insert(['free-rule-0', 'free-rule-1'],
+                     insert_before='policy-rule-1')
+        # Every written rule gets its revision bumped.
+        self.assertEqual(['free-rule-0', 'free-rule-1'], sorted(
+            rule_id for rule_id, revision in self._get_revisions().items()
+            if revision != revisions[rule_id]))
+        self.assertEqual([('policy-rule-0', 1024), ('free-rule-0', 1365),
+                          ('free-rule-1', 1706), ('policy-rule-1', 2048),
+                          ('policy-rule-2', 3072)], self._get_keys())
+
+    def test_insert_at_ends(self):
+        self._insert(['free-rule-0'])
+        self._insert(['free-rule-1'], insert_after='policy-rule-2')
+        self.assertEqual([('free-rule-0', 0), ('policy-rule-0', 1024),
+                          ('policy-rule-1', 2048), ('policy-rule-2', 3072),
+                          ('free-rule-1', 4096)], self._get_keys())
+
+    def test_no_room_renumbers_policy(self):
+        self._set_keys([1, 2, 3])
+        self._insert(['free-rule-0'], insert_after='policy-rule-0')
+        self.assertEqual([('policy-rule-0', 1024), ('free-rule-0', 2048),
+                          ('policy-rule-1', 3072), ('policy-rule-2', 4096)],
+                         self._get_keys())
+
+    def test_gap_used_up_schedules_rebalance(self):
+        scheduled = []
+        self.plugin._schedule_rule_rebalance = scheduled.append
+        self._set_keys([1024, 1028, 4096])
+        self._insert(['free-rule-0'], insert_after='policy-rule-0')
+        self.assertEqual([], scheduled)
+        self._insert(['free-rule-1'], insert_after='policy-rule-0')
+        self.assertEqual(['policy'], scheduled)
+        self.assertEqual(['policy-rule-0', 'free-rule-1', 'free-rule-0',
+                          'policy-rule-1', 'policy-rule-2'],
+                         [rule_id for rule_id, key in self._get_keys()])
+
+    def test_rebalance_keeps_order(self):
+        self._set_keys([-5, 7, 8])
+        context = self.get_context()
+        with context.session.begin():
+            self.plugin._rebalance_rule_positions(context, 'policy', 2, 2)
+        self.assertEqual([('policy-rule-0', 1024), ('policy-rule-1', 4096),
+                          ('policy-rule-2', 5120)], self._get_keys())
+        self.assertEqual(
+            [{'id': 'policy-rule-%d' % index, 'position': index + 1}
+             for index in range(3)],
+            [dict((key, fwr[key]) for key in ('id', 'position'))
+             for fwr in self.plugin.get_firewall_policy_rule_list(
+                 self.get_context(), 'policy')])
+
+
+class TestSetRulesForPolicy(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestSetRulesForPolicy, self).setUp()
+        context = self.get_context()
+        self.add_policy(context, 'policy', 5)
+        self.add_policy(context, 'other', 1)
+        self.add_policy(context, 'free', 2, firewall_policy_id=None,
+                        position=None)
+
+    def _set_rules(self, rule_ids):
+        return self.plugin.update_firewall_policy(
+            self.get_context(), 'policy',
+            {'firewall_policy': {'firewall_rules': rule_ids}})
+
+    def _get_keys(self):
+        context = self.get_context()
+        query = context.session.query(firewall_db.FirewallRule.id,
+                                      firewall_db.FirewallRule.position)
+        return dict(query.filter_by(firewall_policy_id='policy'))
+
+    def _get_journal(self):
+        context = self.get_context()
+        query = context.session.query(
+            firewall_db.FirewallConfigJournal.operation,
+            firewall_db.FirewallConfigJournal.firewall_rule_id)
+        return sorted(query.filter_by(firewall_policy_id='policy'))
+
+    def test_longest_common_subsequence(self):
+        lcs = firewall_db._longest_common_subsequence
+        self.assertEqual(set(['b', 'c', 'd']),
+                         lcs(['a', 'b', 'c', 'd'], ['b', 'c', 'd', 'a']))
+        self.assertEqual(set(['a', 'c']),
+                         lcs(['a', 'b', 'c'], ['x', 'a', 'c', 'y']))
+        self.assertEqual(1, len(lcs(['a', 'b'], ['b', 'a'])))
+        self.assertEqual(set(), lcs(['a', 'b'], ['c']))
+        self.assertEqual(set(), lcs([], ['a']))
+
+    def test_move_writes_moved_rule_only(self):
+        keys = self._get_keys()
+        rule_ids = ['policy-rule-4', 'policy-rule-0', 'policy-rule-1',
+                    'policy-rule-2', 'policy-rule-3']
+        fwp = self._set_rules(rule_ids)
+        self.assertEqual(rule_ids, fwp['firewall_rules'])
+        new_keys = self._get_keys()
+        self.assertEqual(['policy-rule-4'],
+                         [rule_id for rule_id in keys
+                          if new_keys[rule_id] != keys[rule_id]])
+        self.assertTrue(new_keys['policy-rule-4'] <
+                        new_keys['policy-rule-0'])
+
+    def test_add_and_remove(self):
+        keys = self._get_keys()
+        rule_ids = ['policy-rule-0', 'free-rule-0', 'policy-rule-2',
+                    'policy-rule-3', 'policy-rule-4', 'free-rule-1',
+                    'policy-rule-0']
+        fwp = self._set_rules(rule_ids)
+        # A rule listed twice keeps its first place.
+        self.assertEqual(rule_ids[:-1], fwp['firewall_rules'])
+        new_keys = self._get_keys()
+        for rule_id in ('policy-rule-0', 'policy-rule-2', 'policy-rule-3',
+                        'policy-rule-4'):
+            self.assertEqual(keys[rule_id], new_keys[rule_id])
+        removed = self.plugin.get_firewall_rule(self.get_context(),
+                                                'policy-rule-1')
+        self.assertIsNone(removed['firewall_policy_id'])
+        self.assertEqual(
+            [(const.JOURNAL_ADD, 'free-rule-0'),
+             (const.JOURNAL_ADD, 'free-rule-1'),
+             (const.JOURNAL_REMOVE, 'policy-rule-1'),
+             (const.JOURNAL_REORDER, None)], self._get_journal())
+
+    def test_same_list_journals_nothing(self):
+        self._set_rules(['policy-rule-%d' % index for index in range(5)])
+        self.assertEqual([], self._get_journal())
+
+    def test_no_room_renumbers_policy(self):
+        context = self.get_context()
+        table = firewall_db.FirewallRule.__table__
+        with context.session.begin():
+            for index in range(5):
+                context.session.execute(table.update().where(
+                    table.c.id == 'policy-rule-%d' % index).values(
+                    position=index))
+        rule_ids = ['policy-rule-0', 'policy-rule-4', 'policy-rule-1',
+                    'policy-rule-2', 'policy-rule-3']
+        self.assertEqual(rule_ids, self._set_rules(rule_ids)['firewall_rules'])
+        keys = self._get_keys()
+        self.assertEqual(
+            [(index + 1) * firewall_db.RULE_POSITION_GAP
+             for index in range(5)],
+            [keys[rule_id] for rule_id in rule_ids])
+
+    def test_clear(self):
+        self.assertEqual([], self._set_rules([])['firewall_rules'])
+        self.assertEqual({}, self._get_keys())
+
+    def _get_policy_revision(self):
+        return self.plugin.get_firewall_policy(
+            self.get_context(), 'policy')['revision_number']
+
+    def test_add_rules(self):
+        keys = self._get_keys()
+        revision = self._get_policy_revision()
+        fwp = self.plugin.add_rules(
+            self.get_context(), 'policy',
+            {'firewall_rule_ids': ['free-rule-1', 'policy-rule-2',
+                                   'free-rule-0'],
+             'revision_number': revision})
+        # Rules already in the policy keep their place and their keys.
+        self.assertEqual(['policy-rule-%d' % index for index in range(5)] +
+                         ['free-rule-1', 'free-rule-0'],
+                         fwp['firewall_rules'])
+        self.assertEqual(revision + 1, fwp['revision_number'])
+        new_keys = self._get_keys()
+        for rule_id in keys:
+            self.assertEqual(keys[rule_id], new_keys[rule_id])
+        self.assertTrue(keys['policy-rule-4'] < new_keys['free-rule-1'] <
+                        new_keys['free-rule-0'])
+        self.assertEqual(
+            [6, 7], [self.plugin.get_firewall_rule(
+                self.get_context(), rule_id)['position']
+                for rule_id in ('free-rule-1', 'free-rule-0')])
+
+    def test_add_rules_at_other_revision(self):
+        revision = self._get_policy_revision()
+        self.assertRaises(firewall.FirewallRevisionMismatch,
+                          self.plugin.add_rules, self.get_context(), 'policy',
+                          {'firewall_rule_ids': ['free-rule-0'],
+                           'revision_number': revision + 1})
+        self.assertNotIn('free-rule-0', self._get_keys())
+
+    def test_remove_rules(self):
+        keys = self._get_keys()
+        revision = self._get_policy_revision()
+        fwp = self.plugin.remove_rules(
+            self.get_context(), 'policy',
+            {'firewall_rule_ids': ['policy-rule-3', 'policy-rule-1']})
+        self.assertEqual(['policy-rule-0', 'policy-rule-2', 'policy-rule-4'],
+                         fwp['firewall_rules'])
+        self.assertEqual(revision + 1, fwp['revision_number'])
+        new_keys = self._get_keys()
+        self.assertEqual(dict((rule_id, keys[rule_id])
+                              for rule_id in fwp['firewall_rules']), new_keys)
+        self.assertEqual(
+            [1, 2, 3], [self.plugin.get_firewall_rule(
+                self.get_context(), rule_id)['position']
+                for rule_id in fwp['firewall_rules']])
+        self.assertIsNone(self.plugin.get_firewall_rule(
+            self.get_context(), 'policy-rule-1')['firewall_policy_id'])
+
+    def test_remove_rules_not_in_policy(self):
+        keys = self._get_keys()
+        revision = self._get_policy_revision()
+        for rule_id in ('free-rule-0', 'other-rule-0'):
+            self.assertRaises(firewall.FirewallRuleNotAssociatedWithPolicy,
+                              self.plugin.remove_rules, self.get_context(),
+                              'policy',
+                              {'firewall_rule_ids': ['policy-rule-0',
+                                                     rule_id]})
+        self.assertEqual(keys, self._get_keys())
+        self.assertEqual(revision, self._get_policy_revision())
+        self.assertEqual([], self._get_journal())
+
+    def test_rules_request_without_list(self):
+        for rules_info in (None, {}, {'firewall_rule_ids': 'free-rule-0'}):
+            self.assertRaises(firewall.FirewallRuleInfoMissing,
+                              self.plugin.add_rules, self.get_context(),
+                              'policy', rules_info)
+            self.assertRaises(firewall.FirewallRuleInfoMissing,
+                              self.plugin.remove_rules, self.get_context(),
+                              'policy', rules_info)
+
+    def test_invalid_rules_change_nothing(self):
+        keys = self._get_keys()
+        self.assertRaises(firewall.FirewallRuleInUse, self._set_rules,
+                          ['policy-rule-0', 'other-rule-0'])
+        self.assertRaises(firewall.FirewallRuleNotFound, self._set_rules,
+                          ['free-rule-0', 'missing'])
+        self.assertEqual(keys, self._get_keys())
+        self.assertIsNone(self.plugin.get_firewall_rule(
+            self.get_context(), 'free-rule-0')['firewall_policy_id'])
+        self.assertEqual([], self._get_journal())
+
+
+class TestPolicyMemberIds(base.SqlTestCase):
+
+    POLICY_IDS = ['policy', 'other', 'empty']
+
+    def setUp(self):
+        super(TestPolicyMemberIds, self).setUp()
+        context = self.get_context()
+        self.add_policy(context, 'policy', 6)
+        self.add_policy(context, 'other', 2)
+        self.add_policy(context, 'empty', 0)
+        self.add_firewalls(context, 'policy', 3)
+        self.add_firewalls(context, 'other', 1)
+        # Rule order differs from the row order.
+        table = firewall_db.FirewallRule.__table__
+        with context.session.begin():
+            for index, key in enumerate([50, 10, 40, -20, 30, 20]):
+                context.session.execute(table.update().where(
+                    table.c.id == 'policy-rule-%d' % index).values(
+                    position=key))
+
+    def _get_member_ids(self, fields=None):
+        self.reset_statements()
+        return self.plugin._get_policy_member_ids(
+            self.get_context().session, self.POLICY_IDS, fields)
+
+    def test_member_ids_match_relationships(self):
+        rule_ids, firewall_ids = self._get_member_ids()
+        self.assertEqual(2, len(self.statements))
+        context = self.get_context()
+        for policy_id in self.POLICY_IDS:
+            fwp_db = self.plugin._get_firewall_policy(context, policy_id)
+            self.assertEqual([fwr_db.id for fwr_db in fwp_db.firewall_rules],
+                             rule_ids[policy_id])
+            self.assertEqual(sorted(fw_db.id for fw_db in fwp_db.firewalls),
+                             sorted(firewall_ids[policy_id]))
+        self.assertEqual(['policy-rule-3', 'policy-rule-1', 'policy-rule-5',
+                          'policy-rule-4', 'policy-rule-2', 'policy-rule-0'],
+                         rule_ids['policy'])
+        self.assertEqual([], rule_ids['empty'])
+        self.assertEqual([], firewall_ids['empty'])
+
+    def test_fields_leave_out_queries(self):
+        rule_ids, firewall_ids = self._get_member_ids(['firewall_list'])
+        self.assertEqual(1, len(self.statements))
+        self.assertEqual(dict.fromkeys(self.POLICY_IDS, []), rule_ids)
+        self.assertEqual(['other-fw-0'], firewall_ids['other'])
+        rule_ids, firewall_ids = self._get_member_ids(['id', 'name'])
+        self.assertEqual([], self.statements)
+        self.assertEqual(dict.fromkeys(self.POLICY_IDS, []), firewall_ids)
+
+    def test_policy_dicts(self):
+        fwps = dict((fwp['id'], fwp) for fwp in
+                    self.plugin.get_firewall_policies(self.get_context()))
+        rule_ids, firewall_ids = self._get_member_ids()
+        for policy_id in self.POLICY_IDS:
+            fwp = self.plugin.get_firewall_policy(self.get_context(),
+                                                  policy_id)
+            self.assertEqual(fwp, fwps[policy_id])
+            self.assertEqual(rule_ids[policy_id], fwp['firewall_rules'])
+            self.assertEqual(firewall_ids[policy_id], fwp['firewall_list'])
+
+
+class TestFieldColumns(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestFieldColumns, self).setUp()
+        context = self.get_context()
+        self.add_policy(context, 'policy', 3, description='long text')
+        self.add_firewalls(context, 'policy', 2)
+
+    def _get_selected_columns(self, model):
+        """The columns of a model the recorded SELECTs read."""
+        columns = set()
+        for statement, parameters in self.statements:
+            select = statement.split(' FROM ')[0]
+            columns.update(column for column in model.__table__.columns.keys()
+                           if re.search(r'\b%s\.%s\b' % (
+                               model.__tablename__, column), select))
+        return columns
+
+    def test_field_columns(self):
+        get_columns = self.plugin._get_field_columns
+        self.assertIsNone(get_columns(firewall_db.FirewallRule, None))
+        self.assertEqual(['destination_port_range_max',
+                          'destination_port_range_min', 'id', 'name'],
+                         get_columns(firewall_db.FirewallRule,
+                                     ['name', 'destination_port']))
+        self.assertEqual(['firewall_policy_id', 'id', 'position'],
+                         get_columns(firewall_db.FirewallRule, ['position']))
+        # Fields built from other tables select no column of their own.
+        self.assertEqual(['id'], get_columns(firewall_db.FirewallPolicy,
+                                             ['firewall_rules']))
+
+    def test_get_rule_fields(self):
+        self.reset_statements()
+        fwr = self.plugin.get_firewall_rule(
+            self.get_context(), 'policy-rule-1',
+            ['name', 'destination_port', 'position'])
+        self.assertEqual({'name': None, 'destination_port': '1001',
+                          'position': 2}, fwr)
+        self.assertEqual(set(['id', 'name', 'firewall_policy_id', 'position',
+                              'destination_port_range_min',
+                              'destination_port_range_max']),
+                         self._get_selected_columns(firewall_db.FirewallRule))
+
+    def test_list_rule_fields(self):
+        self.reset_statements()
+        fwrs = self.plugin.get_firewall_rules(
+            self.get_context(), fields=['id', 'position'])
+        self.assertEqual([{'id': 'policy-rule-%d' % index,
+                           'position': index + 1} for index in range(3)],
+                         fwrs)
+        self.assertNotIn('description',
+                         self._get_selected_columns(firewall_db.FirewallRule))
+
+    def test_get_policy_fields(self):
+        self.reset_statements()
+        fwp = self.plugin.get_firewall_policy(
+            self.get_context(), 'policy', ['name', 'firewall_rules'])
+        self.assertEqual({'name': 'policy',
+                          'firewall_rules': ['policy-rule-%d' % index
+                                             for index in range(3)]}, fwp)
+        self.assertEqual(set(['id', 'name']),
+                         self._get_selected_columns(
+                             firewall_db.FirewallPolicy))
+        # The firewall IDs are not read at all.
+        self.assertEqual(set(),
+                         self._get_selected_columns(firewall_db.Firewall))
+        fwps = self.plugin.get_firewall_policies(
+            self.get_context(), fields=['id', 'firewall_list'])
+        self.assertEqual([{'id': 'policy',
+                           'firewall_list': ['policy-fw-0', 'policy-fw-1']}],
+                         [dict(fwp, firewall_list=sorted(
+                             fwp['firewall_list'])) for fwp in fwps])
+
+    def test_get_firewall_fields(self):
+        self.reset_statements()
+        fw = self.plugin.get_firewall(self.get_context(), 'policy-fw-0',
+                                      ['status', 'firewall_policy_id'])
+        self.assertEqual({'status': 'ACTIVE',
+                          'firewall_policy_id': 'policy'}, fw)
+        self.assertEqual(set(['id', 'status', 'firewall_policy_id']),
+                         self._get_selected_columns(firewall_db.Firewall))
+
+    def test_missing_resource_with_fields(self):
+        self.assertRaises(firewall.FirewallRuleNotFound,
+                          self.plugin.get_firewall_rule, self.get_context(),
+                          'missing', ['name'])
+        self.assertRaises(firewall.FirewallPolicyNotFound,
+                          self.plugin.get_firewall_policy, self.get_context(),
+                          'missing', ['firewall_rules'])
+
+
+class TestCollectionPages(base.SqlTestCase):
+
+    NAMES = ['b', None, 'a', 'b', None, 'a', 'c']
+
+    def setUp(self):
+        super(TestCollectionPages, self).setUp()
+        context = self.get_context()
+        self.add_policy(context, 'policy', len(self.NAMES))
+        self.add_policy(context, 'other', 2)
+        self.add_policy(context, 'free', 2, firewall_policy_id=None,
+                        position=None)
+        table = firewall_db.FirewallRule.__table__
+        with context.session.begin():
+            for index, name in enumerate(self.NAMES):
+                context.session.execute(table.update().where(
+                    table.c.id == 'policy-rule-%d' % index).values(
+                    name=name))
+
+    def _list(self, **kwargs):
+        return [(fwr['id'], fwr['position']) for fwr in
+                self.plugin.get_firewall_rules(
+                    self.get_context(), filters={'firewall_policy_id':
+                                                 ['policy']},
+                    fields=['id', 'position'], **kwargs)]
+
+    def _page_through(self, limit, **kwargs):
+        rows = []
+        marker = None
+        while True:
+            page = self._list(limit=limit, marker=marker, **kwargs)
+            self.assertTrue(len(page) <= limit)
+            rows.extend(page)
+            if len(page) < limit:
+                return rows
+            marker = page[-1][0]
+
+    def _expected(self, ascending):
+        # NULL sorts below any name, ties are in rule order.
+        rows = sorted(range(len(self.NAMES)),
+                      key=lambda index: (self.NAMES[index] is not None,
+                                         self.NAMES[index]),
+                      reverse=not ascending)
+        return [('policy-rule-%d' % index, index + 1) for index in rows]
+
+    def test_default_order(self):
+        rows = [fwr['id'] for fwr in self.plugin.get_firewall_rules(
+            self.get_context(), fields=['id'], limit=3, marker='free-rule-1')]
+        # Unbound rules first, then policy by policy in rule order.
+        self.assertEqual(['other-rule-0', 'other-rule-1', 'policy-rule-0'],
+                         rows)
+
+    def test_pages_sorted_by_name(self):
+        for ascending in (True, False):
+            expected = self._expected(ascending)
+            self.assertEqual(expected,
+                             self._list(sorts=[('name', ascending)]))
+            for limit in (1, 2, 3, 7):
+                self.reset_statements()
+                self.assertEqual(expected, self._page_through(
+                    limit, sorts=[('name', ascending)]))
+                # Pages resume after the marker instead of skipping rows,
+                # SQLite is always given an offset.
+                self.assertEqual(set([0]), set(
+                    parameters[-1]
+                    for statement, parameters in self.statements
+                    if 'OFFSET' in statement))
+
+    def test_reverse_pages(self):
+        expected = self._expected(True)
+        rows = []
+        marker = expected[-1][0]
+        while True:
+            page = self._list(sorts=[('name', True)], limit=2, marker=marker,
+                              page_reverse=True)
+            rows[:0] = page
+            if len(page) < 2:
+                break
+            marker = page[0][0]
+        self.assertEqual(expected[:-1], rows)
+
+    def test_sort_key_invalid(self):
+        self.assertRaises(firewall.FirewallSortKeyInvalid, self._list,
+                          sorts=[('firewall_policy', True)])
+
+
+class TestRuleContainment(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestRuleContainment, self).setUp()
+        self.plugin.create_firewall_rule_bulk(self.get_context(), {
+            'firewall_rules': [
+                self._rule('any', protocol=None),
+                self._rule('net', source_ip_address='10.0.0.0/8',
+                           destination_port='80'),
+                self._rule('host', protocol='udp',
+                           source_ip_address='10.1.2.3',
+                           destination_ip_address='192.168.1.0/24',
+                           destination_port='1000:2000'),
+                self._rule('v6', ip_version=6,
+                           source_ip_address='2001:db8::/32',
+                           destination_port='443')]})
+
+    def _rule(self, name, **kwargs):
+        fwr = {'tenant_id': 'tenant', 'name': name, 'description': '',
+               'shared': False, 'protocol': 'tcp', 'ip_version': 4,
+               'source_ip_address': None, 'destination_ip_address': None,
+               'source_port': None, 'destination_port': None,
+               'action': 'allow', 'enabled': True}
+        fwr.update(kwargs)
+        return {'firewall_rule': fwr}
+
+    def _list(self, **filters):
+        return sorted(fwr['name'] for fwr in self.plugin.get_firewall_rules(
+            self.get_context(), filters=filters, fields=['name']))
+
+    def test_rule_match_values(self):
+        values = firewall_db.get_rule_match_values(
+            {'ip_version': 4, 'protocol': 'udp',
+             'source_ip_address': '10.1.2.0/24',
+             'destination_ip_address': None})
+        self.assertEqual({'source_ip_start': '\0' * 12 + '\x0a\x01\x02\x00',
+                          'source_ip_end': '\0' * 12 + '\x0a\x01\x02\xff',
+                          'destination_ip_start': '\0' * 16,
+                          'destination_ip_end': '\0' * 12 + '\xff' * 4,
+                          'protocol_number': 17}, values)
+        values = firewall_db.get_rule_match_values(
+            {'ip_version': 6, 'protocol': None,
+             'source_ip_address': '2001:db8::1',
+             'destination_ip_address': '2001:db8::/32'})
+        self.assertEqual(values['source_ip_start'], values['source_ip_end'])
+        self.assertEqual('\x20\x01\x0d\xb8' + '\xff' * 12,
+                         values['destination_ip_end'])
+        self.assertIsNone(values['protocol_number'])
+
+    def test_contains_address(self):
+        self.assertEqual(['any', 'host', 'net'], self._list(
+            contains_source_ip_address=['10.1.2.3']))
+        self.assertEqual(['any', 'net'], self._list(
+            contains_source_ip_address=['10.1.0.0/16']))
+        self.assertEqual(['v6'], self._list(
+            contains_source_ip_address=['2001:db8::1']))
+        # Any of the values.
+        self.assertEqual(['any', 'net', 'v6'], self._list(
+            contains_source_ip_address=['10.1.0.0/16', '2001:db8:1::/48']))
+        self.assertEqual(['any', 'host', 'net'], self._list(
+            contains_destination_ip_address=['192.168.1.7']))
+
+    def test_contains_port(self):
+        self.assertEqual(['any', 'net'], self._list(
+            contains_destination_port=['80']))
+        self.assertEqual(['any', 'host'], self._list(
+            contains_destination_port=['1500']))
+        self.assertEqual(['any'], self._list(
+            contains_destination_port=['1500:2500']))
+
+    def test_contains_protocol(self):
+        self.assertEqual(['any', 'net', 'v6'], self._list(
+            contains_protocol=['tcp']))
+        self.assertEqual(['any', 'host'], self._list(contains_protocol=['17']))
+
+    def test_filters_combined(self):
+        self.assertEqual(['any', 'net'], self._list(
+            contains_protocol=['tcp'], contains_destination_port=['80'],
+            ip_version=[4]))
+
+    def test_invalid_values(self):
+        for filters in ({'contains_source_ip_address': ['10.0.0.300']},
+                        {'contains_destination_ip_address': ['10.0.0.0/x']},
+                        {'contains_destination_port': ['http']},
+                        {'contains_protocol': ['bogus']}):
+            self.assertRaises(firewall.FirewallRuleFilterInvalid,
+                              self._list, **filters)
+
+
+class TestEvaluate(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestEvaluate, self).setUp()
+        context = self.get_context()
+        self.add_policy(context, 'policy', 3)
+        # A deny rule for any port of two hosts, ahead of the allow rule of
+        # the first one.
+        self.add_policy(context, 'deny', 1, firewall_policy_id=None,
+                        position=None, destination_ip_address='10.0.0.2/31',
+                        destination_port_range_min=None,
+                        destination_port_range_max=None, action='deny')
+        self.plugin.insert_rule(self.get_context(), 'policy',
+                                {'firewall_rule_id': 'deny-rule-0',
+                                 'insert_before': 'policy-rule-2'})
+
+    def _packet(self, destination_ip_address, destination_port, **kwargs):
+        packet = {'ip_version': 4, 'protocol': 'tcp',
+                  'source_ip_address': '192.168.1.1',
+                  'destination_ip_address': destination_ip_address,
+                  'source_port': 40000,
+                  'destination_port': destination_port}
+        packet.update(kwargs)
+        return packet
+
+    def _evaluate(self, *packets):
+        return self.plugin.evaluate(self.get_context(), 'policy',
+                                    {'packets': list(packets)})['results']
+
+    def test_matching_packets(self):
+        self.assertEqual(
+            [{'firewall_rule_id': 'policy-rule-1', 'position': 2,
+              'action': 'allow'},
+             {'firewall_rule_id': 'deny-rule-0', 'position': 3,
+              'action': 'deny'},
+             {'firewall_rule_id': 'deny-rule-0', 'position': 3,
+              'action': 'deny'}],
+            self._evaluate(self._packet('10.0.0.1', 1001),
+                           self._packet('10.0.0.2', 1002),
+                           self._packet('10.0.0.3', 22)))
+
+    def test_unmatched_packet_gets_default_action(self):
+        self.assertEqual(
+            [{'firewall_rule_id': None, 'position': None,
+              'action': const.FWAAS_DENY}] * 3,
+            self._evaluate(self._packet('10.0.0.1', 80),
+                           self._packet('10.0.0.1', 1001, protocol='udp'),
+                           self._packet('::1', 1001, ip_version=6,
+                                        source_ip_address='::2')))
+
+    def test_empty_policy(self):
+        self.add_policy(self.get_context(), 'empty', 0)
+        self.assertEqual(
+            [{'firewall_rule_id': None, 'position': None,
+              'action': const.FWAAS_DENY}],
+            self.plugin.evaluate(self.get_context(), 'empty',
+                                 {'packets': [self._packet('10.0.0.1',
+                                                           1001)]})['results'])
+
+    def test_bad_packets(self):
+        for packet_info in (None, {}, {'packets': 'packet'},
+                            {'packets': [self._packet('10.0.0.1', 1001),
+                                         self._packet('host', 1001)]},
+                            {'packets': [self._packet('10.0.0.1', 'http')]},
+                            {'packets': [{'protocol': 'tcp'}]},
+                            {'packets': ['packet']}):
+            self.assertRaises(firewall.FirewallPacketInvalid,
+                              self.plugin.evaluate, self.get_context(),
+                              'policy', packet_info)
+
+    def test_missing_policy(self):
+        self.assertRaises(firewall.FirewallPolicyNotFound,
+                          self.plugin.evaluate, self.get_context(),
+                          'missing', {'packets': []})
+
+
+class TestFirewallHosts(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestFirewallHosts, self).setUp()
+        self.add_policy(self.get_context(), 'policy', 1)
+        self.add_firewalls(self.get_context(), 'policy', 3)
+
+    def _get_hosts(self, max_age=None):
+        return self.plugin.get_firewall_hosts(
+            self.get_context(), ['policy-fw-0', 'policy-fw-1', 'policy-fw-2'],
+            max_age)
+
+    def test_report_replaces_host_placements(self):
+        context = self.get_context()
+        self.plugin.set_firewall_hosts(context, 'b',
+                                       ['policy-fw-0', 'policy-fw-1'])
+        self.plugin.set_firewall_hosts(context, 'a',
+                                       ['policy-fw-0', 'missing'])
+        self.assertEqual({'policy-fw-0': ['a', 'b'], 'policy-fw-1': ['b']},
+                         self._get_hosts())
+        self.plugin.set_firewall_hosts(context, 'b', ['policy-fw-2'])
+        self.assertEqual({'policy-fw-0': ['a'], 'policy-fw-2': ['b']},
+                         self._get_hosts())
+        self.plugin.set_firewall_hosts(context, 'a', [])
+        self.assertEqual({'policy-fw-2': ['b']}, self._get_hosts())
+        self.assertEqual({}, self.plugin.get_firewall_hosts(context, []))
+
+    def test_stale_placements_left_out(self):
+        context = self.get_context()
+        self.plugin.set_firewall_hosts(context, 'a', ['policy-fw-0'])
+        self.plugin.set_firewall_hosts(context, 'b', ['policy-fw-0'])
+        table = firewall_db.FirewallHostPlacement.__table__
+        self.engine.execute(table.update().where(table.c.host == 'a').values(
+            reported_at=datetime.datetime.utcnow() -
+            datetime.timedelta(seconds=600)))
+        self.assertEqual({'policy-fw-0': ['b']}, self._get_hosts(300))
+        self.assertEqual({'policy-fw-0': ['a', 'b']}, self._get_hosts(900))
+        self.assertEqual({'policy-fw-0': ['a', 'b']}, self._get_hosts())
+
+    def test_deleted_firewall_placements_removed(self):
+        context = self.get_context()
+        self.plugin.set_firewall_hosts(context, 'a',
+                                       ['policy-fw-0', 'policy-fw-1'])
+        self.plugin.delete_firewall(context, 'policy-fw-0')
+        self.assertEqual({'policy-fw-1': ['a']}, self._get_hosts())
@@ -0,0 +1,235 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import unittest
+
+from nscs_firewall.crdservice.db import firewall_db
+from nscs_firewall.crdservice.driver import backends
+from nscs_firewall.crdservice.driver import firewall_driver
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.tests import base
+
+
+class RecordingAgentApi(firewall_driver.FirewallAgentApi):
+    """Records the casts to the agents instead of sending them."""
+
+    def __init__(self):
+        super(RecordingAgentApi, self).__init__('l3_agent', 'server')
+        self.casts = []
+
+    def cast(self, context, msg, topic=None, version=None):
+        self.casts.append((topic, msg['method'], msg['args']['firewall']['id']))
+
+    def fanout_cast(self, context, msg, topic=None, version=None):
+        self.casts.append(('fanout', msg['method'],
+                           msg['args']['firewall']['id']))
+
+
+class RecordingServicesDriver(object):
+    """Records the notifications to the network services driver."""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_rpc_msg(self, config_handle_id, notify_data):
+        self.messages.append((config_handle_id, notify_data['config']))
+
+
+class ConfigHandleDb(firewall_db.Firewall_db_mixin):
+    """
+    The firewall database, with config handles of known config modes.
+    lookups lists the config handles looked up.
+    """
+    def __init__(self, config_modes):
+        self.config_modes = config_modes
+        self.lookups = []
+
+    def get_config_handle(self, context, config_handle_id, fields=None):
+        self.lookups.append(config_handle_id)
+        return {'id': config_handle_id,
+                'config_mode': self.config_modes[config_handle_id]}
+
+
+class FailingBackend(backends.FirewallBackend):
+
+    def update_firewalls(self, context, firewalls):
+        raise RuntimeError('backend down')
+
+
+class DriverTestDriver(firewall_driver.FirewallDriver):
+    """The driver, with the given backends and no message bus."""
+
+    def __init__(self, db, backends=None):
+        self.db = db
+        self.driver = RecordingServicesDriver()
+        self.agent_rpc = RecordingAgentApi()
+        self.backends = backends or {}
+
+
+class TestAgentBackend(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestAgentBackend, self).setUp()
+        self.add_policy(self.get_context(), 'policy', 1)
+        self.add_firewalls(self.get_context(), 'policy', 3, None)
+        self.driver = DriverTestDriver(ConfigHandleDb({}))
+        self.backend = backends.AgentBackend(self.driver)
+
+    def _firewalls(self, *fw_ids):
+        return [{'id': fw_id, 'config_handle_id': None} for fw_id in fw_ids]
+
+    def test_cast_to_hosts_running_firewall(self):
+        context = self.get_context()
+        self.driver.db.set_firewall_hosts(context, 'a',
+                                          ['policy-fw-0', 'policy-fw-1'])
+        self.driver.db.set_firewall_hosts(context, 'b', ['policy-fw-1'])
+        self.backend.update_firewalls(context, self._firewalls(
+            'policy-fw-0', 'policy-fw-1', 'policy-fw-2'))
+        self.assertEqual(
+            [('l3_agent.a', 'update_firewall', 'policy-fw-0'),
+             ('l3_agent.a', 'update_firewall', 'policy-fw-1'),
+             ('l3_agent.b', 'update_firewall', 'policy-fw-1'),
+             # Placement unknown, every agent gets it.
+             ('fanout', 'update_firewall', 'policy-fw-2')],
+            self.driver.agent_rpc.casts)
+
+    def test_stale_placement_fans_out(self):
+        context = self.get_context()
+        self.driver.db.set_firewall_hosts(context, 'a', ['policy-fw-0'])
+        table = firewall_db.FirewallHostPlacement.__table__
+        self.engine.execute(table.update().values(
+            reported_at=datetime.datetime.utcnow() - datetime.timedelta(
+                seconds=firewall_driver.placement_max_age + 60)))
+        self.backend.delete_firewalls(context, self._firewalls('policy-fw-0'))
+        self.assertEqual([('fanout', 'delete_firewall', 'policy-fw-0')],
+                         self.driver.agent_rpc.casts)
+
+
+class TestNFVBackend(unittest.TestCase):
+
+    def setUp(self):
+        super(TestNFVBackend, self).setUp()
+        self.driver = DriverTestDriver(ConfigHandleDb({}))
+        self.backend = backends.NFVBackend(self.driver)
+
+    def _firewall(self, fw_id, config_handle_id, config_version=None):
+        return {'id': fw_id, 'config_handle_id': config_handle_id,
+                'config_version': config_version}
+
+    def _notification(self, config_handle_id, header, version):
+        return (config_handle_id, {'header': header,
+                                   'config_handle_id': config_handle_id,
+                                   'slug': 'firewall', 'version': version})
+
+    def test_one_replace_per_config_handle(self):
+        self.backend.update_firewalls(None, [
+            self._firewall('a-0', 'a', 7), self._firewall('b-0', 'b', 5),
+            self._firewall('a-1', 'a', 9), self._firewall('a-2', 'a', 8)])
+        # Each handle is told the newest version of its firewalls.
+        self.assertEqual(
+            [self._notification('a', const.CONFIG_NOTIFY_REPLACE, '9'),
+             self._notification('b', const.CONFIG_NOTIFY_REPLACE, '5')],
+            sorted(self.driver.driver.messages))
+
+    def test_replace_sent_again_for_same_version(self):
+        for attempt in range(2):
+            self.backend.update_firewalls(None,
+                                          [self._firewall('a-0', 'a', 3)])
+        self.assertEqual(
+            [self._notification('a', const.CONFIG_NOTIFY_REPLACE, '3')] * 2,
+            self.driver.driver.messages)
+
+    def test_no_version_sends_request(self):
+        self.backend.update_firewalls(None, [self._firewall('a-0', 'a')])
+        self.driver.prepare_update('b', const.FW_UPDATE)
+        self.assertEqual(
+            [self._notification('a', const.CONFIG_NOTIFY_REQUEST, '0.0'),
+             self._notification('b', const.CONFIG_NOTIFY_REQUEST, '0.0')],
+            self.driver.driver.messages)
+
+    def test_version_zero_is_a_version(self):
+        self.driver.prepare_update('a', const.FW_UPDATE, 0)
+        self.assertEqual(
+            [self._notification('a', const.CONFIG_NOTIFY_REPLACE, '0')],
+            self.driver.driver.messages)
+
+    def test_delete_sends_request(self):
+        self.backend.delete_firewalls(None, [
+            self._firewall('a-0', 'a', 4), self._firewall('a-1', 'a', 4)])
+        self.assertEqual(
+            [self._notification('a', const.CONFIG_NOTIFY_REQUEST, '0.0')],
+            self.driver.driver.messages)
+
+    def test_no_config_handle_sends_nothing(self):
+        self.backend.update_firewalls(None, [self._firewall('a-0', None, 2)])
+        self.assertEqual([], self.driver.driver.messages)
+
+
+class TestFirewallsConfigUpdate(unittest.TestCase):
+
+    def setUp(self):
+        super(TestFirewallsConfigUpdate, self).setUp()
+        self.backends = {'NFV': backends.LocalBackend(),
+                         'NN': backends.LocalBackend(),
+                         'OFC': FailingBackend(None)}
+        self.driver = DriverTestDriver(
+            ConfigHandleDb({'nfv': 'NFV', 'ofc': 'OFC', 'other': 'XYZ'}),
+            self.backends)
+
+    def _firewall(self, fw_id, config_handle_id):
+        return {'id': fw_id, 'config_handle_id': config_handle_id}
+
+    def test_one_batch_per_backend(self):
+        failed = self.driver.firewalls_config_update(None, [
+            self._firewall('nfv-0', 'nfv'), self._firewall('agent', None),
+            self._firewall('nfv-1', 'nfv'), self._firewall('other', 'other')])
+        self.assertEqual([], failed)
+        self.assertEqual(1, self.backends['NFV'].batches)
+        self.assertEqual(['nfv-0', 'nfv-1'],
+                         sorted(self.backends['NFV'].firewalls))
+        # Firewalls without a config handle are run by the agents.
+        self.assertEqual(['agent'], list(self.backends['NN'].firewalls))
+        # Each config handle is looked up once, a config mode without a
+        # backend is skipped.
+        self.assertEqual(['nfv', 'other'], self.driver.db.lookups)
+
+    def test_failed_backend(self):
+        failed = self.driver.firewalls_config_update(None, [
+            self._firewall('nfv-0', 'nfv'), self._firewall('ofc-0', 'ofc'),
+            self._firewall('ofc-1', 'ofc')])
+        # Only the firewalls of the failed backend are reported.
+        self.assertEqual(['ofc-0', 'ofc-1'], sorted(failed))
+        self.assertEqual(['nfv-0'], list(self.backends['NFV'].firewalls))
+
+    def test_failed_backend_lookup(self):
+        self.driver.db.config_modes = {}
+        self.assertEqual(['nfv-0', 'agent'],
+                         self.driver.firewalls_config_update(None, [
+                             self._firewall('nfv-0', 'nfv'),
+                             self._firewall('agent', None)]))
+        self.assertEqual(0, self.backends['NN'].batches)
+
+    def test_delete_with_given_config_handle(self):
+        self.driver.firewalls_config_update(None, [
+            self._firewall('nfv-0', 'nfv')])
+        # The firewall may no longer be mapped to the config handle it was
+        # deleted from.
+        self.driver.firewall_config_delete(None, 'nfv',
+                                           self._firewall('nfv-0', None))
+        self.assertEqual({}, self.backends['NFV'].firewalls)
+        self.assertEqual({}, self.backends['NN'].firewalls)
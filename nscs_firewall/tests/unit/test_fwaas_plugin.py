@@ -0,0 +1,636 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import unittest
+
+from sqlalchemy import exc as sa_exc
+
+from nscs_firewall.crdservice.db import firewall_db
+from nscs_firewall.crdservice.driver.dispatch import CoalescingDispatcher
+from nscs_firewall.crdservice.driver.dispatch import WorkerPool
+from nscs_firewall.crdservice.extensions import firewall
+from nscs_firewall.crdservice.plugins.common.config_cache import ConfigCache
+from nscs_firewall.crdservice.plugins.common import config_encoding
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins import fwaas_plugin
+from nscs_firewall.tests import base
+
+
+class RetryTestPlugin(object):
+    """Fails its calls with the given errors, one per call, in order."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.bodies = []
+
+    @fwaas_plugin.retry_on_conflict
+    def update(self, body):
+        self.bodies.append(body)
+        body['edited'] = True
+        if self.errors:
+            raise self.errors.pop(0)
+        return len(self.bodies)
+
+
+class TestRetryOnConflict(unittest.TestCase):
+
+    def setUp(self):
+        super(TestRetryOnConflict, self).setUp()
+        self.addCleanup(setattr, fwaas_plugin, 'conflict_retries',
+                        fwaas_plugin.conflict_retries)
+        fwaas_plugin.conflict_retries = 2
+
+    def _conflict(self):
+        return firewall.FirewallConcurrentUpdate(resource='firewall_rule',
+                                                 id='rule')
+
+    def test_conflict_retried_with_fresh_body(self):
+        plugin = RetryTestPlugin([self._conflict(), self._conflict()])
+        body = {'firewall_rule': {'name': 'rule'}}
+        self.assertEqual(3, plugin.update(body))
+        # Every attempt edits a copy of the request body of its own.
+        self.assertNotIn('edited', body)
+        for attempt in plugin.bodies:
+            self.assertEqual({'name': 'rule'}, attempt['firewall_rule'])
+
+    def test_conflict_retries_exhausted(self):
+        plugin = RetryTestPlugin([self._conflict()] * 3)
+        self.assertRaises(firewall.FirewallConcurrentUpdate, plugin.update,
+                          {})
+        self.assertEqual(3, len(plugin.bodies))
+
+    def test_revision_mismatch_not_retried(self):
+        error = firewall.FirewallRevisionMismatch(
+            resource='firewall_rule', id='rule', expected=1, current=2)
+        plugin = RetryTestPlugin([error])
+        self.assertRaises(firewall.FirewallRevisionMismatch, plugin.update,
+                          {})
+        self.assertEqual(1, len(plugin.bodies))
+
+    def _deadlock(self):
+        return sa_exc.OperationalError(
+            'UPDATE firewall_rules', {},
+            Exception(1213, 'Deadlock found when trying to get lock'))
+
+    def test_deadlock_retried(self):
+        plugin = RetryTestPlugin([self._deadlock()])
+        self.assertEqual(2, plugin.update({}))
+
+    def test_other_database_error_not_retried(self):
+        error = sa_exc.OperationalError('UPDATE firewall_rules', {},
+                                        Exception(2006, 'gone away'))
+        plugin = RetryTestPlugin([error])
+        self.assertRaises(sa_exc.OperationalError, plugin.update, {})
+        self.assertEqual(1, len(plugin.bodies))
+
+
+class FakeDriver(object):
+    """
+    Records the statuses of the firewalls of every push as the driver
+    sees them, and fails the firewalls listed in failed.
+    """
+    def __init__(self):
+        self.failed = set()
+        self.pushes = []
+
+    def firewalls_config_update(self, context, fws_with_rules):
+        query = context.session.query(firewall_db.Firewall.id,
+                                      firewall_db.Firewall.status)
+        query = query.filter(firewall_db.Firewall.id.in_(
+            [fw['id'] for fw in fws_with_rules]))
+        self.pushes.append(dict(query))
+        return [fw['id'] for fw in fws_with_rules if fw['id'] in self.failed]
+
+
+class PushTestPlugin(fwaas_plugin.FirewallPlugin):
+    """The pushes of the plugin, run inline against a fake driver."""
+
+    def __init__(self, get_context):
+        self._get_context = get_context
+        self.driver = FakeDriver()
+        self.workers = WorkerPool(0)
+        self.config_cache = ConfigCache()
+        self.push_dispatcher = CoalescingDispatcher(self._submit_push)
+        self._rebalance_lock = threading.Lock()
+        self._rebalance_pending = set()
+
+    def _get_admin_context(self):
+        return self._get_context()
+
+    def get_config_handle(self, context, config_handle_id, fields=None):
+        return {'id': config_handle_id, 'config_mode': 'NFV'}
+
+
+class TestPushFirewalls(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestPushFirewalls, self).setUp()
+        self.plugin = PushTestPlugin(self.get_context)
+        context = self.get_context()
+        self.add_policy(context, 'policy', 2)
+        self.add_firewalls(context, 'policy', 3)
+
+    def _get_statuses(self):
+        return dict((fw['id'], fw['status']) for fw in
+                    self.plugin.get_firewalls(self.get_context(),
+                                              fields=['id', 'status']))
+
+    def _update_policy(self):
+        self.plugin.update_firewall_policy(
+            self.get_context(), 'policy',
+            {'firewall_policy': {'description': 'changed'}})
+
+    def test_pending_update_then_active(self):
+        self._update_policy()
+        self.assertEqual([dict.fromkeys(['policy-fw-0', 'policy-fw-1',
+                                         'policy-fw-2'],
+                                        const.PENDING_UPDATE)],
+                         self.plugin.driver.pushes)
+        self.assertEqual(dict.fromkeys(['policy-fw-0', 'policy-fw-1',
+                                        'policy-fw-2'], const.ACTIVE),
+                         self._get_statuses())
+
+    def test_failed_firewall_in_error(self):
+        self.plugin.driver.failed.add('policy-fw-1')
+        self._update_policy()
+        self.assertEqual({'policy-fw-0': const.ACTIVE,
+                          'policy-fw-1': const.ERROR,
+                          'policy-fw-2': const.ACTIVE},
+                         self._get_statuses())
+        # The next push that gets through makes it active again.
+        self.plugin.driver.failed.clear()
+        self._update_policy()
+        self.assertEqual(const.ACTIVE, self._get_statuses()['policy-fw-1'])
+
+    def test_changed_during_push_stays_pending(self):
+        firewall_ids = ['policy-fw-0', 'policy-fw-1', 'policy-fw-2']
+        self.plugin._update_firewalls_status(
+            self.get_context(), firewall_ids, const.PENDING_UPDATE)
+        push = self.plugin.driver.firewalls_config_update
+
+        def change_policy(context, fws_with_rules):
+            # Committed after the push read the journal head.
+            context = self.get_context()
+            with context.session.begin():
+                self.plugin._journal_change(context, const.JOURNAL_MODIFY,
+                                            firewall_policy_id='policy')
+            return push(context, fws_with_rules)
+        self.plugin.driver.firewalls_config_update = change_policy
+        self.plugin._push_firewalls(firewall_ids)
+        self.assertEqual(dict.fromkeys(firewall_ids, const.PENDING_UPDATE),
+                         self._get_statuses())
+        # The push carrying the change makes them active.
+        self.plugin.driver.firewalls_config_update = push
+        self.plugin._push_firewalls(firewall_ids)
+        self.assertEqual(dict.fromkeys(firewall_ids, const.ACTIVE),
+                         self._get_statuses())
+
+    def test_deleted_firewall_not_pushed(self):
+        context = self.get_context()
+        self.plugin._update_firewalls_status(context, ['policy-fw-2'],
+                                             const.PENDING_DELETE)
+        self._update_policy()
+        self.assertEqual(['policy-fw-0', 'policy-fw-1'],
+                         sorted(self.plugin.driver.pushes[0]))
+        self.assertEqual(const.PENDING_DELETE,
+                         self._get_statuses()['policy-fw-2'])
+
+    def test_status_changes_keep_version(self):
+        context = self.get_context()
+        head = self.plugin.get_config_journal_head(context)
+        self._update_policy()
+        # The policy update was journaled, the PENDING_UPDATE and ACTIVE
+        # statuses of its push were not.
+        self.assertEqual(head, self.plugin.get_config_journal_head(context))
+        self.plugin._update_firewalls_status(context, ['policy-fw-0'],
+                                             const.ERROR)
+        self.assertEqual(head, self.plugin.get_config_journal_head(context))
+
+    def test_report_firewall_hosts(self):
+        self.plugin.report_firewall_hosts(
+            self.get_context(), 'host', ['policy-fw-0', 'policy-fw-1'])
+        self.plugin.report_firewall_hosts(
+            self.get_context(), 'host', ['policy-fw-1'])
+        self.assertEqual({'policy-fw-1': ['host']},
+                         self.plugin.get_firewall_hosts(
+                             self.get_context(),
+                             ['policy-fw-0', 'policy-fw-1']))
+
+    def test_dispatch_stats(self):
+        self._update_policy()
+        stats = self.plugin.get_dispatch_stats(self.get_context())
+        self.assertEqual(3, stats['push']['pushes'])
+        self.assertEqual(0, stats['push']['pending'])
+        self.assertEqual(1, stats['workers']['completed'])
+        self.assertEqual(0, stats['workers']['queue_depth'])
+
+
+class TestConfigCache(base.SqlTestCase):
+    """
+    Two plugins on one database, as two API workers: each caches the
+    configs it compiled and serves them while the journal head is the same.
+    """
+    def setUp(self):
+        super(TestConfigCache, self).setUp()
+        self.reader = PushTestPlugin(self.get_context)
+        self.writer = PushTestPlugin(self.get_context)
+        context = self.get_context()
+        self.add_policy(context, 'policy', 2)
+        self.add_firewalls(context, 'policy', 2)
+
+    def _compile_config(self, format_version=const.CONFIG_FORMAT_JSON):
+        return self.reader._compile_config(self.get_context(), 'handle',
+                                           format_version)
+
+    def test_write_by_other_plugin(self):
+        version, firewalls = self._compile_config()
+        self.writer.update_firewall_rule(
+            self.get_context(), 'policy-rule-0',
+            {'firewall_rule': {'destination_port': '8080'}})
+        new_version, firewalls = self._compile_config()
+        self.assertTrue(new_version > version)
+        for fw in firewalls:
+            self.assertEqual('8080',
+                             fw['firewall_rule_list'][0]['destination_port'])
+
+    def test_cached_across_push(self):
+        version, firewalls = self._compile_config()
+        compact = self._compile_config(const.CONFIG_FORMAT_COMPACT)
+        self.writer._push_firewalls(['policy-fw-0', 'policy-fw-1'])
+        self.reset_statements()
+        self.assertEqual((version, firewalls), self._compile_config())
+        self.assertEqual(compact,
+                         self._compile_config(const.CONFIG_FORMAT_COMPACT))
+        # The journal head and the firewall statuses are all that is read.
+        self.assertEqual(2 * 2, len(self.statements))
+
+    def test_status_change(self):
+        version, firewalls = self._compile_config()
+        self._compile_config(const.CONFIG_FORMAT_COMPACT)
+        self.writer._update_firewalls_status(
+            self.get_context(), ['policy-fw-0'], const.ERROR)
+        new_version, firewalls = self._compile_config()
+        self.assertEqual(version, new_version)
+        statuses = dict((fw['id'], fw['status']) for fw in firewalls)
+        self.assertEqual(const.ERROR, statuses['policy-fw-0'])
+        self.assertNotEqual(const.ERROR, statuses['policy-fw-1'])
+        compact = config_encoding.decode_config(
+            self._compile_config(const.CONFIG_FORMAT_COMPACT)[1])
+        self.assertEqual(statuses, dict((fw['id'], fw['status'])
+                                        for fw in compact))
+
+    def test_rebalance(self):
+        version, firewalls = self._compile_config()
+        self.writer._rebalance_policy('policy')
+        new_version, firewalls = self._compile_config()
+        self.assertTrue(new_version > version)
+        revisions = dict(
+            (fwr['id'], fwr['revision_number'])
+            for fwr in self.writer.get_firewall_rules(self.get_context()))
+        for fw in firewalls:
+            for fwr in fw['firewall_rule_list']:
+                self.assertEqual(revisions[fwr['id']],
+                                 fwr['revision_number'])
+
+
+class TestConfigDelta(base.SqlTestCase):
+    """Deltas sent to a consumer holding the configuration at a version."""
+
+    RULE_IDS = ['policy-rule-%d' % index for index in range(4)]
+
+    def setUp(self):
+        super(TestConfigDelta, self).setUp()
+        self.plugin = PushTestPlugin(self.get_context)
+        context = self.get_context()
+        self.add_policy(context, 'policy', 4)
+        self.add_policy(context, 'other', 1)
+        self.add_policy(context, 'free', 1, firewall_policy_id=None,
+                        position=None)
+        self.add_firewalls(context, 'policy', 2)
+        self.add_firewalls(context, 'other', 1, config_handle_id='other')
+        self.version = self.plugin.get_config_journal_head(context)
+
+    def _create_config(self, version, config_handle_id='handle'):
+        return self.plugin.create_config(self.get_context(), {'config': {
+            'config_handle_id': config_handle_id, 'slug': 'firewall',
+            'header': const.CONFIG_HEADER_DELTA, 'version': version}})
+
+    def _get_delta(self, config_handle_id='handle'):
+        res = self._create_config(str(self.version), config_handle_id)
+        self.assertEqual(const.CONFIG_HEADER_DELTA, res['header'])
+        self.assertEqual(str(self.version), res['from_version'])
+        self.assertEqual(str(self.plugin.get_config_journal_head(
+            self.get_context())), res['version'])
+        return res['response']
+
+    def _get_firewalls(self, delta):
+        self.assertEqual(['policy-fw-0', 'policy-fw-1'],
+                         sorted(fw['id'] for fw in delta['firewalls']))
+        for fw in delta['firewalls']:
+            self.assertFalse(fw['resync'])
+            self.assertEqual('NFV', fw['config_mode'])
+        return delta['firewalls']
+
+    def test_insert(self):
+        self.plugin.insert_rule(self.get_context(), 'policy',
+                                {'firewall_rule_id': 'free-rule-0',
+                                 'insert_after': 'policy-rule-1'})
+        for fw in self._get_firewalls(self._get_delta()):
+            self.assertEqual(self.RULE_IDS[:2] + ['free-rule-0'] +
+                             self.RULE_IDS[2:], fw['firewall_rule_ids'])
+            self.assertEqual([('free-rule-0', 3)],
+                             [(rule['id'], rule['position'])
+                              for rule in fw['firewall_rule_list']])
+            self.assertEqual([], fw['removed_firewall_rule_ids'])
+
+    def test_remove(self):
+        self.plugin.remove_rule(self.get_context(), 'policy',
+                                {'firewall_rule_id': 'policy-rule-2'})
+        for fw in self._get_firewalls(self._get_delta()):
+            self.assertEqual(['policy-rule-0', 'policy-rule-1',
+                              'policy-rule-3'], fw['firewall_rule_ids'])
+            self.assertEqual([], fw['firewall_rule_list'])
+            self.assertEqual(['policy-rule-2'],
+                             fw['removed_firewall_rule_ids'])
+
+    def test_modify(self):
+        self.plugin.update_firewall_rule(
+            self.get_context(), 'policy-rule-1',
+            {'firewall_rule': {'destination_port': '8080'}})
+        for fw in self._get_firewalls(self._get_delta()):
+            self.assertEqual(self.RULE_IDS, fw['firewall_rule_ids'])
+            self.assertEqual([('policy-rule-1', 2, '8080')],
+                             [(rule['id'], rule['position'],
+                               rule['destination_port'])
+                              for rule in fw['firewall_rule_list']])
+            self.assertEqual([], fw['removed_firewall_rule_ids'])
+
+    def test_reorder(self):
+        rule_ids = ['policy-rule-3', 'policy-rule-0', 'policy-rule-1',
+                    'policy-rule-2']
+        self.plugin.update_firewall_policy(
+            self.get_context(), 'policy',
+            {'firewall_policy': {'firewall_rules': rule_ids}})
+        for fw in self._get_firewalls(self._get_delta()):
+            # The order is all that changed.
+            self.assertEqual(rule_ids, fw['firewall_rule_ids'])
+            self.assertEqual([], fw['firewall_rule_list'])
+            self.assertEqual([], fw['removed_firewall_rule_ids'])
+
+    def test_changes_of_other_handle_left_out(self):
+        self.plugin.update_firewall_rule(
+            self.get_context(), 'other-rule-0',
+            {'firewall_rule': {'destination_port': '8080'}})
+        delta = self._get_delta()
+        self.assertEqual([], delta['firewalls'])
+        self.assertEqual([], delta['removed_firewall_ids'])
+        self.assertEqual(['other-fw-0'], [fw['id'] for fw in self._get_delta(
+            'other')['firewalls']])
+
+    def test_firewall_moved_to_other_handle(self):
+        self.plugin.update_firewall(
+            self.get_context(), 'policy-fw-1',
+            {'firewall': {'config_handle_id': 'other'}})
+        delta = self._get_delta()
+        self.assertEqual([], delta['firewalls'])
+        self.assertEqual(['policy-fw-1'], delta['removed_firewall_ids'])
+        fws = self._get_delta('other')['firewalls']
+        self.assertEqual(['policy-fw-1'], [fw['id'] for fw in fws])
+        # The handle has not seen the firewall before, it gets all of it.
+        self.assertTrue(fws[0]['resync'])
+        self.assertEqual(self.RULE_IDS, [rule['id'] for rule in
+                                         fws[0]['firewall_rule_list']])
+
+    def test_no_change(self):
+        self.assertEqual({'firewalls': [], 'removed_firewall_ids': []},
+                         self._get_delta())
+
+    def _assert_full_config(self, version):
+        res = self._create_config(version)
+        self.assertEqual(const.CONFIG_HEADER_DATA, res['header'])
+        self.assertEqual(
+            (res['version'], ['policy-fw-0', 'policy-fw-1']),
+            (str(self.plugin.get_config_journal_head(self.get_context())),
+             sorted(fw['id'] for fw in res['response'])))
+        for fw in res['response']:
+            self.assertEqual(self.RULE_IDS, [rule['id'] for rule in
+                                             fw['firewall_rule_list']])
+
+    def test_future_version_gets_full_config(self):
+        self._assert_full_config(str(self.version + 1))
+
+    def test_pruned_version_gets_full_config(self):
+        for port in ('8080', '8081', '8082'):
+            self.plugin.update_firewall_rule(
+                self.get_context(), 'policy-rule-1',
+                {'firewall_rule': {'destination_port': port}})
+        context = self.get_context()
+        self.plugin._prune_config_journal(context, 1)
+        self._assert_full_config(str(self.version))
+        # The journal still covers the version before its oldest entry.
+        head = self.plugin.get_config_journal_head(context)
+        res = self._create_config(str(head - 1))
+        self.assertEqual(const.CONFIG_HEADER_DELTA, res['header'])
+
+    def test_bad_version_gets_full_config(self):
+        for version in ('latest', None):
+            self._assert_full_config(version)
+
+    def test_optimized_rules_resync_policy(self):
+        self.addCleanup(setattr, fwaas_plugin, 'optimize_rules',
+                        fwaas_plugin.optimize_rules)
+        fwaas_plugin.optimize_rules = True
+        self.plugin.update_firewall_rule(
+            self.get_context(), 'policy-rule-1',
+            {'firewall_rule': {'destination_port': '8080'}})
+        for fw in self._get_delta()['firewalls']:
+            # Which rules are shipped depends on the whole policy.
+            self.assertTrue(fw['resync'])
+            self.assertEqual(self.RULE_IDS, fw['firewall_rule_ids'])
+            self.assertEqual(self.RULE_IDS, [rule['id'] for rule in
+                                             fw['firewall_rule_list']])
+
+
+class TestConfigStatements(base.SqlTestCase):
+    """
+    The SELECTs behind a compiled configuration and a push depend on the
+    number of policies, not on the number of firewalls or rules.
+    """
+    def setUp(self):
+        super(TestConfigStatements, self).setUp()
+        self.plugin = PushTestPlugin(self.get_context)
+
+    def _add_firewalls(self, config_handle_id, policy_count, rule_count,
+                       firewall_count):
+        context = self.get_context()
+        for index in range(policy_count):
+            policy_id = '%s-policy-%d' % (config_handle_id, index)
+            self.add_policy(context, policy_id, rule_count)
+            self.add_firewalls(context, policy_id, firewall_count,
+                               config_handle_id)
+        self.reset_statements()
+
+    def _compile_config(self, config_handle_id):
+        return self.plugin._compile_config(
+            self.get_context(), config_handle_id, const.CONFIG_FORMAT_JSON)[1]
+
+    def _get_selects(self):
+        return [(statement, parameters)
+                for statement, parameters in self.statements
+                if statement.startswith('SELECT')]
+
+    def test_compile_config_statements(self):
+        self._add_firewalls('small', 2, 1, 1)
+        self._compile_config('small')
+        small = len(self.statements)
+        self._add_firewalls('large', 2, 300, 20)
+        firewalls = self._compile_config('large')
+        self.assertEqual(40, len(firewalls))
+        self.assertEqual(small, len(self.statements))
+        # The journal head, the firewall statuses, the firewalls, then the
+        # rules of each policy.
+        self.assertEqual(1 + 1 + 1 + 2, len(self.statements))
+
+    def test_shared_policy_rules_fetched_once(self):
+        self._add_firewalls('handle', 1, 300, 50)
+        firewalls = self._compile_config('handle')
+        # Run the SELECTs once more and count the rows they return: the
+        # journal head, the firewall status rows, the firewall rows and the
+        # rule rows, not a rule row per firewall.
+        self.assertEqual(1 + 50 + 50 + 300, sum(
+            len(self.engine.execute(statement, parameters).fetchall())
+            for statement, parameters in self._get_selects()))
+        for fw in firewalls:
+            self.assertEqual(
+                ['handle-policy-0-rule-%d' % index for index in range(300)],
+                [rule['id'] for rule in fw['firewall_rule_list']])
+            self.assertEqual(range(1, 301),
+                             [rule['position']
+                              for rule in fw['firewall_rule_list']])
+
+    def _push(self, config_handle_id):
+        firewall_ids = [fw['id'] for fw in self.plugin.get_firewalls(
+            self.get_context(),
+            filters={'config_handle_id': [config_handle_id]})]
+        self.reset_statements()
+        self.plugin._push_firewalls(firewall_ids)
+        return firewall_ids
+
+    def test_push_statements(self):
+        self._add_firewalls('small', 2, 1, 1)
+        self._push('small')
+        small = len(self.statements)
+        self._add_firewalls('large', 2, 300, 20)
+        firewall_ids = self._push('large')
+        self.assertEqual(small, len(self.statements))
+        pushed = self.plugin.driver.pushes[-1]
+        self.assertEqual(sorted(firewall_ids), sorted(pushed))
+
+
+class TestCoalescingDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        super(TestCoalescingDispatcher, self).setUp()
+        self.pushes = []
+        self.pushed = threading.Event()
+
+    def _push(self, firewall_ids):
+        self.pushes.append(sorted(firewall_ids))
+        self.pushed.set()
+
+    def test_marks_within_window_pushed_once(self):
+        dispatcher = CoalescingDispatcher(self._push, interval=0.2)
+        dispatcher.mark_dirty(['fw-1'])
+        dispatcher.mark_dirty(['fw-1'])
+        dispatcher.mark_dirty(['fw-1', 'fw-2'])
+        dispatcher.mark_dirty(['fw-1'])
+        self.assertEqual([], self.pushes)
+        # The marks of a firewall already pending count as saved at once.
+        self.assertEqual({'marks': 5, 'pushes': 0, 'pushes_saved': 3,
+                          'pending': 2}, dispatcher.get_stats())
+        self.assertTrue(self.pushed.wait(5))
+        self.assertEqual([['fw-1', 'fw-2']], self.pushes)
+        self.assertEqual({'marks': 5, 'pushes': 2, 'pushes_saved': 3,
+                          'pending': 0}, dispatcher.get_stats())
+
+    def test_marks_after_flush_start_new_window(self):
+        # A window long enough to never expire during the test.
+        dispatcher = CoalescingDispatcher(self._push, interval=3600)
+        dispatcher.mark_dirty(['fw-1', 'fw-2'])
+        dispatcher.mark_dirty(['fw-2'])
+        dispatcher.flush()
+        dispatcher.mark_dirty(['fw-2'])
+        dispatcher.flush()
+        dispatcher.flush()
+        self.assertEqual([['fw-1', 'fw-2'], ['fw-2']], self.pushes)
+        self.assertEqual({'marks': 4, 'pushes': 3, 'pushes_saved': 1,
+                          'pending': 0}, dispatcher.get_stats())
+
+    def test_no_interval_pushes_every_mark(self):
+        dispatcher = CoalescingDispatcher(self._push)
+        dispatcher.mark_dirty(['fw-1'])
+        dispatcher.mark_dirty(['fw-1'])
+        self.assertEqual([['fw-1'], ['fw-1']], self.pushes)
+        self.assertEqual(0, dispatcher.get_stats()['pushes_saved'])
+
+    def test_failed_push_counted(self):
+        def push(firewall_ids):
+            raise RuntimeError('driver down')
+        dispatcher = CoalescingDispatcher(push)
+        dispatcher.mark_dirty(['fw-1'])
+        self.assertEqual({'marks': 1, 'pushes': 1, 'pushes_saved': 0,
+                          'pending': 0}, dispatcher.get_stats())
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_full_queue_blocks_submit(self):
+        pool = WorkerPool(1, 1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+        pool.submit(block)
+        self.assertTrue(started.wait(5))
+        calls = []
+        pool.submit(calls.append, 1)
+        self.assertEqual(1, pool.get_stats()['queue_depth'])
+        # The writer waits for room in the queue instead of growing it.
+        submitter = threading.Thread(target=pool.submit,
+                                     args=(calls.append, 2))
+        submitter.daemon = True
+        submitter.start()
+        submitter.join(0.2)
+        self.assertTrue(submitter.is_alive())
+        release.set()
+        submitter.join(5)
+        self.assertFalse(submitter.is_alive())
+        pool._queue.join()
+        self.assertEqual([1, 2], calls)
+        stats = pool.get_stats()
+        self.assertEqual(3, stats['completed'])
+        self.assertEqual(0, stats['queue_depth'])
+
+    def test_failed_call_counted(self):
+        pool = WorkerPool(0)
+        pool.submit(int, 'not a number')
+        stats = pool.get_stats()
+        self.assertEqual(1, stats['completed'])
+        self.assertEqual(1, stats['failed'])
@@ -0,0 +1,144 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import unittest
+
+from nscs_firewall.crdservice.db import match_compiler
+
+
+def covered_ports(matches, bits):
+    """
+    Mark the ports selected by masked matches. Returns the marks and the
+    number of ports of all matches, counting overlaps more than once.
+    """
+    full_mask = (1 << bits) - 1
+    marks = bytearray(1 << bits)
+    total = 0
+    for value, mask in matches:
+        assert value & ~mask & full_mask == 0, (value, mask)
+        wildcard = ~mask & full_mask
+        # The low wildcard bits make a block, the others pick its starts.
+        block = (wildcard + 1) & ~wildcard
+        high = wildcard & ~(block - 1)
+        total += block << bin(high).count('1')
+        subset = 0
+        while True:
+            start = value | subset
+            marks[start:start + block] = '\x01' * block
+            if subset == high:
+                break
+            subset = (subset - high) & high
+    return marks, total
+
+
+def boundary_ranges(bits):
+    top = (1 << bits) - 1
+    ranges = set([(0, 0), (0, top), (top, top), (1, top), (0, top - 1),
+                  (1, top - 1)])
+    for shift in range(bits):
+        power = 1 << shift
+        ranges.update([(power, power), (power - 1, power - 1),
+                       (power, min(top, 2 * power - 1)),
+                       (power - 1, power), (power - 1, top),
+                       (0, power), (power + 1, top)])
+        if power + 1 <= top:
+            ranges.add((power + 1, power + 1))
+    return sorted(ranges)
+
+
+class TestMatchCompiler(unittest.TestCase):
+
+    def _assert_cover(self, port_min, port_max, matches, bits,
+                      overlaps=True):
+        marks, total = covered_ports(matches, bits)
+        # Every port of the range is covered, and no other port.
+        self.assertEqual(port_max - port_min + 1, marks.count('\x01'),
+                         (port_min, port_max, matches))
+        self.assertNotIn('\x00', marks[port_min:port_max + 1],
+                         (port_min, port_max, matches))
+        if not overlaps:
+            self.assertEqual(port_max - port_min + 1, total,
+                             (port_min, port_max, matches))
+
+    def _assert_range(self, port_min, port_max, bits):
+        prefixes = match_compiler.range_to_prefixes(port_min, port_max, bits)
+        self._assert_cover(port_min, port_max, prefixes, bits,
+                           overlaps=False)
+        self.assertTrue(len(prefixes) <= max(1, 2 * bits - 2))
+        ternary = match_compiler.range_to_ternary(port_min, port_max, bits)
+        self._assert_cover(port_min, port_max, ternary, bits)
+        compiled = match_compiler.compile_range(port_min, port_max, bits)
+        self._assert_cover(port_min, port_max, compiled, bits)
+        self.assertEqual(min(len(prefixes), len(ternary)), len(compiled))
+
+    def test_all_ranges_of_narrow_ports(self):
+        bits = 6
+        for port_min in range(1 << bits):
+            for port_max in range(port_min, 1 << bits):
+                self._assert_range(port_min, port_max, bits)
+
+    def test_boundary_ranges(self):
+        for port_min, port_max in boundary_ranges(match_compiler.PORT_BITS):
+            self._assert_range(port_min, port_max, match_compiler.PORT_BITS)
+
+    def test_random_ranges(self):
+        rng = random.Random(25)
+        top = (1 << match_compiler.PORT_BITS) - 1
+        for attempt in range(200):
+            port_min = rng.randint(0, top)
+            if attempt % 2:
+                # Short ranges, as most rules have.
+                port_max = min(top, port_min + rng.randint(0, 1024))
+            else:
+                port_max = rng.randint(port_min, top)
+            self._assert_range(port_min, port_max, match_compiler.PORT_BITS)
+
+    def test_prefixes_of_single_ports_and_blocks(self):
+        full_mask = (1 << match_compiler.PORT_BITS) - 1
+        for port in (0, 1, 1023, 1024, 65535):
+            self.assertEqual([(port, full_mask)],
+                             match_compiler.compile_range(port, port))
+        for shift in range(match_compiler.PORT_BITS + 1):
+            size = 1 << shift
+            self.assertEqual(
+                [(0, full_mask & ~(size - 1))],
+                match_compiler.compile_range(0, size - 1))
+
+    def test_ternary_fewer_than_prefixes(self):
+        # 1-65534 takes 30 prefixes, a ternary cover of its two ends 16.
+        self.assertEqual(30, len(match_compiler.range_to_prefixes(1, 65534)))
+        self.assertTrue(len(match_compiler.compile_range(1, 65534)) < 30)
+
+    def test_compile_rule(self):
+        rule = {'protocol': None, 'source_port': '1024:65535',
+                'destination_port': '80'}
+        matches = match_compiler.compile_rule(rule)
+        self.assertEqual(set([6, 17]),
+                         set(match.protocol for match in matches))
+        self.assertEqual(2 * 6, len(matches))
+        rule = {'protocol': 'tcp', 'source_port': None,
+                'destination_port': '0:65535'}
+        self.assertEqual([match_compiler.PortMatch(6, None, None)],
+                         match_compiler.compile_rule(rule))
+        rule = {'protocol': 'icmp', 'source_port': None,
+                'destination_port': '80'}
+        self.assertEqual([], match_compiler.compile_rule(rule))
+        rule = {'protocol': 'icmp', 'source_port': None,
+                'destination_port': None}
+        self.assertEqual([match_compiler.PortMatch(1, None, None)],
+                         match_compiler.compile_rule(rule))
@@ -0,0 +1,80 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nscs_firewall.crdservice.db import firewall_db
+from nscs_firewall.crdservice.db import migration
+from nscs_firewall.tests import base
+
+
+class TestBackfillRuleMatchValues(base.SqlTestCase):
+
+    def setUp(self):
+        super(TestBackfillRuleMatchValues, self).setUp()
+        self.addCleanup(setattr, migration, 'BACKFILL_BATCH_SIZE',
+                        migration.BACKFILL_BATCH_SIZE)
+        migration.BACKFILL_BATCH_SIZE = 2
+        self.add_policy(self.get_context(), 'policy', 5)
+        self._add_rule('bad-address', source_ip_address='10.0.0.300')
+        self._add_rule('bad-protocol', protocol='bogus')
+        self._add_rule('v6', ip_version=6, source_ip_address='2001:db8::/32')
+        # As left by the release before the match columns.
+        table = firewall_db.FirewallRule.__table__
+        self.engine.execute(table.update().values(
+            dict.fromkeys(migration.INVALID_MATCH_VALUES)))
+
+    def _add_rule(self, rule_id, **kwargs):
+        values = dict(id=rule_id, tenant_id='tenant', protocol='tcp',
+                      ip_version=4, source_ip_address=None,
+                      destination_ip_address=None, action='allow',
+                      enabled=True, shared=False)
+        values.update(kwargs)
+        self.engine.execute(firewall_db.FirewallRule.__table__.insert(),
+                            values)
+
+    def _get_match_values(self, rule_id):
+        table = firewall_db.FirewallRule.__table__
+        row = self.engine.execute(table.select().where(
+            table.c.id == rule_id)).first()
+        return dict((key, row[key]) for key in migration.INVALID_MATCH_VALUES)
+
+    def test_backfill(self):
+        migration.backfill_rule_match_values(self.engine)
+        for rule_id in ['policy-rule-%d' % index for index in range(5)] + [
+                'v6']:
+            fwr = self.plugin.get_firewall_rule(self.get_context(), rule_id)
+            self.assertEqual(firewall_db.get_rule_match_values(fwr),
+                             self._get_match_values(rule_id))
+        for rule_id in ('bad-address', 'bad-protocol'):
+            self.assertEqual(migration.INVALID_MATCH_VALUES,
+                             self._get_match_values(rule_id))
+        # No containment filter matches a rule that could not be parsed.
+        self.assertEqual(
+            ['policy-rule-%d' % index for index in range(5)],
+            sorted(fwr['id'] for fwr in self.plugin.get_firewall_rules(
+                self.get_context(), fields=['id'],
+                filters={'contains_source_ip_address': ['10.0.0.1']})))
+
+    def test_backfill_runs_once(self):
+        migration.backfill_rule_match_values(self.engine)
+        self.reset_statements()
+        migration.backfill_rule_match_values(self.engine)
+        # One lookup per IP version, and nothing is read or written again.
+        self.assertEqual(2, len(self.statements))
+        for statement, parameters in list(self.statements):
+            self.assertTrue(statement.startswith('SELECT'))
+            self.assertEqual([], self.engine.execute(
+                statement, parameters).fetchall())
@@ -0,0 +1,171 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from nscs_firewall.crdservice.db import match_compiler
+from nscs_firewall.crdservice.driver import ofc_notifier
+from nscs_firewall.crdservice.plugins.common import constants as const
+
+
+def make_rule(rule_id, **kwargs):
+    rule = {'id': rule_id, 'enabled': True, 'ip_version': 4,
+            'protocol': 'tcp', 'source_ip_address': None,
+            'destination_ip_address': None, 'source_port': None,
+            'destination_port': None, 'action': 'allow'}
+    rule.update(kwargs)
+    return rule
+
+
+def make_firewall(fw_id, rules, version=1, config_handle_id='handle'):
+    return {'id': fw_id, 'config_handle_id': config_handle_id,
+            'config_version': version, 'firewall_rule_list': rules}
+
+
+class RecordingTransport(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, context, config_handle_id, message):
+        self.messages.append((config_handle_id, message))
+
+
+class TestBuildFlowTable(unittest.TestCase):
+
+    def _flows(self, *rules):
+        return ofc_notifier.build_flow_table(make_firewall('fw', list(rules)))
+
+    def test_rule_order_and_default_entry(self):
+        flows = self._flows(
+            make_rule('web', destination_ip_address='10.0.0.0/24',
+                      destination_port='80'),
+            make_rule('off', enabled=False),
+            make_rule('ssh', action='deny', source_ip_address='10.1.2.3',
+                      destination_port='22'))
+        self.assertEqual([
+            {'priority': 65534, 'action': 'allow', 'firewall_rule_id': 'web',
+             'match': {'eth_type': 0x0800, 'ip_proto': 6,
+                       'ipv4_dst': '10.0.0.0/24', 'tcp_dst': [80, 0xffff]}},
+            {'priority': 65533, 'action': 'deny', 'firewall_rule_id': 'ssh',
+             'match': {'eth_type': 0x0800, 'ip_proto': 6,
+                       'ipv4_src': '10.1.2.3/32', 'tcp_dst': [22, 0xffff]}},
+            {'priority': 0, 'action': const.FWAAS_DENY,
+             'firewall_rule_id': None, 'match': {}}], flows)
+
+    def test_port_range_entries_share_priority(self):
+        flows = self._flows(make_rule('range', protocol='udp',
+                                      destination_port='1000:1999'))
+        entries = flows[:-1]
+        self.assertEqual(
+            [list(match) for match in
+             match_compiler.compile_range(1000, 1999)],
+            [flow['match']['udp_dst'] for flow in entries])
+        self.assertEqual(set([65534]),
+                         set(flow['priority'] for flow in entries))
+
+    def test_ports_without_protocol(self):
+        flows = self._flows(make_rule('any', protocol=None,
+                                      source_port='53'))
+        self.assertEqual([(6, 'tcp_src'), (17, 'udp_src')],
+                         [(flow['match']['ip_proto'],
+                           [key for key in flow['match']
+                            if key.endswith('_src')][0])
+                          for flow in flows[:-1]])
+
+    def test_ipv6_and_portless_protocol(self):
+        flows = self._flows(
+            make_rule('v6', ip_version=6, protocol=None,
+                      source_ip_address='2001:db8::/32'),
+            make_rule('icmp ports', protocol='icmp', destination_port='80'))
+        self.assertEqual({'eth_type': 0x86dd, 'ipv6_src': '2001:db8::/32'},
+                         flows[0]['match'])
+        # ICMP has no ports, the rule matches nothing.
+        self.assertEqual(['v6', None],
+                         [flow['firewall_rule_id'] for flow in flows])
+
+    def test_too_many_rules(self):
+        rules = [make_rule('rule-%d' % index)
+                 for index in range(ofc_notifier.FLOW_PRIORITY_MAX + 1)]
+        self.assertRaises(ValueError, ofc_notifier.build_flow_table,
+                          make_firewall('fw', rules))
+
+
+class TestFlowTableUpdates(unittest.TestCase):
+
+    def setUp(self):
+        super(TestFlowTableUpdates, self).setUp()
+        self.recorder = RecordingTransport()
+        # One firewall per message.
+        self.notifier = ofc_notifier.OFCNotifier(self.recorder, max_flows=3)
+
+    def _update(self, firewalls):
+        del self.recorder.messages[:]
+        self.notifier.update_firewalls(None, firewalls)
+        return list(self.recorder.messages)
+
+    def _firewalls(self, port, version=1):
+        return [make_firewall(fw_id, [make_rule(fw_id + '-rule',
+                                                destination_port=port)],
+                              version)
+                for fw_id in ('fw-1', 'fw-2')]
+
+    def _apply(self, transport, messages):
+        for config_handle_id, message in messages:
+            transport.send(None, config_handle_id, message)
+
+    def test_parts_of_an_update(self):
+        messages = self._update(self._firewalls('80'))
+        self.assertEqual([(0, 2), (1, 2)],
+                         [(message['sequence'], message['total'])
+                          for handle, message in messages])
+        self.assertEqual(1, len(set(message['update_id']
+                                    for handle, message in messages)))
+
+    def test_interleaved_updates_of_one_version(self):
+        first = self._update(self._firewalls('80'))
+        second = self._firewalls('443')
+        second_messages = self._update(second)
+        self.assertNotEqual(first[0][1]['update_id'],
+                            second_messages[0][1]['update_id'])
+        transport = ofc_notifier.LocalTransport()
+        self._apply(transport, [first[0], second_messages[0], first[1],
+                                second_messages[1]])
+        # Each update is applied whole, the last one completed wins.
+        self.assertEqual(
+            dict((fw['id'], ofc_notifier.build_flow_table(fw))
+                 for fw in second),
+            transport.tables)
+        self.assertEqual({'handle': 1}, transport.versions)
+
+    def test_stale_update_dropped(self):
+        newer = self._firewalls('443', version=2)
+        transport = ofc_notifier.LocalTransport()
+        self._apply(transport, self._update(newer))
+        self._apply(transport, self._update(self._firewalls('80')))
+        self.assertEqual(1, transport.stale)
+        self.assertEqual(ofc_notifier.build_flow_table(newer[0]),
+                         transport.tables['fw-1'])
+
+    def test_delete(self):
+        transport = ofc_notifier.LocalTransport()
+        firewalls = self._firewalls('80')
+        self._apply(transport, self._update(firewalls))
+        del self.recorder.messages[:]
+        self.notifier.delete_firewalls(None, firewalls[:1])
+        self._apply(transport, self.recorder.messages)
+        self.assertEqual(['fw-2'], list(transport.tables))
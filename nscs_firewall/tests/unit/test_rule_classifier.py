@@ -0,0 +1,101 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import unittest
+
+from nscs_firewall.crdservice.plugins.common import constants as const
+from nscs_firewall.crdservice.plugins.common import rule_classifier
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+from nscs_firewall.tests import fake_rules
+
+
+def linear_first_match(rules, packet):
+    """The first enabled rule whose traffic holds the packet."""
+    ip_version = packet['ip_version']
+    protocol = rule_optimizer.parse_protocol(packet['protocol'])
+    src = rule_optimizer.parse_address(packet['source_ip_address'],
+                                       ip_version)[0]
+    dst = rule_optimizer.parse_address(packet['destination_ip_address'],
+                                       ip_version)[0]
+    src_port = packet.get('source_port', 0)
+    dst_port = packet.get('destination_port', 0)
+    for rule in rules:
+        if not rule['enabled'] or rule['ip_version'] != ip_version:
+            continue
+        match = rule_optimizer.RuleMatch(rule)
+        if ((match.protocol is None or match.protocol == protocol) and
+                match.src_min <= src <= match.src_max and
+                match.dst_min <= dst <= match.dst_max and
+                match.src_port_min <= src_port <= match.src_port_max and
+                match.dst_port_min <= dst_port <= match.dst_port_max):
+            return rule
+    return None
+
+
+class TestRuleClassifier(unittest.TestCase):
+
+    def _make_rules(self, count, seed):
+        rules = fake_rules.make_rules(count, seed)
+        rng = random.Random(seed)
+        for rule in rules:
+            if rng.random() < 0.1:
+                rule['source_port'] = rng.choice(['53', '1024:65535'])
+        return rules
+
+    def _assert_agrees(self, rules, packets):
+        classifier = rule_classifier.RuleClassifier(rules)
+        for packet in packets:
+            expected = linear_first_match(rules, packet)
+            self.assertEqual(expected, classifier.classify(packet), packet)
+            result = classifier.evaluate(packet)
+            if expected is None:
+                self.assertEqual({'firewall_rule_id': None,
+                                  'position': None,
+                                  'action': const.FWAAS_DENY}, result)
+            else:
+                self.assertEqual({'firewall_rule_id': expected['id'],
+                                  'position': expected['position'],
+                                  'action': expected['action']}, result)
+
+    def test_agrees_with_linear_scan(self):
+        for seed in range(5):
+            rules = self._make_rules(300, seed)
+            rng = random.Random(seed)
+            self._assert_agrees(rules, [fake_rules.make_packet(rules, rng)
+                                        for index in range(1000)])
+
+    def test_overlapping_rules_first_wins(self):
+        # Every rule matches the packet, the classifier must take the first
+        # whatever group it falls in.
+        rules = fake_rules.make_rules(4)
+        networks = ['10.1.2.3', '10.0.0.0/8', None, '10.1.0.0/16']
+        for rule, network in zip(rules, networks):
+            rule.update(ip_version=4, protocol=None, enabled=True,
+                        source_ip_address=network,
+                        destination_ip_address=None, destination_port=None)
+        packet = {'ip_version': 4, 'protocol': 'udp',
+                  'source_ip_address': '10.1.2.3',
+                  'destination_ip_address': '192.0.2.1',
+                  'source_port': 5, 'destination_port': 6}
+        for start in range(len(rules)):
+            self._assert_agrees(rules[start:], [packet])
+
+    def test_no_rules(self):
+        rng = random.Random(1)
+        self._assert_agrees([], [fake_rules.make_packet([], rng)
+                                 for index in range(10)])
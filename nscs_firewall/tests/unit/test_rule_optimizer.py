@@ -0,0 +1,140 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 Freescale Semiconductor, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import unittest
+
+from nscs_firewall.crdservice.plugins.common import rule_classifier
+from nscs_firewall.crdservice.plugins.common import rule_optimizer
+from nscs_firewall.tests import fake_rules
+
+
+def make_rule(rule_id, action='allow', **kwargs):
+    rule = {'id': rule_id,
+            'protocol': 'tcp',
+            'ip_version': 4,
+            'source_ip_address': None,
+            'destination_ip_address': None,
+            'source_port': None,
+            'destination_port': None,
+            'action': action,
+            'enabled': True}
+    rule.update(kwargs)
+    return rule
+
+
+class TestOptimizeRules(unittest.TestCase):
+
+    def _optimize(self, rules):
+        kept, annotations = rule_optimizer.optimize_rules(rules)
+        return ([rule['id'] for rule in kept],
+                dict((annotation['firewall_rule_id'], annotation)
+                     for annotation in annotations))
+
+    def test_disabled(self):
+        kept, annotations = self._optimize([
+            make_rule('a', destination_port='80'),
+            make_rule('b', destination_port='443', enabled=False)])
+        self.assertEqual(['a'], kept)
+        self.assertEqual({'b': {'firewall_rule_id': 'b',
+                                'reason': rule_optimizer.RULE_DISABLED}},
+                         annotations)
+
+    def test_shadowed(self):
+        kept, annotations = self._optimize([
+            make_rule('a', source_ip_address='10.0.0.0/8'),
+            make_rule('b', source_ip_address='10.1.0.0/16',
+                      destination_port='80'),
+            make_rule('c', action='deny', source_ip_address='10.1.2.3'),
+            make_rule('d', action='deny', destination_port='22')])
+        self.assertEqual(['a', 'd'], kept)
+        self.assertEqual({'firewall_rule_id': 'b',
+                          'reason': rule_optimizer.RULE_SHADOWED,
+                          'by_firewall_rule_id': 'a',
+                          'conflict': False}, annotations['b'])
+        self.assertEqual({'firewall_rule_id': 'c',
+                          'reason': rule_optimizer.RULE_SHADOWED,
+                          'by_firewall_rule_id': 'a',
+                          'conflict': True}, annotations['c'])
+
+    def test_any_protocol_shadows(self):
+        kept, annotations = self._optimize([
+            make_rule('a', protocol=None, destination_ip_address='1.2.3.4'),
+            make_rule('b', destination_ip_address='1.2.3.4',
+                      destination_port='80'),
+            make_rule('c', protocol=None, destination_ip_address='1.2.3.4',
+                      action='deny')])
+        self.assertEqual(['a'], kept)
+        self.assertEqual(rule_optimizer.RULE_SHADOWED,
+                         annotations['b']['reason'])
+        self.assertEqual(rule_optimizer.RULE_SHADOWED,
+                         annotations['c']['reason'])
+
+    def test_other_ip_version_not_shadowed(self):
+        kept, annotations = self._optimize([
+            make_rule('a', action='deny'),
+            make_rule('b', ip_version=6)])
+        self.assertEqual(['a', 'b'], kept)
+        self.assertEqual({}, annotations)
+
+    def test_redundant(self):
+        kept, annotations = self._optimize([
+            make_rule('a', destination_port='80'),
+            make_rule('b', action='deny', destination_port='22'),
+            make_rule('c', destination_port='1:1024')])
+        self.assertEqual(['b', 'c'], kept)
+        self.assertEqual({'a': {'firewall_rule_id': 'a',
+                                'reason': rule_optimizer.RULE_REDUNDANT,
+                                'by_firewall_rule_id': 'c',
+                                'conflict': False}}, annotations)
+
+    def test_redundant_blocked_by_other_action(self):
+        # The deny in between overlaps rule a, dropping a would let the deny
+        # take port 80 traffic from 10.1.0.0/16.
+        kept, annotations = self._optimize([
+            make_rule('a', destination_port='80'),
+            make_rule('b', action='deny', source_ip_address='10.1.0.0/16'),
+            make_rule('c', destination_port='1:1024')])
+        self.assertEqual(['a', 'b', 'c'], kept)
+        self.assertEqual({}, annotations)
+
+    def test_partial_overlap_kept(self):
+        kept, annotations = self._optimize([
+            make_rule('a', destination_port='1:1000'),
+            make_rule('b', action='deny', destination_port='500:2000'),
+            make_rule('c', destination_port='900:3000')])
+        self.assertEqual(['a', 'b', 'c'], kept)
+        self.assertEqual({}, annotations)
+
+    def test_no_rules(self):
+        self.assertEqual(([], []), rule_optimizer.optimize_rules([]))
+
+    def test_same_outcome(self):
+        # Whatever is dropped, every packet gets the action it got from the
+        # full rule list.
+        for seed in range(5):
+            rules = fake_rules.make_rules(200, seed)
+            kept, annotations = rule_optimizer.optimize_rules(rules)
+            self.assertEqual(len(rules), len(kept) + len(annotations))
+            full = rule_classifier.RuleClassifier(rules)
+            optimized = rule_classifier.RuleClassifier(kept)
+            rng = random.Random(seed)
+            for index in range(1000):
+                packet = fake_rules.make_packet(rules, rng)
+                self.assertEqual(full.evaluate(packet)['action'],
+                                 optimized.evaluate(packet)['action'],
+                                 packet)